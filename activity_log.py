@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+import atexit
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from datetime import datetime
+
+
+_second_cache = (None, "")
+
+
+def _format_second(ts):
+    # 同じ秒のレコードが続くことが多いので、直前の秒の文字列を使い回す
+    global _second_cache
+    second = int(ts)
+    cached_second, text = _second_cache
+    if cached_second != second:
+        text = datetime.fromtimestamp(second).strftime("%Y-%m-%d %H:%M:%S")
+        _second_cache = (second, text)
+    return text
+
+
+def format_text(record):
+    """従来どおりの人が読める形式: [YYYY-mm-dd HH:MM:SS] メッセージ (Progress: N%)"""
+    timestamp = _format_second(record["ts"])
+    line = f"[{timestamp}] {record['message']}"
+    if record["progress"] is not None:
+        line += f" (Progress: {record['progress']}%)"
+    return line
+
+
+def format_jsonl(record):
+    """1行1レコードのJSON（timestamp, worker, task_id, progress, event, message）"""
+    return json.dumps({
+        "timestamp": datetime.fromtimestamp(record["ts"]).isoformat(timespec="milliseconds"),
+        "worker": record["worker"],
+        "task_id": record["task_id"],
+        "progress": record["progress"],
+        "event": record["event"],
+        "message": record["message"],
+    }, ensure_ascii=False)
+
+
+# 出力形式 → (整形関数, ファイルの拡張子)
+LOG_FORMATS = {
+    "text": (format_text, ".txt"),
+    "jsonl": (format_jsonl, ".jsonl"),
+}
+
+
+class _RotatingFile:
+    """サイズ上限で path → path.1 → path.2 ... とローテートする追記ファイル"""
+    
+    def __init__(self, path, max_bytes, backup_count):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self._file = None
+    
+    def _open(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(self.path, 'ab')
+    
+    def write(self, data):
+        if self._file is None:
+            self._open()
+        else:
+            # 別プロセスがローテートしていたら開き直す
+            try:
+                if os.stat(self.path).st_ino != os.fstat(self._file.fileno()).st_ino:
+                    self._file.close()
+                    self._open()
+            except FileNotFoundError:
+                self._file.close()
+                self._open()
+        
+        size = os.fstat(self._file.fileno()).st_size
+        if self.max_bytes and size and size + len(data) > self.max_bytes:
+            self.rotate()
+        # O_APPEND の1回の write なので、複数プロセスが書いても行は混ざらない
+        self._file.write(data)
+        self._file.flush()
+    
+    def rotate(self):
+        self._file.close()
+        for i in range(self.backup_count - 1, 0, -1):
+            source = f"{self.path}.{i}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{i + 1}")
+        if self.backup_count > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self._open()
+    
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class ActivityLogger:
+    """log_activity のバッファ付きバックエンド
+    
+    呼び出し側はレコードをキューに積むだけで、専用スレッドが溜まった分を
+    まとめて整形し、形式ごとのファイルと標準出力にそれぞれ1回の write で書き出す。
+    キューが max_queue を超えると呼び出し側は空くまで待つ（メモリを際限なく使わない）。
+    """
+    
+    def __init__(self, base_path, worker, formats=("text",), echo_prefix=None, batch_size=256,
+                 max_bytes=10 * 1024 * 1024, backup_count=5, max_queue=10000):
+        unknown = [fmt for fmt in formats if fmt not in LOG_FORMATS]
+        if unknown:
+            raise ValueError(f"Unknown log format: {', '.join(unknown)}")
+        
+        self.worker = worker
+        self.echo_prefix = echo_prefix
+        self.batch_size = batch_size
+        self.sinks = [(LOG_FORMATS[fmt][0],
+                       _RotatingFile(base_path + LOG_FORMATS[fmt][1], max_bytes, backup_count))
+                      for fmt in formats]
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = threading.Thread(target=self._run, name=f"{worker}-log-writer", daemon=True)
+        self._thread.start()
+    
+    def log(self, message, progress=None, event="activity", task_id=None):
+        self._queue.put({
+            "ts": time.time(),
+            "worker": self.worker,
+            "task_id": task_id,
+            "progress": progress,
+            "event": event,
+            "message": message,
+        })
+    
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            
+            records = [record for record in batch if record is not None]
+            try:
+                if records:
+                    self._write(records)
+            except Exception as e:
+                print(f"[{self.worker}] Failed to write log: {e}", file=sys.stderr)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+            if len(records) < len(batch):
+                return
+    
+    def _write(self, records):
+        for formatter, sink in self.sinks:
+            sink.write("".join(formatter(record) + "\n" for record in records).encode("utf-8"))
+        if self.echo_prefix is not None:
+            sys.stdout.write("".join(f"[{self.echo_prefix}] {format_text(record)}\n"
+                                     for record in records))
+            sys.stdout.flush()
+    
+    def flush(self):
+        """キューに積まれた分が書き出されるまで待つ"""
+        if self._thread.is_alive():
+            self._queue.join()
+    
+    def close(self):
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        for _, sink in self.sinks:
+            sink.close()
+
+
+_loggers = {}
+_loggers_lock = threading.Lock()
+
+
+def get_activity_logger(base_path, worker, **options):
+    """プロセス内で base_path ごとに1つのロガーを共有する（プロセスプールの子でも書き込みスレッドは1本）"""
+    with _loggers_lock:
+        logger = _loggers.get(base_path)
+        if logger is None:
+            logger = ActivityLogger(base_path, worker, **options)
+            _loggers[base_path] = logger
+        return logger
+
+
+def _reset_after_fork():
+    # fork した子プロセスには書き込みスレッドが引き継がれないので作り直させる
+    global _loggers_lock
+    _loggers.clear()
+    _loggers_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+@atexit.register
+def _close_all():
+    with _loggers_lock:
+        loggers = list(_loggers.values())
+        _loggers.clear()
+    for logger in loggers:
+        logger.close()
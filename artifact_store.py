@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+import fcntl
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+import zlib
+from collections import Counter
+from contextlib import contextmanager
+
+ARTIFACT_ROOT = "artifacts"
+CHUNK_SIZE = 256 * 1024
+COMPRESS_LEVEL = 6
+# 参照されなくなったチャンク・マニフェストでも、これより新しいものは書き込み中のワーカーが使っている可能性があるので残す
+GC_GRACE = 3600
+
+
+class ArtifactReader(io.RawIOBase):
+    """成果物をチャンク単位で展開しながら読む（メモリに載るのは1チャンク分だけ）"""
+    
+    def __init__(self, store, manifest):
+        super().__init__()
+        self.store = store
+        self.chunks = manifest["chunks"]
+        self.size = manifest["size"]
+        self._next = 0
+        self._buffer = b""
+        self._pos = 0
+    
+    def readable(self):
+        return True
+    
+    def readinto(self, b):
+        while self._pos >= len(self._buffer):
+            if self._next >= len(self.chunks):
+                return 0
+            digest, _ = self.chunks[self._next]
+            self._buffer = self.store.read_chunk(digest)
+            self._pos = 0
+            self._next += 1
+        n = min(len(b), len(self._buffer) - self._pos)
+        b[:n] = self._buffer[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+
+class ArtifactStore:
+    """タスクの出力を内容アドレスで保存する（チャンク単位で重複排除し zlib で圧縮）
+    
+    chunks/<hh>/<sha256>   チャンク（CHUNK_SIZE ごと、圧縮済み）
+    objects/<hh>/<sha256>  成果物全体のハッシュ → チャンクの並びとサイズ
+    index.jsonl            タスクID → 成果物（名前・サイズ・ハッシュ・終了コード）の追記専用の索引
+    index.lock             索引の追記（共有ロック）と GC による書き直し（排他ロック）の flock
+    
+    同じ内容のチャンクは一度しか書かないため、繰り返し同じ出力を出すタスクはほとんど容量を使わない。
+    書き込みは一時ファイルからの rename で行い、複数のワーカーが同時に同じチャンクを書いても壊れない。
+    古い成果物は collect_garbage（Manager が定期的に実行）で索引から外し、参照されなくなったファイルを消す。
+    """
+    
+    def __init__(self, root=ARTIFACT_ROOT, chunk_size=CHUNK_SIZE, level=COMPRESS_LEVEL):
+        self.root = root
+        self.chunk_size = chunk_size
+        self.level = level
+        self.index_path = os.path.join(root, "index.jsonl")
+        self.lock_path = os.path.join(root, "index.lock")
+        os.makedirs(os.path.join(root, "chunks"), exist_ok=True)
+        os.makedirs(os.path.join(root, "objects"), exist_ok=True)
+        
+        # 索引の読み込み位置（読み手は前回からの追記分だけを読む。GC で書き直されたら最初から読む）
+        self._entries = {}
+        self._offset = 0
+        self._inode = None
+        self._totals = {"artifacts": 0, "bytes": 0, "stored_bytes": 0}
+        self._lock = threading.Lock()
+    
+    def _path(self, kind, digest):
+        return os.path.join(self.root, kind, digest[:2], digest)
+    
+    def _write_atomic(self, path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    
+    @contextmanager
+    def _index_lock(self, mode):
+        """索引のプロセス間ロック（追記は LOCK_SH、書き直しは LOCK_EX）"""
+        with open(self.lock_path, 'a') as lock:
+            fcntl.flock(lock, mode)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+    
+    def _reuse(self, path):
+        """既存のファイルを再利用するなら mtime を更新する（索引に載る前に GC で消されないように）"""
+        try:
+            os.utime(path)
+            return True
+        except FileNotFoundError:
+            return False
+    
+    # ---- 書き込み ----
+    
+    def put_file(self, path):
+        """ファイルを保存し (ハッシュ, サイズ, 新たに書いたバイト数) を返す（ファイル全体は読み込まない）"""
+        whole = hashlib.sha256()
+        chunks = []
+        size = 0
+        stored = 0
+        with open(path, 'rb') as f:
+            while True:
+                data = f.read(self.chunk_size)
+                if not data:
+                    break
+                whole.update(data)
+                size += len(data)
+                digest = hashlib.sha256(data).hexdigest()
+                chunks.append([digest, len(data)])
+                chunk_path = self._path("chunks", digest)
+                if not self._reuse(chunk_path):
+                    compressed = zlib.compress(data, self.level)
+                    self._write_atomic(chunk_path, compressed)
+                    stored += len(compressed)
+        
+        digest = whole.hexdigest()
+        object_path = self._path("objects", digest)
+        if not self._reuse(object_path):
+            manifest = json.dumps({"size": size, "chunks": chunks}).encode("utf-8")
+            self._write_atomic(object_path, manifest)
+            stored += len(manifest)
+        return digest, size, stored
+    
+    def store_output(self, task_id, name, worker, path, exit_code=None, artifact="output"):
+        """タスクの出力ファイルを保存し、索引に記録したエントリを返す"""
+        digest, size, stored = self.put_file(path)
+        entry = {
+            "task_id": task_id,
+            "name": name,
+            "worker": worker,
+            "artifact": artifact,
+            "hash": digest,
+            "size": size,
+            "stored_bytes": stored,
+            "exit_code": exit_code,
+            "created_at": time.time(),
+        }
+        # 1行を1回の write で追記する（O_APPEND なので複数のワーカーが書いても行は混ざらない）
+        line = (json.dumps(entry, ensure_ascii=False) + "\n").encode("utf-8")
+        with self._index_lock(fcntl.LOCK_SH):
+            fd = os.open(self.index_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, line)
+            finally:
+                os.close(fd)
+        return entry
+    
+    # ---- 読み出し ----
+    
+    def read_chunk(self, digest):
+        with open(self._path("chunks", digest), 'rb') as f:
+            data = zlib.decompress(f.read())
+        if hashlib.sha256(data).hexdigest() != digest:
+            raise ValueError(f"Corrupted artifact chunk: {digest}")
+        return data
+    
+    def manifest(self, digest):
+        with open(self._path("objects", digest), 'r') as f:
+            return json.load(f)
+    
+    def open(self, digest):
+        """成果物をバイナリのストリームとして開く（チャンクごとに展開する）"""
+        return io.BufferedReader(ArtifactReader(self, self.manifest(digest)), self.chunk_size)
+    
+    def open_task(self, task_id, artifact="output"):
+        """タスクIDの成果物を開く（なければ None）"""
+        entry = self.lookup(task_id, artifact)
+        return self.open(entry["hash"]) if entry is not None else None
+    
+    # ---- 索引 ----
+    
+    def refresh(self):
+        """前回から追記された索引の行を取り込む（書きかけの最終行は次回に回す）"""
+        with self._lock:
+            try:
+                with open(self.index_path, 'rb') as f:
+                    inode = os.fstat(f.fileno()).st_ino
+                    if inode != self._inode:
+                        self._reset_locked()
+                        self._inode = inode
+                    f.seek(self._offset)
+                    data = f.read()
+            except FileNotFoundError:
+                return
+            end = data.rfind(b"\n") + 1
+            for line in data[:end].splitlines():
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                entries = self._entries.setdefault(entry["task_id"], {})
+                if entry["artifact"] not in entries:
+                    self._totals["artifacts"] += 1
+                    self._totals["bytes"] += entry["size"]
+                self._totals["stored_bytes"] += entry.get("stored_bytes", 0)
+                entries[entry["artifact"]] = entry
+            self._offset += end
+    
+    def _reset_locked(self):
+        self._entries = {}
+        self._offset = 0
+        self._inode = None
+        self._totals = {"artifacts": 0, "bytes": 0, "stored_bytes": 0}
+    
+    def lookup(self, task_id, artifact="output"):
+        """タスクIDの成果物のエントリ（サイズ・ハッシュ・終了コードなど）。なければ None"""
+        self.refresh()
+        return self._entries.get(task_id, {}).get(artifact)
+    
+    def summary(self):
+        """索引に載っている成果物の件数・元のサイズ・実際に書いたサイズ"""
+        self.refresh()
+        with self._lock:
+            return dict(self._totals)
+    
+    
+    # ---- GC ----
+    
+    def _files(self):
+        """チャンク・マニフェスト・書きかけの一時ファイルを {パス: (種類, ハッシュ, サイズ, mtime)} で返す"""
+        files = {}
+        for kind in ("chunks", "objects"):
+            for prefix in os.scandir(os.path.join(self.root, kind)):
+                if not prefix.is_dir():
+                    continue
+                for entry in os.scandir(prefix.path):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    digest = None if entry.name.endswith(".tmp") else entry.name
+                    files[entry.path] = (kind, digest, stat.st_size, stat.st_mtime)
+        return files
+    
+    def _chunk_digests(self, digest):
+        try:
+            return {chunk for chunk, _ in self.manifest(digest)["chunks"]}
+        except (OSError, ValueError, KeyError):
+            return set()
+    
+    def collect_garbage(self, max_bytes=None, ttl=None, grace=GC_GRACE):
+        """保持期間・容量の上限を超えた成果物を索引から外し、参照されなくなったファイルを消す
+        
+        ttl 秒より前に作られたエントリを外し、残りが参照するチャンク・マニフェストの合計が
+        max_bytes を超えていれば古い順にさらに外す。索引は残すエントリ（と走査中に追記された行）だけに
+        書き直し、どのエントリからも参照されず grace 秒以上使われていないファイルを削除する。
+        GC を行うのは1プロセス（Manager）だけとする。(索引から除いた行数, 削除したバイト数) を返す。
+        """
+        now = time.time()
+        self.refresh()
+        with self._lock:
+            entries = sorted((entry for by_artifact in self._entries.values() for entry in by_artifact.values()),
+                             key=lambda entry: entry["created_at"])
+            offset, inode = self._offset, self._inode
+        if inode is None:
+            return 0, 0
+        
+        kept = [entry for entry in entries if ttl is None or entry["created_at"] >= now - ttl]
+        object_refs = Counter(entry["hash"] for entry in kept)
+        chunks_of = {digest: self._chunk_digests(digest) for digest in object_refs}
+        chunk_refs = Counter(chunk for chunks in chunks_of.values() for chunk in chunks)
+        files = self._files()
+        
+        if max_bytes is not None:
+            sizes = {(kind, digest): size for kind, digest, size, _ in files.values()}
+            total = sum(sizes.get(("objects", digest), 0) for digest in object_refs) + \
+                sum(sizes.get(("chunks", chunk), 0) for chunk in chunk_refs)
+            oldest = 0
+            while oldest < len(kept) and total > max_bytes:
+                digest = kept[oldest]["hash"]
+                oldest += 1
+                object_refs[digest] -= 1
+                if object_refs[digest]:
+                    continue
+                del object_refs[digest]
+                total -= sizes.get(("objects", digest), 0)
+                for chunk in chunks_of[digest]:
+                    chunk_refs[chunk] -= 1
+                    if not chunk_refs[chunk]:
+                        del chunk_refs[chunk]
+                        total -= sizes.get(("chunks", chunk), 0)
+            kept = kept[oldest:]
+        
+        # 最新でない（同じタスクIDで上書きされた）行も含め、残さない行を索引から除く
+        keep = {(entry["task_id"], entry["artifact"], entry["created_at"]) for entry in kept}
+        with self._index_lock(fcntl.LOCK_EX):
+            with open(self.index_path, 'rb') as f:
+                if os.fstat(f.fileno()).st_ino != inode:
+                    return 0, 0
+                data = f.read()
+            lines = []
+            dropped = 0
+            for line in data[:offset].splitlines(keepends=True):
+                try:
+                    entry = json.loads(line)
+                    key = (entry["task_id"], entry["artifact"], entry["created_at"])
+                except (ValueError, KeyError):
+                    continue
+                if key in keep:
+                    lines.append(line)
+                else:
+                    dropped += 1
+            if dropped:
+                self._write_atomic(self.index_path, b"".join(lines) + data[offset:])
+        
+        freed = 0
+        refs = {"objects": object_refs, "chunks": chunk_refs}
+        for path, (kind, digest, size, mtime) in files.items():
+            if digest in refs[kind] or mtime >= now - grace:
+                continue
+            try:
+                # 走査後にワーカーが再利用した（mtime を更新した）ファイルは残す
+                if os.stat(path).st_mtime >= now - grace:
+                    continue
+                os.unlink(path)
+                freed += size
+            except FileNotFoundError:
+                continue
+        
+        # 書き直した索引は inode が変わるので最初から読み直される
+        self.refresh()
+        with self._lock:
+            # 削除後の実際の使用量に合わせる（以降の追記分はエントリの stored_bytes で加算する）
+            self._totals["stored_bytes"] = sum(size for _, _, size, _ in files.values()) - freed
+        return dropped, freed
@@ -0,0 +1,420 @@
+#!/usr/bin/env python3
+import asyncio
+import itertools
+import os
+import signal
+import subprocess
+import sys
+import time
+
+from task_limits import LimitGate, TaskLimits, kill_process_group
+
+RUNTIMES = ("sync", "async")
+
+
+async def run_subprocess(args, cwd=None, shell=False, limits=None, on_start=None, env=None):
+    """子プロセスをイベントループ上で実行し、subprocess.CompletedProcess を返す
+    
+    子プロセスは新しいセッションで起動し、limits.timeout を過ぎたらプロセスグループごと kill する
+    （結果の timed_out が True になる）。on_start には子プロセスの pid を渡す。
+    キャンセルされた場合も kill してから CancelledError を送出する。
+    """
+    gate = LimitGate(limits, args, shell, stdin=subprocess.DEVNULL)
+    options = dict(cwd=cwd, env=env, stdin=gate.stdin, stdout=subprocess.PIPE,
+                   stderr=subprocess.PIPE, start_new_session=True)
+    try:
+        if gate.shell:
+            process = await asyncio.create_subprocess_shell(gate.args, **options)
+        else:
+            process = await asyncio.create_subprocess_exec(*gate.args, **options)
+    except BaseException:
+        gate.release(None)
+        raise
+    gate.release(process.pid)
+    if on_start is not None:
+        on_start(process.pid)
+    communicate = asyncio.ensure_future(process.communicate())
+    timed_out = False
+    try:
+        done, _ = await asyncio.wait({communicate}, timeout=limits.timeout if limits else None)
+        if not done:
+            # kill 後もパイプが閉じるまでの出力は結果に残す
+            kill_process_group(process.pid)
+            timed_out = True
+        stdout, stderr = await communicate
+    except asyncio.CancelledError:
+        if process.returncode is None:
+            kill_process_group(process.pid)
+        communicate.cancel()
+        await process.wait()
+        raise
+    result = subprocess.CompletedProcess(args, process.returncode,
+                                         stdout.decode("utf-8", errors="replace"),
+                                         stderr.decode("utf-8", errors="replace"))
+    result.timed_out = timed_out
+    return result
+
+
+async def every(interval, callback, on_error=None):
+    """callback を直ちに1回、その後 interval 秒ごとに呼ぶ"""
+    while True:
+        try:
+            callback()
+        except Exception as e:
+            if on_error is not None:
+                on_error(e)
+        await asyncio.sleep(interval)
+
+
+class _Runtime:
+    """メッセージの受信とシグナルによる停止をイベントループに載せる共通部分"""
+    
+    message_check_interval = 20  # プッシュが届かなくてもこの秒数ごとにメッセージチェック
+    
+    def __init__(self, owner):
+        self.owner = owner
+        self.comm = owner.comm
+        self.loop = None
+        self.messages_ready = None
+        self.stopped = None
+        self._readers = []
+        self._signals = []
+        self._background = []
+    
+    def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.messages_ready = asyncio.Event()
+        self.stopped = asyncio.Event()
+        fd = self.comm.transport.fileno()
+        if fd is not None:
+            # プッシュが届くとパイプが読み込み可能になる
+            self.add_reader(fd, self.messages_ready.set)
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            try:
+                self.loop.add_signal_handler(signum, self.request_stop)
+                self._signals.append(signum)
+            except (NotImplementedError, RuntimeError, ValueError):
+                pass
+    
+    def add_reader(self, fd, callback):
+        self.loop.add_reader(fd, callback)
+        self._readers.append(fd)
+    
+    def spawn(self, coroutine):
+        task = self.loop.create_task(coroutine)
+        self._background.append(task)
+        return task
+    
+    def log_error(self, error):
+        self.comm.log_activity(f"Error in event loop: {error}")
+    
+    def request_stop(self):
+        self.owner.running = False
+        self.notify_stopped()
+    
+    def notify_stopped(self):
+        self.stopped.set()
+    
+    async def message_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.messages_ready.wait(), self.message_check_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.messages_ready.clear()
+            try:
+                self.owner.check_messages()
+            except Exception as e:
+                self.log_error(e)
+            if not self.owner.running:
+                self.notify_stopped()
+    
+    async def close(self):
+        for task in self._background:
+            task.cancel()
+        await asyncio.gather(*self._background, return_exceptions=True)
+        self._background = []
+        for fd in self._readers:
+            self.loop.remove_reader(fd)
+        self._readers = []
+        for signum in self._signals:
+            self.loop.remove_signal_handler(signum)
+        self._signals = []
+
+
+class AsyncWorkerRuntime(_Runtime):
+    """WorkerSessionAutomation を1つのイベントループで動かす
+    
+    メッセージ処理・タスクの取得と投入・定期処理を並行に進め、command / script は
+    asyncio の子プロセスとして実行する（最大 max_parallel_tasks 件）。
+    出力のストリーミング・インタプリタプール・結果キャッシュを使うタスクはスレッドで実行する。
+    タスクの実行中も停止・状況確認のメッセージにすぐ応答できる。
+    """
+    
+    task_check_interval = 30   # 監視イベントがなくてもこの秒数ごとにタスクチェック
+    metrics_interval = 15      # メトリクスファイルの更新間隔
+    
+    def __init__(self, worker):
+        super().__init__(worker)
+        self.worker = worker
+        self.wakeup = None
+        self.tasks = set()
+        self._script_ids = itertools.count(1)
+        self._interrupts = 0
+    
+    async def run(self):
+        worker = self.worker
+        self.start()
+        self.wakeup = asyncio.Event()
+        worker.tasks_available = self.wakeup.set
+        
+        watcher = worker.watcher
+        if watcher is not None and watcher.fileno() is not None:
+            self.add_reader(watcher.fileno(), self.on_watch_event)
+        elif watcher is not None:
+            self.spawn(self.poll_watcher(watcher))
+        self.spawn(self.message_loop())
+        self.spawn(every(self.task_check_interval, worker.check_pending_tasks, self.log_error))
+        if worker.metrics_file is not None:
+            self.spawn(every(self.metrics_interval, worker.write_metrics, self.log_error))
+        
+        worker.comm.log_activity(
+            f"Worker {worker.worker_name} is now running on an asyncio event loop "
+            f"(up to {worker.max_parallel_tasks} concurrent tasks)")
+        try:
+            await self.dispatch_loop()
+            if self.tasks:
+                worker.comm.log_activity(f"Waiting for {len(self.tasks)} running tasks to finish")
+                await asyncio.gather(*self.tasks, return_exceptions=True)
+        finally:
+            worker.tasks_available = None
+            await self.close()
+    
+    def request_stop(self):
+        # 1回目は実行中のタスクの終了を待ち、2回目で実行中のタスクも打ち切る
+        self._interrupts += 1
+        if self._interrupts > 1:
+            for task in self.tasks:
+                task.cancel()
+        super().request_stop()
+    
+    def notify_stopped(self):
+        super().notify_stopped()
+        self.wakeup.set()
+    
+    # ---- 監視イベント ----
+    
+    def handle_changes(self, changed):
+        if "messages" in changed:
+            self.messages_ready.set()
+        if "tasks" in changed:
+            self.worker.enqueue_pending(self.worker.task_files_from_event(changed["tasks"]))
+            self.wakeup.set()
+    
+    def on_watch_event(self):
+        self.handle_changes(self.worker.watcher.wait(0))
+    
+    async def poll_watcher(self, watcher):
+        """ポーリング監視: 変化がない間は間隔を伸ばす"""
+        interval = watcher.min_interval
+        while True:
+            await asyncio.sleep(interval)
+            changed = watcher.wait(0)
+            self.handle_changes(changed)
+            interval = watcher.min_interval if changed else min(interval * 2, watcher.max_interval)
+    
+    # ---- タスクの投入 ----
+    
+    async def dispatch_loop(self):
+        while self.worker.running:
+            self.fill_slots()
+            await self.wakeup.wait()
+            self.wakeup.clear()
+    
+    def fill_slots(self):
+        """空きスロットの分だけ優先度順にタスクを開始"""
+        worker = self.worker
+        while worker.running and len(self.tasks) < worker.max_parallel_tasks:
+            task_file = worker.next_pending_task()
+            if task_file is None:
+                # ワークスティーリング時は奪える仕事がなくなるまで続ける
+                if worker.steal and worker.enqueue_pending(worker.find_task_files()):
+                    continue
+                return
+            with worker._task_lock:
+                if task_file.name in worker.in_flight:
+                    continue
+                worker.in_flight.add(task_file.name)
+            
+            claimed = worker.claim_task(task_file)
+            if claimed is None:
+                # 他のワーカーが先に取得した
+                with worker._task_lock:
+                    worker.in_flight.discard(task_file.name)
+                continue
+            claimed_at = time.time()
+            if worker.heartbeat is not None:
+                worker.heartbeat.task_started(claimed.name)
+            task = self.loop.create_task(self.run_task(task_file.name, claimed, claimed_at))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+    
+    async def run_task(self, name, task_file, claimed_at):
+        worker = self.worker
+        outcome = {"success": False, "task_type": None, "timings": {"claimed_at": claimed_at}}
+        try:
+            outcome = await self.process_task(task_file, claimed_at)
+        finally:
+            with worker._task_lock:
+                worker.in_flight.discard(name)
+            worker.record_task_outcome(outcome)
+            self.wakeup.set()
+    
+    async def process_task(self, task_file, claimed_at):
+        """WorkerSessionAutomation.process_task と同じ手順で、各段階を await する
+        
+        開始・完了・エラーの処理（報告の送信、ジャーナルの fsync 待ち、成果物の圧縮、キャッシュの
+        書き込み）もブロックするので、実行部分と同じくスレッドで動かしてイベントループを塞がない。
+        """
+        worker = self.worker
+        outcome = {"success": False, "task_type": None, "timings": {"claimed_at": claimed_at}}
+        # asyncio のタスクごとにコンテキストが分かれるので、並行するタスクのIDは混ざらない
+        # （to_thread もコンテキストを引き継ぐ）
+        worker.comm.set_current_task(task_file.stem)
+        try:
+            task_data = await asyncio.to_thread(worker.begin_task, task_file, outcome)
+            result = await self.execute_task(task_data)
+            outcome["exit_code"] = getattr(result, "returncode", None)
+            if getattr(result, "array", None) is not None:
+                outcome["array"] = result.array
+            await asyncio.to_thread(worker.finish_task, task_file, task_data, outcome)
+        except asyncio.CancelledError:
+            await asyncio.to_thread(worker.fail_task, task_file, "cancelled by worker shutdown")
+            raise
+        except Exception as e:
+            await asyncio.to_thread(worker.fail_task, task_file, e)
+        finally:
+            worker.comm.set_current_task(None)
+        return outcome
+    
+    # ---- 実行 ----
+    
+    async def execute_task(self, task_data):
+        worker = self.worker
+        if 'array' in task_data:
+            # 配列タスクはバッチごとに1つの子プロセスで実行する（スレッドで待つ）
+            return await asyncio.to_thread(worker.execute_task, task_data)
+        cached = worker.result_cache is not None and worker.result_cache.is_cacheable(task_data)
+        if cached or worker.stream_output or (worker.script_pool is not None and 'script' in task_data):
+            return await asyncio.to_thread(worker.execute_task, task_data)
+        if 'command' in task_data:
+            return await self.execute_command_task(task_data)
+        if 'script' in task_data:
+            return await self.execute_script_task(task_data)
+        return worker.execute_generic_task(task_data)
+    
+    async def execute_command_task(self, task_data):
+        worker = self.worker
+        command = task_data['command']
+        task_name = task_data.get('name', 'command_task')
+        
+        worker.comm.log_activity(f"Executing command: {command}", progress=25)
+        try:
+            output_file = f"task_{task_name}_output.txt"
+            header = [f"Task: {task_name}", f"Command: {command}"]
+            limits = TaskLimits.from_task(task_data)
+            result = await run_subprocess(command, cwd=worker.worker_dir, shell=True, limits=limits,
+                                          on_start=worker.register_task_process,
+                                          env=worker.task_env(task_data))
+            await asyncio.to_thread(worker.write_task_output, output_file, header, result)
+            worker.settle_task_process(limits, result)
+            worker.comm.log_activity(f"Command executed successfully. Output saved to {output_file}", progress=75)
+            return result
+        except Exception as e:
+            worker.comm.log_activity(f"Error executing command: {str(e)}")
+            raise
+    
+    async def execute_script_task(self, task_data):
+        worker = self.worker
+        script = task_data['script']
+        task_name = task_data.get('name', 'script_task')
+        
+        worker.comm.log_activity(f"Executing script for task: {task_name}", progress=25)
+        try:
+            output_file = f"task_{task_name}_output.txt"
+            # 同じスレッドで並行に動くので、スレッドIDではなく連番で命名
+            script_file = f"temp_script_{task_name}_{os.getpid()}_{next(self._script_ids)}.py"
+            script_path = os.path.join(worker.worker_dir, script_file)
+            with open(script_path, 'w') as f:
+                f.write(script)
+            header = [f"Task: {task_name}", f"Script executed: {script_file}"]
+            limits = TaskLimits.from_task(task_data)
+            try:
+                result = await run_subprocess([sys.executable, script_file], cwd=worker.worker_dir,
+                                              limits=limits, on_start=worker.register_task_process,
+                                              env=worker.task_env(task_data))
+            finally:
+                os.remove(script_path)
+            await asyncio.to_thread(worker.write_task_output, output_file, header, result)
+            worker.settle_task_process(limits, result)
+            worker.comm.log_activity(f"Script executed successfully. Output saved to {output_file}", progress=75)
+            return result
+        except Exception as e:
+            worker.comm.log_activity(f"Error executing script: {str(e)}")
+            raise
+
+
+class AsyncManagerRuntime(_Runtime):
+    """ManagerAutomation の定期処理を1つのイベントループで並行に動かす
+    
+    完了・エラー報告はプッシュが届いた時点で処理し、生存確認・ステータスチェック・
+    レポート生成・メトリクスの書き出しはそれぞれの間隔で実行する。
+    """
+    
+    heartbeat_check_interval = 5
+    pool_check_interval = 2
+    status_check_interval = 60
+    report_interval = 180
+    metrics_interval = 15
+    artifact_gc_interval = 600
+    
+    def __init__(self, manager):
+        super().__init__(manager)
+        self.manager = manager
+    
+    async def run(self):
+        manager = self.manager
+        self.start()
+        manager.create_sample_tasks()
+        
+        self.spawn(self.message_loop())
+        self.spawn(every(self.heartbeat_check_interval, manager.check_heartbeats, self.log_error))
+        if manager.pool is not None:
+            self.spawn(every(self.pool_check_interval, manager.supervise_workers, self.log_error))
+        self.spawn(every(self.status_check_interval, self.check_status, self.log_error))
+        self.spawn(every(self.report_interval, manager.generate_status_report, self.log_error))
+        if manager.metrics_file is not None:
+            self.spawn(every(self.metrics_interval, manager.write_metrics, self.log_error))
+        self.spawn(self.collect_artifacts())
+        
+        manager.comm.log_activity("Manager is now running on an asyncio event loop")
+        try:
+            if manager.running:
+                await self.stopped.wait()
+        finally:
+            await self.close()
+    
+    async def collect_artifacts(self):
+        """成果物の GC はディレクトリを走査するのでスレッドで行う"""
+        while True:
+            try:
+                await asyncio.to_thread(self.manager.collect_artifacts)
+            except Exception as e:
+                self.log_error(e)
+            await asyncio.sleep(self.artifact_gc_interval)
+    
+    def check_status(self):
+        self.manager.check_worker_status()
+        self.manager.load_blocked_tasks()
+        if self.manager.queue is not None:
+            self.manager.reclaim_expired_leases()
@@ -0,0 +1,404 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import os
+import platform
+import random
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from heartbeat import heartbeat_path, read_heartbeat
+from manager_automation import ManagerAutomation
+from message_bus import TRANSPORTS, start_broker
+from metrics import stage_latencies
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+INSTRUCTION_FILES = ["manager_instructions.md", "worker_session_instructions.md"]
+
+# 合成タスクの種類
+TASK_KINDS = ("tiny", "cpu", "output")
+DEFAULT_MIX = "tiny=70,cpu=20,output=10"
+
+
+def parse_mix(spec):
+    """'tiny=70,cpu=20,output=10' → {"tiny": 70, ...}"""
+    mix = {}
+    for part in spec.split(","):
+        kind, _, weight = part.partition("=")
+        kind = kind.strip()
+        if kind not in TASK_KINDS:
+            raise ValueError(f"Unknown task kind: {kind} (choose from {', '.join(TASK_KINDS)})")
+        mix[kind] = float(weight or 1)
+    return mix
+
+
+def make_task(kind, index, cpu_loops, output_lines):
+    name = f"bench_{index:06d}_{kind}"
+    if kind == "tiny":
+        return {"name": name, "command": "true"}
+    if kind == "cpu":
+        return {"name": name,
+                "script": f"total = 0\nfor i in range({cpu_loops}):\n    total += i * i\nprint(total)"}
+    return {"name": name, "command": f"yes 'benchmark output line' | head -n {output_lines}"}
+
+
+def percentile(values, pct):
+    """最近傍順位法のパーセンタイル（値がなければ None）"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(int(round(pct / 100 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def summarize(values):
+    return {
+        "count": len(values),
+        "p50": percentile(values, 50),
+        "p90": percentile(values, 90),
+        "p99": percentile(values, 99),
+        "max": max(values) if values else None,
+        "mean": sum(values) / len(values) if values else None,
+    }
+
+
+def tree_usage(path):
+    """ディレクトリ配下のファイル数と合計バイト数"""
+    files, total = 0, 0
+    for root, _, names in os.walk(path):
+        for name in names:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+                files += 1
+            except FileNotFoundError:
+                continue
+    return {"files": files, "bytes": total}
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+                              capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+class Benchmark:
+    """一時ディレクトリで本物の Manager と N 個のワーカープロセスを動かし、処理性能を測る
+    
+    Manager はこのプロセス内で動かし（完了報告の処理に計測を挟むため）、
+    ワーカーは worker_session_automation.py を別プロセスとして起動する。
+    """
+    
+    def __init__(self, workdir, workers=3, tasks=200, mix=DEFAULT_MIX, batch_size=50,
+                 flood=0, flood_rate=0, worker_args="--watch auto", cpu_loops=200000,
+                 output_lines=20000, seed=0, timeout=600, poll_interval=0.05, transport="socket"):
+        self.workdir = workdir
+        self.worker_names = [f"worker{i + 1}" for i in range(workers)]
+        self.task_count = tasks
+        self.mix = parse_mix(mix)
+        self.mix_spec = mix
+        self.batch_size = batch_size
+        self.flood = flood
+        self.flood_rate = flood_rate
+        self.worker_args = shlex.split(worker_args)
+        self.transport = transport
+        self.cpu_loops = cpu_loops
+        self.output_lines = output_lines
+        self.seed = seed
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        
+        self.processes = []
+        self.latencies = []
+        self.stages = {}
+        self.completed = set()
+        self.failed = 0
+        self.flood_sent = 0
+    
+    # ---- 準備 ----
+    
+    def generate_tasks(self):
+        """seed から決まる再現可能なタスク列"""
+        rng = random.Random(self.seed)
+        kinds = list(self.mix)
+        weights = [self.mix[kind] for kind in kinds]
+        return [make_task(rng.choices(kinds, weights)[0], i, self.cpu_loops, self.output_lines)
+                for i in range(self.task_count)]
+    
+    def start_workers(self):
+        os.makedirs("bench_logs", exist_ok=True)
+        for name in self.worker_names:
+            out = open(os.path.join("bench_logs", f"{name}.out"), 'w')
+            process = subprocess.Popen(
+                [sys.executable, os.path.join(REPO_DIR, "worker_session_automation.py"), name,
+                 "--transport", self.transport] + self.worker_args,
+                cwd=self.workdir, stdout=out, stderr=subprocess.STDOUT)
+            out.close()
+            self.processes.append(process)
+    
+    def wait_for_workers(self, timeout=30):
+        """全ワーカーのハートビートが出るまで待つ"""
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if all(read_heartbeat(heartbeat_path(name)) is not None for name in self.worker_names):
+                return
+            if any(process.poll() is not None for process in self.processes):
+                raise RuntimeError("A worker exited during startup (see bench_logs/)")
+            time.sleep(0.1)
+        raise RuntimeError("Workers did not start in time")
+    
+    def instrument(self, manager):
+        """完了・エラー報告の処理に計測を挟む"""
+        handle_completion = manager.handle_completion_report
+        handle_error = manager.handle_error_report
+        
+        def on_completion(msg):
+            handle_completion(msg)
+            if not msg['subject'].startswith("タスク完了"):
+                return
+            acked_at = time.time()
+            self.completed.add(manager.task_name_from_subject(msg))
+            data = msg.get('data') or {}
+            timings = dict(data.get('timings') or {}, acked_at=acked_at)
+            for stage, seconds in stage_latencies(timings).items():
+                self.stages.setdefault(stage, []).append(seconds)
+            if timings.get('enqueued_at') is not None:
+                self.latencies.append(acked_at - timings['enqueued_at'])
+        
+        def on_error(msg):
+            handle_error(msg)
+            if msg['subject'].startswith("タスクエラー"):
+                self.failed += 1
+        
+        manager.handle_completion_report = on_completion
+        manager.handle_error_report = on_error
+    
+    def flood_messages(self, store, stop):
+        """ワーカーとManager宛てのダミーメッセージを送り続ける（flood_rate=0 なら全速）"""
+        recipients = self.worker_names + ["manager"]
+        interval = 1 / self.flood_rate if self.flood_rate else 0
+        for i in range(self.flood):
+            if stop.is_set():
+                break
+            store.append({
+                "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                "from": "benchmark",
+                "to": recipients[i % len(recipients)],
+                "subject": "ベンチマーク",
+                "message": f"flood message {i}",
+                "priority": "low",
+            })
+            self.flood_sent += 1
+            if interval:
+                time.sleep(interval)
+    
+    # ---- 実行 ----
+    
+    def run(self):
+        tasks = self.generate_tasks()
+        # ワーカーが起動時から購読できるよう、ブローカーを先に立てておく
+        broker = start_broker() if self.transport == "socket" else None
+        self.start_workers()
+        try:
+            self.wait_for_workers()
+            manager = ManagerAutomation(workers=self.worker_names, transport=self.transport)
+            self.instrument(manager)
+            store_before = manager.comm.store.disk_usage()
+            
+            stop_flood = threading.Event()
+            flood_thread = None
+            if self.flood:
+                flood_thread = threading.Thread(target=self.flood_messages,
+                                                args=(manager.comm.store, stop_flood), daemon=True)
+            
+            started = time.time()
+            if flood_thread is not None:
+                flood_thread.start()
+            for i in range(0, len(tasks), self.batch_size):
+                manager.distribute_tasks(tasks[i:i + self.batch_size])
+                manager.check_messages()
+            distributed = time.time()
+            
+            deadline = started + self.timeout
+            while len(self.completed) + self.failed < len(tasks) and time.time() < deadline:
+                manager.check_messages()
+                manager.comm.wait_for_messages(self.poll_interval)
+            finished = time.time()
+            
+            stop_flood.set()
+            if flood_thread is not None:
+                flood_thread.join()
+            timed_out = len(self.completed) + self.failed < len(tasks)
+            store_after = manager.comm.store.disk_usage()
+            peak_rss = self.worker_rss()
+            for name in self.worker_names:
+                manager.comm.send_message(name, "停止", "Benchmark finished", "high")
+            manager.comm.flush()
+        finally:
+            self.stop_workers()
+            if broker is not None:
+                broker.close()
+        
+        elapsed = finished - started
+        return {
+            "completed": len(self.completed),
+            "failed": self.failed,
+            "timed_out": timed_out,
+            "elapsed_seconds": elapsed,
+            "distribute_seconds": distributed - started,
+            "throughput_tasks_per_second": len(self.completed) / elapsed if elapsed else None,
+            "latency_seconds": summarize(self.latencies),
+            "stage_latency_seconds": {stage: summarize(values)
+                                      for stage, values in sorted(self.stages.items())},
+            "flood_messages_sent": self.flood_sent,
+            "message_store": {
+                "segments_before": store_before[0],
+                "bytes_before": store_before[1],
+                "segments_after": store_after[0],
+                "bytes_after": store_after[1],
+            },
+            "worker_rss_bytes": peak_rss,
+            "disk": {
+                "communication": tree_usage("communication"),
+                "pending_tasks": tree_usage("pending_tasks"),
+                "completed_tasks": tree_usage("completed_tasks"),
+                "worker_dirs": {name: tree_usage(name) for name in self.worker_names},
+                "total": tree_usage("."),
+            },
+        }
+    
+    def worker_rss(self):
+        rss = {}
+        for name in self.worker_names:
+            heartbeat = read_heartbeat(heartbeat_path(name))
+            if heartbeat is not None:
+                rss[name] = heartbeat['rss_bytes']
+        return rss
+    
+    def stop_workers(self, timeout=15):
+        deadline = time.time() + timeout
+        for process in self.processes:
+            try:
+                process.wait(max(deadline - time.time(), 0.1))
+            except subprocess.TimeoutExpired:
+                process.terminate()
+                try:
+                    process.wait(5)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+    
+    def config(self):
+        return {
+            "workers": len(self.worker_names),
+            "worker_args": self.worker_args,
+            "transport": self.transport,
+            "tasks": self.task_count,
+            "mix": self.mix_spec,
+            "batch_size": self.batch_size,
+            "flood": self.flood,
+            "flood_rate": self.flood_rate,
+            "cpu_loops": self.cpu_loops,
+            "output_lines": self.output_lines,
+            "seed": self.seed,
+        }
+
+
+def compare(baseline, current):
+    """主要な指標について前回の結果との差（%）を返す"""
+    def pick(result):
+        return {
+            "throughput_tasks_per_second": result.get("throughput_tasks_per_second"),
+            "latency_p50": result.get("latency_seconds", {}).get("p50"),
+            "latency_p99": result.get("latency_seconds", {}).get("p99"),
+            "message_store_bytes": result.get("message_store", {}).get("bytes_after"),
+            "disk_bytes": result.get("disk", {}).get("total", {}).get("bytes"),
+        }
+    
+    before, after = pick(baseline["result"]), pick(current["result"])
+    changes = {}
+    for key in before:
+        if before[key] and after[key] is not None:
+            changes[key] = {"baseline": before[key], "current": after[key],
+                            "change_percent": (after[key] - before[key]) / before[key] * 100}
+    return changes
+
+
+# メイン実行
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the manager/worker pipeline in a temporary directory",
+        epilog="Example: python3 benchmark.py --workers 3 --tasks 500 --flood 10000 -o result.json")
+    parser.add_argument("--workers", type=int, default=3)
+    parser.add_argument("--tasks", type=int, default=200)
+    parser.add_argument("--mix", default=DEFAULT_MIX,
+                        help=f"タスクの種類と比率（既定: {DEFAULT_MIX}）")
+    parser.add_argument("--batch-size", type=int, default=50, help="1回の distribute_tasks で配布する件数")
+    parser.add_argument("--flood", type=int, default=0, help="計測中に送るダミーメッセージの数")
+    parser.add_argument("--flood-rate", type=float, default=0, help="ダミーメッセージの送信レート（件/秒、0 = 全速）")
+    parser.add_argument("--worker-args", default="--watch auto",
+                        help="ワーカーに渡す引数（例: \"--watch auto --max-parallel 4\"）")
+    parser.add_argument("--transport", choices=TRANSPORTS, default="socket",
+                        help="メッセージの転送方式（socket / file）")
+    parser.add_argument("--cpu-loops", type=int, default=200000, help="cpu タスクのループ回数")
+    parser.add_argument("--output-lines", type=int, default=20000, help="output タスクの出力行数")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--output", "-o", default=None, help="結果のJSONを書き出すファイル（既定: 標準出力）")
+    parser.add_argument("--compare", default=None, help="比較する前回の結果JSON")
+    parser.add_argument("--keep", action="store_true", help="一時ディレクトリを削除しない")
+    args = parser.parse_args()
+    
+    workdir = tempfile.mkdtemp(prefix="worker_bench_")
+    for name in INSTRUCTION_FILES:
+        if os.path.exists(os.path.join(REPO_DIR, name)):
+            shutil.copy(os.path.join(REPO_DIR, name), workdir)
+    original_cwd = os.getcwd()
+    output_path = os.path.abspath(args.output) if args.output else None
+    compare_path = os.path.abspath(args.compare) if args.compare else None
+    
+    # Manager のログ出力はベンチマーク結果と混ざらないようファイルへ
+    os.chdir(workdir)
+    real_stdout = sys.stdout
+    sys.stdout = open(os.path.join(workdir, "manager.out"), 'w')
+    try:
+        benchmark = Benchmark(workdir, workers=args.workers, tasks=args.tasks, mix=args.mix,
+                              batch_size=args.batch_size, flood=args.flood, flood_rate=args.flood_rate,
+                              worker_args=args.worker_args, cpu_loops=args.cpu_loops,
+                              output_lines=args.output_lines, seed=args.seed, timeout=args.timeout,
+                              transport=args.transport)
+        result = benchmark.run()
+    finally:
+        sys.stdout.close()
+        sys.stdout = real_stdout
+        os.chdir(original_cwd)
+    
+    report = {
+        "benchmark": "worker-manager-pipeline",
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "config": benchmark.config(),
+        "result": result,
+    }
+    if compare_path:
+        with open(compare_path, 'r') as f:
+            report["comparison"] = compare(json.load(f), report)
+    if args.keep:
+        report["workdir"] = workdir
+    else:
+        shutil.rmtree(workdir, ignore_errors=True)
+    
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if output_path:
+        with open(output_path, 'w') as f:
+            f.write(text + "\n")
+    print(text)
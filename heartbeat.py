@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+import mmap
+import os
+import resource
+import struct
+import threading
+import time
+
+# magic, seq, pid, state, progress, running, updated_at, started_at, task_started_at,
+# rss_bytes, tasks_done, tasks_failed, current_task
+RECORD = struct.Struct("<4sIiBBHdddQII128s")
+MAGIC = b"HBT1"
+SEQ_OFFSET = 4
+
+STATE_IDLE = 0
+STATE_RUNNING = 1
+STATE_STOPPED = 2
+STATE_NAMES = {STATE_IDLE: "idle", STATE_RUNNING: "running", STATE_STOPPED: "stopped"}
+
+
+def heartbeat_path(worker, base_dir="communication/heartbeats"):
+    return os.path.join(base_dir, f"{worker}.hb")
+
+
+def current_rss():
+    """自プロセスの常駐メモリ（バイト）"""
+    try:
+        with open("/proc/self/statm", 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        # /proc がない環境では最大常駐メモリで代用
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def pid_alive(pid):
+    if pid <= 0:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class HeartbeatWriter:
+    """ワーカーの状態を固定長レコードとして mmap したファイルに書き続ける
+    
+    専用スレッドが interval ごとに時刻とRSSを更新するため、長いタスクの実行中も
+    ハートビートは止まらない。書き込み中は seq を奇数にし（seqlock）、
+    読み手は seq が偶数かつ前後で一致するまで読み直す。
+    """
+    
+    def __init__(self, worker, base_dir="communication/heartbeats", interval=1.0):
+        self.worker = worker
+        self.interval = interval
+        self.path = heartbeat_path(worker, base_dir)
+        os.makedirs(base_dir, exist_ok=True)
+        
+        # 再起動時も同じファイルを上書きする（読み手の mmap を無効にしない）
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            os.ftruncate(fd, RECORD.size)
+            self._map = mmap.mmap(fd, RECORD.size)
+        finally:
+            os.close(fd)
+        
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._stop = threading.Event()
+        self._thread = None
+        
+        self.started_at = time.time()
+        self.state = STATE_IDLE
+        self.progress = 0
+        self.current_task = ""
+        self.task_started_at = 0.0
+        self.running = 0
+        self.tasks_done = 0
+        self.tasks_failed = 0
+        self.write()
+    
+    def write(self):
+        with self._lock:
+            name = self.current_task.encode("utf-8")[:128]
+            body = RECORD.pack(MAGIC, 0, os.getpid(), self.state, min(max(int(self.progress), 0), 100),
+                               min(self.running, 0xFFFF), time.time(), self.started_at,
+                               self.task_started_at, current_rss(), self.tasks_done,
+                               self.tasks_failed, name)
+            self._seq += 1
+            struct.pack_into("<I", self._map, SEQ_OFFSET, self._seq)
+            self._map[SEQ_OFFSET + 4:] = body[SEQ_OFFSET + 4:]
+            self._map[:SEQ_OFFSET] = MAGIC
+            self._seq += 1
+            struct.pack_into("<I", self._map, SEQ_OFFSET, self._seq)
+    
+    def start(self):
+        """定期更新スレッドを開始"""
+        def beat():
+            while not self._stop.wait(self.interval):
+                self.write()
+        
+        self._thread = threading.Thread(target=beat, name=f"{self.worker}-heartbeat", daemon=True)
+        self._thread.start()
+    
+    # ---- 状態の更新（ワーカーから呼ぶ） ----
+    
+    def task_started(self, task):
+        with self._lock:
+            self.running += 1
+            self.state = STATE_RUNNING
+            self.current_task = task
+            self.task_started_at = time.time()
+            self.progress = 0
+        self.write()
+    
+    def task_finished(self, success=True):
+        with self._lock:
+            self.running = max(self.running - 1, 0)
+            self.tasks_done += 1
+            if not success:
+                self.tasks_failed += 1
+            if self.running == 0:
+                self.state = STATE_IDLE
+                self.current_task = ""
+                self.task_started_at = 0.0
+                self.progress = 0
+        self.write()
+    
+    def set_progress(self, progress):
+        # 次の定期更新で書き出す
+        self.progress = progress
+    
+    def stop(self):
+        self._stop.set()
+        with self._lock:
+            self.state = STATE_STOPPED
+            self.running = 0
+            self.current_task = ""
+        self.write()
+
+
+def read_heartbeat(path, retries=10):
+    """ハートビートを読み取り dict で返す（未作成・壊れている場合は None）"""
+    try:
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size < RECORD.size:
+                return None
+            with mmap.mmap(f.fileno(), RECORD.size, access=mmap.ACCESS_READ) as m:
+                for _ in range(retries):
+                    before = struct.unpack_from("<I", m, SEQ_OFFSET)[0]
+                    data = m[:RECORD.size]
+                    after = struct.unpack_from("<I", m, SEQ_OFFSET)[0]
+                    if before == after and before % 2 == 0:
+                        break
+                    time.sleep(0.001)
+                else:
+                    return None
+    except (OSError, ValueError):
+        return None
+    
+    (magic, _, pid, state, progress, running, updated_at, started_at, task_started_at,
+     rss_bytes, tasks_done, tasks_failed, name) = RECORD.unpack(data)
+    if magic != MAGIC:
+        return None
+    return {
+        "pid": pid,
+        "state": STATE_NAMES.get(state, "unknown"),
+        "progress": progress,
+        "running": running,
+        "updated_at": updated_at,
+        "started_at": started_at,
+        "task_started_at": task_started_at,
+        "rss_bytes": rss_bytes,
+        "tasks_done": tasks_done,
+        "tasks_failed": tasks_failed,
+        "current_task": name.rstrip(b"\0").decode("utf-8", errors="replace"),
+    }
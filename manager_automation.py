@@ -1,24 +1,149 @@
 #!/usr/bin/env python3
+import argparse
+import asyncio
 import json
 import os
+import shlex
+import shutil
+import signal
 import sys
 import time
+from collections import defaultdict
 from datetime import datetime
 from pathlib import Path
 import subprocess
 
+from activity_log import get_activity_logger
+from artifact_store import ArtifactStore
+from async_runtime import RUNTIMES, AsyncManagerRuntime
+from heartbeat import heartbeat_path, pid_alive, read_heartbeat
+from message_bus import TRANSPORTS, create_transport, new_message_id, start_broker
+from message_store import MessageStore
+from metrics import MetricsRegistry, stage_latencies
+from result_cache import read_cache_stats
+from scheduler import TaskIdGenerator, TaskScheduler, check_task_id
+from task_graph import TaskGraph
+from task_journal import OUTPUT_WRITTEN, read_journal
+from task_limits import worker_registry
+from task_priority import sort_messages_by_priority
+from task_stats import TaskStats
+from work_queue import WorkQueue
+from worker_pool import WorkerPool, system_load
+
 class ManagerAutomation:
-    def __init__(self):
+    def __init__(self, use_queue=False, dead_after=10, stuck_after=600, log_formats=("text",),
+                 metrics_port=None, metrics_file=None, workers=None, transport="socket",
+                 runtime="sync", max_reschedules=1, announce=True, worker_pool=None,
+                 artifact_max_mb=1024, artifact_ttl_days=7):
         self.worker_name = "manager"
-        self.comm = WorkerCommunication(self.worker_name)
+        self.comm = WorkerCommunication(self.worker_name, log_formats, transport)
         self.running = True
-        self.workers = ["worker1", "worker2", "worker3"]
+        self.runtime = runtime
+        # worker_pool を渡すとワーカーを子プロセスとして起動し、負荷に応じて増減させる
+        self.pool = worker_pool
+        if worker_pool is not None:
+            workers = worker_pool.initial_names()
+        self.workers = list(workers) if workers else ["worker1", "worker2", "worker3"]
         self.instructions_file = "manager_instructions.md"
         
-        # 初期ログ
-        self.comm.log_activity("Manager automation started")
-        self.read_instructions()
+        # 共有キュー（ワーカー未指定のタスクはここに投入）
+        self.queue = WorkQueue() if use_queue else None
+        
+        # 配布先の自動選択とタスクID
+        self.scheduler = TaskScheduler(self.workers)
+        self.task_ids = TaskIdGenerator()
+        
+        # タイムアウト・リソース超過で中断されたタスクを再配布する回数の上限
+        self.max_reschedules = max_reschedules
+        
+        # depends_on の依存関係（依存先がすべて完了したタスクから配布する）
+        # 補助プロセスは完了報告を受け取らずノードが減らないので、最近のものだけを保持する
+        self.graph = TaskGraph(bounded=not announce)
+        
+        # ワーカーが保存したタスクの出力（ディレクトリを走査せず索引から引く）
+        # 保持期間・容量の上限を超えた分は collect_artifacts で消す（0 は無制限）
+        self.artifacts = ArtifactStore()
+        self.artifact_max_bytes = artifact_max_mb * 1024 * 1024 if artifact_max_mb > 0 else None
+        self.artifact_ttl = artifact_ttl_days * 86400 if artifact_ttl_days > 0 else None
+        
+        # 初期ログ（task_ingest.py などの補助プロセスでは省略）
+        if announce:
+            self.comm.log_activity("Manager automation started")
+            self.read_instructions()
         self.ensure_directories()
+        
+        # メッセージブローカー（別途起動されていなければこのプロセス内で動かす）
+        # 補助プロセスは送信だけを行い、Manager 宛てのプッシュを横取りしないよう購読しない
+        self.broker = None
+        if transport == "socket" and announce:
+            self.broker = start_broker(self.comm.store)
+            if self.broker is not None:
+                self.comm.log_activity(f"Message broker listening on {self.broker.socket_path}")
+        if announce and self.comm.subscribe():
+            self.comm.log_activity("Subscribed to message bus")
+        
+        # ステータスレポート用カウンタ（起動時に一度だけファイル数と突き合わせる）
+        self.stats = TaskStats(self.workers,
+                               queue_dir=self.queue.ready_dir if self.queue is not None else None)
+        self.stats.reconcile()
+        
+        # ハートビートによる生存確認（dead_after 秒更新がなければ停止とみなす）
+        self.dead_after = dead_after
+        self.stuck_after = stuck_after
+        self.lost_workers = set()
+        self._stuck_warned = {}
+        # 長すぎるためキャンセルしたタスクID（中断報告が届いたら再配布する）
+        self._stuck_cancelled = set()
+        
+        # レイテンシ・キューの深さのメトリクス（ポートかファイルを指定したときのみ）
+        self.metrics = None
+        self.metrics_file = metrics_file
+        if metrics_port is not None or metrics_file is not None:
+            self.metrics = self.create_metrics(metrics_port)
+        
+        # 前回から保留中のタスクを引き継ぐ（停止中に依存先が完了していれば配布）
+        if announce:
+            self.load_blocked_tasks()
+    
+    def create_metrics(self, port):
+        """タスクの段階ごとのレイテンシ、待ち件数、メッセージストアのサイズを公開"""
+        metrics = MetricsRegistry()
+        metrics.histogram("task_latency_seconds",
+                          "Task latency by stage (queue_wait, pickup, run, report, total)",
+                          ["worker", "task_type", "stage"])
+        metrics.gauge("pending_tasks", "Tasks waiting per worker (shared_queue = shared queue)",
+                      self.pending_by_worker)
+        metrics.gauge("running_tasks", "Tasks reported as running per worker",
+                      lambda: {(("worker", worker),): self.stats.counters[worker].running
+                               for worker in self.workers})
+        metrics.gauge("lost_workers", "Workers whose heartbeat has stopped",
+                      lambda: len(self.lost_workers))
+        if self.pool is not None:
+            metrics.gauge("pool_workers", "Workers started by the manager (excluding draining)",
+                          lambda: len(self.pool.active()))
+        metrics.gauge("message_store_bytes", "Total size of message store segments",
+                      lambda: self.comm.store.disk_usage()[1])
+        metrics.gauge("message_store_segments", "Number of message store segments",
+                      lambda: self.comm.store.disk_usage()[0])
+        if port is not None:
+            host, bound_port = metrics.serve(port)
+            self.comm.log_activity(f"Metrics available at http://{host}:{bound_port}/metrics")
+        if self.metrics_file is not None:
+            self.comm.log_activity(f"Writing metrics to {self.metrics_file}")
+        return metrics
+    
+    def pending_by_worker(self):
+        pending = {(("worker", worker),): self.stats.pending(worker) for worker in self.workers}
+        if self.queue is not None:
+            pending[(("worker", "shared_queue"),)] = self.stats.pending()
+        return pending
+    
+    def write_metrics(self):
+        if self.metrics is not None and self.metrics_file is not None:
+            try:
+                self.metrics.write_file(self.metrics_file)
+            except OSError as e:
+                self.comm.log_activity(f"Error writing metrics: {e}")
     
     def ensure_directories(self):
         """必要なディレクトリを確保"""
@@ -40,33 +165,151 @@ class ManagerAutomation:
     
     def check_messages(self):
         """メッセージをチェックして処理"""
-        messages = self.comm.read_messages_for_me()
+        # エラー報告など high のメッセージを先に処理
+        messages = sort_messages_by_priority(self.comm.read_messages_for_me())
         for msg in messages:
             self.comm.log_activity(f"Received message from {msg['from']}: {msg['subject']}")
             
+            # 開始報告の処理
+            if msg['subject'].startswith("タスク開始"):
+                self.handle_start_report(msg)
+            
+            # 中断報告の処理（タイムアウト・キャンセル・リソース超過）
+            elif msg['subject'].startswith("タスク中断"):
+                self.handle_killed_report(msg)
+            
             # 完了報告の処理
-            if "完了" in msg['subject']:
+            elif "完了" in msg['subject']:
                 self.handle_completion_report(msg)
             
             # エラー報告の処理
             elif "エラー" in msg['subject'] or "error" in msg['subject'].lower():
                 self.handle_error_report(msg)
     
+    def handle_start_report(self, msg):
+        """開始報告を処理"""
+        task_name = self.task_name_from_subject(msg)
+        self.scheduler.task_started(msg['from'], task_name, self.message_time(msg))
+        self.stats.task_started(msg['from'], task_name, self.message_time(msg))
+    
     def handle_completion_report(self, msg):
         """完了報告を処理"""
         self.comm.log_activity(f"Processing completion report from {msg['from']}")
-        
-        # Worker3からの最終レポート完了通知
-        if msg['from'] == "worker3" and "レポート生成完了" in msg['subject']:
-            self.comm.log_activity("Final report received. Checking output folder...")
-            self.check_output_folder()
+        if msg['subject'].startswith("タスク完了"):
+            task_name = self.task_name_from_subject(msg)
+            self.scheduler.task_finished(msg['from'], task_name, self.message_time(msg))
+            self.stats.task_completed(msg['from'], task_name)
+            self.record_task_latency(msg)
+            data = msg.get('data') or {}
+            array = data.get('array')
+            if array:
+                failed = f" (failed items: {', '.join(map(str, array['failed_items']))})" if array['failed'] else ""
+                self.comm.log_activity(
+                    f"Array task {task_name}: {array['succeeded']}/{array['total']} items succeeded, "
+                    f"{array['failed']} failed{failed}, results in {array['results']}")
+            if data.get('task_id'):
+                self.release_dependents(data['task_id'], data.get('output'), task_name,
+                                        (data.get('artifact') or {}).get('hash'))
     
     def handle_error_report(self, msg):
         """エラー報告を処理"""
         self.comm.log_activity(f"ERROR reported by {msg['from']}: {msg['message']}")
+        if msg['subject'].startswith("タスクエラー"):
+            self.scheduler.task_finished(msg['from'], None, self.message_time(msg), success=False)
+            self.stats.task_failed(msg['from'])
+            # エラーのタスクは pending_tasks に残って再実行されるので、依存するタスクは保留のまま
+            task_id = Path(self.task_name_from_subject(msg)).stem
+            waiting = self.graph.waiting_on(task_id)
+            if waiting:
+                self.comm.log_activity(f"{waiting} tasks stay blocked until {task_id} succeeds")
         # エラー内容を分析して適切な対処を決定
         self.analyze_and_respond_to_error(msg)
     
+    def handle_killed_report(self, msg):
+        """中断報告を処理（キャンセル以外は別のワーカーへ再配布）"""
+        data = msg.get('data') or {}
+        reason = data.get('reason', 'unknown')
+        if data.get('task_id') in self._stuck_cancelled:
+            # check_heartbeats が長すぎるためにキャンセルしたタスクは、他の中断と同じく再配布する
+            self._stuck_cancelled.discard(data['task_id'])
+            if reason == "cancelled":
+                reason = "stuck"
+        self.comm.log_activity(f"Task killed on {msg['from']} ({reason}): {msg['message']}")
+        if data.get('started', True):
+            self.scheduler.task_finished(msg['from'], None, self.message_time(msg), success=False)
+            self.stats.task_failed(msg['from'])
+        else:
+            self.stats.task_cancelled(msg['from'])
+        rescheduled = False
+        if reason != "cancelled" and data.get('task_file'):
+            rescheduled = self.reschedule_task(data['task_file'], msg['from'], reason)
+        if not rescheduled and data.get('task_id'):
+            self.drop_dependents(data['task_id'])
+    
+    def reschedule_task(self, task_file, worker, reason):
+        """中断されたタスクを新しいIDで投入し直す（max_reschedules 回まで、なるべく別のワーカーへ）"""
+        try:
+            with open(task_file, 'r') as f:
+                task_data = json.load(f)
+        except (OSError, ValueError) as e:
+            self.comm.log_activity(f"Error reading killed task {task_file}: {str(e)}")
+            return False
+        
+        reschedules = task_data.get('reschedules', 0)
+        if reschedules >= self.max_reschedules:
+            self.comm.log_activity(
+                f"WARNING: task '{task_data.get('name')}' was killed {reschedules + 1} times "
+                f"({reason}), leaving it in {task_file}")
+            return False
+        task_data['reschedules'] = reschedules + 1
+        task_data['killed_by'] = {"worker": worker, "reason": reason}
+        old_id = task_data.pop('task_id', None) or Path(task_file).stem
+        task_data.pop('enqueued_at', None)
+        
+        if self.queue is not None:
+            self.enqueue_task(task_data)
+            target = "shared queue"
+        else:
+            live = self.live_workers()
+            if not live:
+                self.comm.log_activity(f"WARNING: no live workers to reschedule {task_file}")
+                return False
+            target = self.scheduler.choose(task_data, [w for w in live if w != worker] or live)
+            self.write_task_file(task_data, target, notify=False)
+            self.comm.send_message(target, "新規タスク",
+                                   f"Rescheduled task: {task_data.get('name')}", "high")
+        # 依存するタスクは新しいIDの完了を待つ
+        self.graph.replace(old_id, task_data['task_id'])
+        os.remove(task_file)
+        self.comm.log_activity(
+            f"Rescheduled task '{task_data.get('name')}' killed on {worker} ({reason}) to {target} "
+            f"(attempt {task_data['reschedules']} of {self.max_reschedules})")
+        return True
+    
+    def cancel_task(self, task_id):
+        """タスクIDでキャンセル（実行中なら子プロセスをプロセスグループごと kill、未着手なら取り除く）"""
+        return cancel_task(self.comm, task_id, self.live_workers(), self.queue, self.stats)
+    
+    def record_task_latency(self, msg):
+        """完了報告に含まれる各段階の時刻と受信時刻からレイテンシを集計"""
+        data = msg.get('data')
+        if self.metrics is None or not isinstance(data, dict) or not data.get('timings'):
+            return
+        timings = dict(data['timings'], acked_at=time.time())
+        for stage, seconds in stage_latencies(timings).items():
+            self.metrics.observe("task_latency_seconds", seconds, worker=msg['from'],
+                                 task_type=data.get('task_type') or "unknown", stage=stage)
+    
+    def task_name_from_subject(self, msg):
+        """「タスク開始: <name>」形式の件名からタスク名を取り出す"""
+        return msg['subject'].split(":", 1)[-1].strip()
+    
+    def message_time(self, msg):
+        try:
+            return datetime.strptime(msg['timestamp'], "%Y-%m-%d %H:%M:%S").timestamp()
+        except (KeyError, ValueError):
+            return time.time()
+    
     def analyze_and_respond_to_error(self, error_msg):
         """エラーを分析して対処"""
         # リトライ可能なエラーの場合
@@ -76,8 +319,10 @@ class ManagerAutomation:
                                  "エラーを検知しました。タスクを再実行してください。", "high")
     
     def check_worker_status(self):
-        """各ワーカーの状態をチェック"""
+        """各ワーカーの状態をチェック（ハートビートのないワーカーはログの更新時刻で判断）"""
         for worker in self.workers:
+            if read_heartbeat(heartbeat_path(worker)) is not None:
+                continue
             log_file = f"{worker}/{worker}_log.txt"
             if os.path.exists(log_file):
                 # 最終更新時刻をチェック
@@ -88,23 +333,401 @@ class ManagerAutomation:
                 if time_since_update > 300:
                     self.comm.log_activity(f"WARNING: {worker} has not updated for {int(time_since_update/60)} minutes")
     
-    def check_output_folder(self):
-        """outputフォルダの内容を確認"""
-        output_files = list(Path("output").glob("*"))
-        if output_files:
-            self.comm.log_activity(f"Found {len(output_files)} files in output folder:")
-            for file in output_files:
-                self.comm.log_activity(f"  - {file.name}")
-    
-    def distribute_task(self, task_data, target_worker):
-        """タスクをワーカーに配布"""
-        task_file = f"pending_tasks/{target_worker}/task_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    def check_heartbeats(self):
+        """ハートビートからワーカーの生存を確認し、停止したワーカーのタスクを再配布"""
+        now = time.time()
+        for worker in self.workers:
+            heartbeat = read_heartbeat(heartbeat_path(worker))
+            if heartbeat is None or heartbeat['state'] == "stopped":
+                continue
+            
+            age = now - heartbeat['updated_at']
+            alive = age <= self.dead_after and pid_alive(heartbeat['pid'])
+            if not alive:
+                if worker not in self.lost_workers:
+                    self.lost_workers.add(worker)
+                    self.comm.log_activity(
+                        f"WARNING: {worker} (pid {heartbeat['pid']}) is not responding "
+                        f"(last heartbeat {age:.0f}s ago), reassigning its tasks")
+                    self.reassign_worker_tasks(worker)
+                continue
+            if worker in self.lost_workers:
+                self.lost_workers.discard(worker)
+                self.comm.log_activity(f"{worker} is alive again (pid {heartbeat['pid']})")
+            
+            # 生きているが1つのタスクが長すぎる場合はキャンセルし、中断報告を受けて再配布する（タスクごとに1回）
+            task = heartbeat['current_task']
+            if (task and heartbeat['task_started_at'] and now - heartbeat['task_started_at'] > self.stuck_after
+                    and self._stuck_warned.get(worker) != task):
+                self._stuck_warned[worker] = task
+                self.comm.log_activity(
+                    f"WARNING: {worker} has been running {task} for "
+                    f"{int((now - heartbeat['task_started_at']) / 60)} minutes "
+                    f"(progress {heartbeat['progress']}%), cancelling it to reschedule")
+                task_id = Path(task).stem
+                self._stuck_cancelled.add(task_id)
+                self.cancel_task(task_id)
+    
+    def live_workers(self):
+        return [worker for worker in self.workers if worker not in self.lost_workers
+                and (self.pool is None or self.pool.is_up(worker))]
+    
+    def reassign_worker_tasks(self, worker, keep=()):
+        """停止したワーカーの保留・実行中タスクを生きているワーカーへ移す（keep のタスクIDは残す）"""
+        live = self.live_workers()
+        moved = defaultdict(int)
+        if live:
+            for task_file in sorted(Path(f"pending_tasks/{worker}").glob("*.json")):
+                if task_file.stem in keep:
+                    continue
+                try:
+                    with open(task_file, 'r') as f:
+                        task_data = json.load(f)
+                except (OSError, ValueError):
+                    continue
+                target = self.scheduler.choose(task_data, live)
+                try:
+                    os.rename(task_file, Path(f"pending_tasks/{target}") / task_file.name)
+                except FileNotFoundError:
+                    # 移動前にワーカーが完了させた
+                    continue
+                self.stats.task_reassigned(worker, target, task_data.get('name'))
+                moved[target] += 1
+        else:
+            self.comm.log_activity("WARNING: no live workers to take over tasks")
+        
+        if self.queue is not None:
+            released = self.queue.release_worker(worker, keep)
+            if released:
+                self.comm.log_activity(f"Returned {released} leases of {worker} to the shared queue")
+        self.scheduler.worker_lost(worker)
+        self.stats.worker_lost(worker)
+        
+        for target, count in moved.items():
+            self.comm.log_activity(f"Reassigned {count} tasks from {worker} to {target}")
+            self.comm.send_message(target, "新規タスク", f"{count} tasks reassigned from {worker}", "high")
+    
+    def start_worker_pool(self):
+        """管理下のワーカーを起動（worker_pool 指定時のみ）"""
+        if self.pool is None:
+            return
+        for worker in self.workers:
+            pid = self.pool.spawn(worker)
+            self.comm.log_activity(f"Started {worker} (pid {pid})")
+    
+    def supervise_workers(self):
+        """管理下のワーカーの回収・再起動・停止・増減を行う"""
+        if self.pool is None:
+            return
+        for worker, returncode, expected in self.pool.reap():
+            if expected:
+                self.retire_worker(worker, returncode)
+            else:
+                self.recover_crashed_worker(worker, returncode)
+        for worker in self.pool.due_restarts():
+            pid = self.pool.restart(worker)
+            self.comm.log_activity(f"Restarted {worker} (pid {pid})")
+        self.kill_hung_workers()
+        self.stop_drained_workers()
+        self.scale_workers()
+    
+    def recover_crashed_worker(self, worker, returncode):
+        """異常終了したワーカーの子プロセスを止め、保留タスクを他のワーカーへ移す"""
+        delay = self.pool.restart_delay_for(worker)
+        self.comm.log_activity(
+            f"WARNING: {worker} exited unexpectedly (exit code {returncode}), "
+            f"restarting in {delay:.0f}s")
+        # 記録のうち、落ちたワーカーの実行中に起動して今も動いている子プロセスだけを止める
+        # （起動時刻を確かめられないときは止めず、再起動したワーカー自身に任せる）
+        identity = self.pool.identity(worker)
+        orphans = worker_registry(worker).kill_all(since=identity) if identity is not None else 0
+        if orphans:
+            self.comm.log_activity(f"Killed {orphans} task processes left by {worker}")
+        if worker not in self.lost_workers:
+            self.lost_workers.add(worker)
+            # 出力まで書き終えていたタスクは、再起動したワーカーがジャーナルから完了させる
+            finished = {task_id for task_id, record in read_journal(worker).items()
+                        if record["state"] == OUTPUT_WRITTEN}
+            if finished:
+                self.comm.log_activity(
+                    f"Keeping {len(finished)} tasks with written output for {worker} to finalize")
+            self.reassign_worker_tasks(worker, keep=finished)
+    
+    def kill_hung_workers(self):
+        """プロセスは生きているがハートビートが途絶えたワーカーを止める（次の回収で再起動）"""
+        now = time.time()
+        for worker in self.pool.active():
+            pid = self.pool.pid(worker)
+            heartbeat = read_heartbeat(heartbeat_path(worker))
+            if pid is None or heartbeat is None or heartbeat['pid'] != pid or heartbeat['state'] == "stopped":
+                continue
+            if now - heartbeat['updated_at'] > self.dead_after:
+                self.comm.log_activity(
+                    f"WARNING: {worker} (pid {pid}) stopped updating its heartbeat, killing it")
+                self.pool.kill(worker)
+    
+    def stop_drained_workers(self):
+        """縮小中のワーカーは手元のタスクがなくなってから停止させる
+        
+        共有キューを使う場合はワーカーが自分でタスクを取りに行くため、すぐに停止を指示する
+        （実行中のタスクは終えてから止まる）。pool.drain_timeout を過ぎたら待たずに停止させる。
+        """
+        for worker in self.pool.draining():
+            backlog = self.worker_backlog(worker)
+            if self.queue is None and backlog and self.pool.draining_for(worker) < self.pool.drain_timeout:
+                continue
+            self.comm.send_message(worker, "停止", "Scaling down", "high")
+            self.pool.mark_stopping(worker)
+            self.comm.log_activity(f"Stopping {worker} ({backlog} tasks left)")
+    
+    def scale_workers(self):
+        """待ち件数とロードアベレージから管理下のワーカー数を増減"""
+        depth = self.pending_depth()
+        load = system_load()
+        active = self.pool.active()
+        target = self.pool.target(depth, load)
+        for _ in range(target - len(active)):
+            worker = self.pool.undrain()
+            if worker is not None:
+                self.comm.log_activity(f"Scaling up: keeping {worker} (backlog {depth}, load {load:.2f})")
+                continue
+            worker = self.pool.free_name()
+            self.add_worker(worker)
+            pid = self.pool.spawn(worker)
+            self.comm.log_activity(
+                f"Scaling up: started {worker} (pid {pid}, backlog {depth}, load {load:.2f})")
+        if target < len(active):
+            # 番号の大きいワーカーから減らす
+            worker = active[-1]
+            self.pool.drain(worker)
+            self.comm.log_activity(
+                f"Scaling down: draining {worker} (backlog {depth}, load {load:.2f})")
+    
+    def add_worker(self, worker):
+        """ワーカーを配布先・レポートの対象に加える"""
+        if worker not in self.workers:
+            self.workers.append(worker)
+        os.makedirs(f"pending_tasks/{worker}", exist_ok=True)
+        os.makedirs(f"completed_tasks/{worker}", exist_ok=True)
+        self.scheduler.add_worker(worker)
+        self.stats.add_worker(worker)
+        self.lost_workers.discard(worker)
+    
+    def retire_worker(self, worker, returncode):
+        """縮小で停止したワーカーを外す（残っていたタスクは他のワーカーへ移す）"""
+        if self.worker_backlog(worker) or self.queue is not None:
+            self.reassign_worker_tasks(worker)
+        self.workers.remove(worker)
+        self.scheduler.remove_worker(worker)
+        self.stats.remove_worker(worker)
+        self.lost_workers.discard(worker)
+        self._stuck_warned.pop(worker, None)
+        self.comm.log_activity(f"Scaled down: {worker} stopped (exit code {returncode})")
+    
+    def worker_backlog(self, worker):
+        try:
+            with os.scandir(f"pending_tasks/{worker}") as it:
+                return sum(1 for entry in it if entry.name.endswith(".json"))
+        except FileNotFoundError:
+            return 0
+    
+    def stop_worker_pool(self):
+        """管理下のワーカーをすべて停止させる"""
+        if self.pool is None or not self.pool.members:
+            return
+        self.comm.log_activity("Stopping managed workers")
+        self.pool.stop_all(lambda worker: self.comm.send_message(worker, "停止", "Manager stopping", "high"))
+    
+    def report_artifacts(self, task_ids):
+        """タスクの成果物（サイズ・ハッシュ・終了コード）を索引から引いてログに記録"""
+        lines = []
+        for task_id in task_ids:
+            entry = self.artifacts.lookup(task_id)
+            if entry is None:
+                lines.append(f"  - {task_id}: no artifact")
+                continue
+            exit_code = "-" if entry['exit_code'] is None else entry['exit_code']
+            lines.append(f"  - {entry['name'] or task_id} ({task_id}): {entry['size'] / 1024:.1f}KB, "
+                         f"sha256 {entry['hash'][:12]}, exit code {exit_code}")
+        self.comm.log_activity("Artifacts:\n" + "\n".join(lines))
+    
+    def collect_artifacts(self):
+        """保持期間・容量の上限を超えた成果物を索引から外し、参照されなくなったチャンクを削除"""
+        if self.artifact_max_bytes is None and self.artifact_ttl is None:
+            return
+        dropped, freed = self.artifacts.collect_garbage(self.artifact_max_bytes, self.artifact_ttl)
+        if dropped or freed:
+            self.comm.log_activity(f"Artifact GC: removed {dropped} index entries, "
+                                   f"freed {freed / 1024 / 1024:.1f}MB")
+    
+    def distribute_task(self, task_data, target_worker=None):
+        """タスクをワーカーに配布
+        
+        ワーカー未指定の場合、共有キュー使用時はキューへ投入し、
+        それ以外はスケジューラが負荷と過去の実行時間から配布先を選ぶ。
+        depends_on のあるタスクは依存先がすべて完了するまで blocked_tasks に保留する。
+        """
+        if task_data.get('depends_on'):
+            self.submit_dependent_tasks([task_data], target_worker)
+            return
+        self.dispatch_task(task_data, target_worker)
+    
+    def dispatch_task(self, task_data, target_worker=None):
+        """依存関係を見ずにタスクを配布"""
+        if target_worker is None:
+            if self.queue is not None:
+                self.enqueue_task(task_data)
+                self.comm.log_activity(f"Task '{task_data.get('name')}' queued to shared queue")
+                return
+            target_worker = self.scheduler.choose(task_data, self.live_workers())
+        else:
+            self.scheduler.assign(target_worker, task_data)
+        self.write_task_file(task_data, target_worker)
+    
+    def distribute_tasks(self, tasks):
+        """複数タスクをまとめて配布（推定実行時間の長い順、通知はワーカーごとに1通）"""
+        dependent = [task for task in tasks if task.get('depends_on')]
+        tasks = [task for task in tasks if not task.get('depends_on')]
+        # 依存先を名前で引けるよう、依存のないタスクを先に配布してから登録する
+        self.dispatch_tasks(tasks)
+        if dependent:
+            self.submit_dependent_tasks(dependent)
+    
+    def dispatch_tasks(self, tasks):
+        if not tasks:
+            return
+        if self.queue is not None:
+            for task in tasks:
+                self.enqueue_task(task)
+            self.comm.log_activity(f"{len(tasks)} tasks queued to shared queue")
+            return
+        
+        assigned = defaultdict(int)
+        for worker, task in self.scheduler.plan(tasks, self.live_workers()):
+            self.write_task_file(task, worker, notify=False)
+            assigned[worker] += 1
+        for worker, count in assigned.items():
+            self.comm.log_activity(f"{count} tasks distributed to {worker}")
+            self.comm.send_message(worker, "新規タスク", f"{count} new tasks available", "high")
+    
+    def assign_task_id(self, task_data):
+        """タスクIDを割り当てる（指定済みなら検証する。ファイル名に使うので不正なIDは ValueError）"""
+        if not task_data.get("task_id"):
+            task_data["task_id"] = self.task_ids.next_id()
+        return check_task_id(task_data["task_id"], generated=True)
+    
+    def task_id_in_use(self, task_id):
+        """登録済み、またはいずれかのタスクフォルダにファイルがあるタスクIDか"""
+        if task_id in self.graph.nodes:
+            return True
+        name = f"{task_id}.json"
+        if os.path.exists(os.path.join(self.graph.blocked_dir, name)):
+            return True
+        for pattern in ("pending_tasks/*/", "completed_tasks/*/", "killed_tasks/*/",
+                        "task_queue/ready/", "task_queue/leases/*/"):
+            if next(Path().glob(pattern + name), None) is not None:
+                return True
+        return False
+    
+    def enqueue_task(self, task_data):
+        """共有キューにタスクを投入"""
+        task_id = self.assign_task_id(task_data)
+        task_data.setdefault("enqueued_at", time.time())
+        self.queue.enqueue(task_data, f"{task_id}.json")
+        self.graph.track(task_data)
+        self.stats.task_enqueued(None, task_data.get('name'))
+    
+    def write_task_file(self, task_data, target_worker, notify=True):
+        """pending_tasks/<worker> にタスクファイルを書き込み、ワーカーに通知"""
+        task_id = self.assign_task_id(task_data)
+        task_file = f"pending_tasks/{target_worker}/{task_id}.json"
+        task_data.setdefault("enqueued_at", time.time())
         with open(task_file, 'w') as f:
             json.dump(task_data, f, indent=2)
+        self.graph.track(task_data)
+        self.stats.task_enqueued(target_worker, task_data.get('name'))
         
-        self.comm.log_activity(f"Task '{task_data.get('name')}' distributed to {target_worker}")
-        self.comm.send_message(target_worker, "新規タスク", 
-                             f"New task available: {task_data.get('name')}", "high")
+        if notify:
+            self.comm.log_activity(f"Task '{task_data.get('name')}' distributed to {target_worker}")
+            self.comm.send_message(target_worker, "新規タスク", 
+                                 f"New task available: {task_data.get('name')}", "high")
+    
+    def submit_dependent_tasks(self, tasks, target_worker=None):
+        """depends_on のあるタスクを依存関係に登録し、依存先が完了済みのものはすぐ配布"""
+        for task in tasks:
+            self.assign_task_id(task)
+        ready, rejected = self.graph.add(tasks, target_worker)
+        for task, reason in rejected:
+            self.comm.log_activity(f"ERROR: rejected task '{task.get('name')}' ({task['task_id']}): {reason}")
+        blocked = len(tasks) - len(ready) - len(rejected)
+        if blocked:
+            self.comm.log_activity(f"{blocked} tasks waiting on dependencies in {self.graph.blocked_dir}")
+        self.release_tasks(ready)
+    
+    def release_tasks(self, ready):
+        """依存先が完了したタスクを配布（依存のない枝は空いているワーカーで並行に動く）"""
+        for task_data, worker in ready:
+            # 再起動前に完了した依存先などはハッシュを成果物の索引から引く
+            for source in task_data.get('artifacts', {}).values():
+                if source.get('hash') is None:
+                    entry = self.artifacts.lookup(source['task_id'])
+                    source['hash'] = entry['hash'] if entry is not None else None
+            self.dispatch_task(task_data, worker if worker in self.live_workers() else None)
+    
+    def load_blocked_tasks(self):
+        """blocked_tasks のうち、起動前や別のプロセス（task_ingest.py）で登録されたものを引き継ぐ
+        
+        フォルダ全体を走査するので、起動時と定期のステータスチェックでだけ呼ぶ
+        （依存先が既に完了していれば、読み込んだ時点で解放される）。
+        """
+        loaded, ready = self.graph.load_blocked()
+        if loaded:
+            self.comm.log_activity(f"Loaded {loaded} tasks waiting on dependencies from {self.graph.blocked_dir}")
+            self.release_tasks(ready)
+    
+    def release_dependents(self, task_id, output=None, name=None, artifact=None):
+        """完了したタスクを待っていたタスクを解放し、終端まで来たらパイプライン全体の所要時間を記録
+        
+        待っているタスクはメモリ上の依存関係から引く（blocked_tasks は走査しない）。
+        """
+        ready, path = self.graph.complete(task_id, output, name, artifact)
+        if ready:
+            self.comm.log_activity(f"Releasing {len(ready)} tasks that depended on {task_id}")
+            self.release_tasks(ready)
+        if path is not None:
+            names, seconds, task_ids = path
+            self.comm.log_activity(
+                f"Pipeline finished in {seconds:.1f}s (critical path: {' -> '.join(names)})")
+            self.report_artifacts(task_ids)
+    
+    def drop_dependents(self, task_id):
+        """完了しないことが確定したタスクに依存する保留タスクを取り除く"""
+        dropped = self.graph.fail(task_id)
+        if dropped:
+            self.comm.log_activity(
+                f"WARNING: skipped {len(dropped)} tasks depending on {task_id}: "
+                f"{', '.join(task.get('name') or task['task_id'] for task in dropped)} "
+                f"(moved to {self.graph.failed_dir})")
+    
+    def pending_depth(self):
+        """全ワーカーの保留タスク数（共有キュー使用時はキューの待ち件数も含む）"""
+        dirs = [f"pending_tasks/{worker}" for worker in self.workers]
+        if self.queue is not None:
+            dirs.append(self.queue.ready_dir)
+        depth = 0
+        for path in dirs:
+            try:
+                with os.scandir(path) as it:
+                    depth += sum(1 for entry in it if entry.name.endswith(".json"))
+            except FileNotFoundError:
+                continue
+        return depth
+    
+    def reclaim_expired_leases(self):
+        """期限切れのリースを共有キューへ戻す"""
+        reclaimed = self.queue.reclaim_expired()
+        if reclaimed:
+            self.comm.log_activity(f"Returned {reclaimed} expired leases to the shared queue")
     
     def create_sample_tasks(self):
         """サンプルタスクを作成して配布"""
@@ -118,20 +741,26 @@ class ManagerAutomation:
             {
                 "name": "data_processing",
                 "description": "データの処理",
-                "script": "print('Processing data...')\nfor i in range(5):\n    print(f'Step {i+1}/5')",
+                "script": "import os\nprint('Processing data...')\n"
+                          "with open(os.environ['ARTIFACT_DATA_COLLECTION']) as f:\n"
+                          "    print(f'{sum(1 for _ in f)} lines collected')\n"
+                          "for i in range(5):\n    print(f'Step {i+1}/5')",
+                "depends_on": ["data_collection"],
                 "worker": "worker2"
             },
             {
                 "name": "report_generation",
                 "description": "レポートの生成",
-                "command": "echo 'Generating report...'",
+                "command": "echo 'Generating report...' && tail -n 5 \"$ARTIFACT_DATA_PROCESSING\"",
+                "depends_on": ["data_processing"],
                 "worker": "worker3"
             }
         ]
         
         for task in tasks:
             worker = task.pop('worker')
-            self.distribute_task(task, worker)
+            # --workers で管理していないワーカー宛てはスケジューラに任せる
+            self.distribute_task(task, worker if worker in self.workers else None)
     
     def generate_status_report(self):
         """全体のステータスレポートを生成"""
@@ -140,11 +769,43 @@ class ManagerAutomation:
         report.append(f"Time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
         report.append("")
         
-        # 各ワーカーのステータス
+        # 各ワーカーのステータス（ディレクトリは走査せずカウンタから作る）
+        elapsed, rows = self.stats.snapshot()
+        report.append(f"Interval: {elapsed:.0f}s")
+        if self.queue is not None:
+            report.append(f"shared_queue: Pending={self.stats.pending()}")
+        blocked = self.graph.blocked_count()
+        if blocked:
+            report.append(f"Blocked on dependencies: {blocked}")
+        if self.pool is not None:
+            report.append(f"Worker pool: {self.pool.summary()}")
+        artifacts = self.artifacts.summary()
+        if artifacts["artifacts"]:
+            ratio = artifacts["bytes"] / artifacts["stored_bytes"] if artifacts["stored_bytes"] else 0.0
+            report.append(f"Artifacts: {artifacts['artifacts']}, "
+                          f"{artifacts['bytes'] / 1024 / 1024:.1f}MB stored as "
+                          f"{artifacts['stored_bytes'] / 1024 / 1024:.1f}MB ({ratio:.1f}x)")
+        cache_stats = read_cache_stats()
         for worker in self.workers:
-            pending = len(list(Path(f"pending_tasks/{worker}").glob("*.json")))
-            completed = len(list(Path(f"completed_tasks/{worker}").glob("*.json")))
-            report.append(f"{worker}: Pending={pending}, Completed={completed}")
+            row = rows[worker]
+            line = (f"{worker}: Pending={row['pending']}, Running={row['running']}, "
+                    f"Completed={row['completed']}, Failed={row['failed']} "
+                    f"({row['failure_rate']:.1%}), "
+                    f"Throughput={row['interval_completed']} ({row['throughput_per_min']:.1f}/min)")
+            if row['wait_avg'] is not None:
+                line += f", QueueWait avg={row['wait_avg']:.1f}s max={row['wait_max']:.1f}s"
+            if worker in cache_stats:
+                hits = cache_stats[worker].get("hits", 0)
+                lookups = hits + cache_stats[worker].get("misses", 0)
+                ratio = hits / lookups if lookups else 0.0
+                line += f", CacheHit={ratio:.1%} ({hits}/{lookups})"
+            heartbeat = read_heartbeat(heartbeat_path(worker))
+            if heartbeat is not None:
+                state = "lost" if worker in self.lost_workers else heartbeat['state']
+                line += f", State={state}, RSS={heartbeat['rss_bytes'] / 1024 / 1024:.0f}MB"
+                if heartbeat['current_task']:
+                    line += f", Task={heartbeat['current_task']} ({heartbeat['progress']}%)"
+            report.append(line)
         
         report_text = "\n".join(report)
         self.comm.log_activity(f"Status Report:\n{report_text}")
@@ -154,14 +815,28 @@ class ManagerAutomation:
             f.write(report_text)
     
     def run(self):
-        """メインループ"""
+        """メインループ（runtime="async" ではイベントループで実行）"""
+        self.start_worker_pool()
+        if self.runtime == "async":
+            asyncio.run(AsyncManagerRuntime(self).run())
+            self.stop()
+            return
+        
         message_check_interval = 20  # 20秒ごとにメッセージチェック
         status_check_interval = 60   # 60秒ごとにステータスチェック
+        heartbeat_check_interval = 5  # 5秒ごとにハートビートを確認
+        pool_check_interval = 2      # 2秒ごとに管理下のワーカーの回収・増減
+        metrics_interval = 15        # 15秒ごとにメトリクスファイルを更新
         report_interval = 180        # 3分ごとにレポート生成
+        artifact_gc_interval = 600   # 10分ごとに古い成果物を削除
         
         last_message_check = 0
         last_status_check = 0
+        last_heartbeat_check = 0
+        last_pool_check = 0
+        last_metrics_write = 0
         last_report = 0
+        last_artifact_gc = 0
         initial_tasks_created = False
         
         self.comm.log_activity("Manager is now running autonomously")
@@ -179,9 +854,22 @@ class ManagerAutomation:
                 self.check_messages()
                 last_message_check = current_time
             
+            # ハートビートによる生存確認
+            if current_time - last_heartbeat_check >= heartbeat_check_interval:
+                self.check_heartbeats()
+                last_heartbeat_check = current_time
+            
+            # 管理下のワーカーの再起動・増減
+            if self.pool is not None and current_time - last_pool_check >= pool_check_interval:
+                self.supervise_workers()
+                last_pool_check = current_time
+            
             # ステータスチェック
             if current_time - last_status_check >= status_check_interval:
                 self.check_worker_status()
+                self.load_blocked_tasks()
+                if self.queue is not None:
+                    self.reclaim_expired_leases()
                 last_status_check = current_time
             
             # レポート生成
@@ -189,27 +877,81 @@ class ManagerAutomation:
                 self.generate_status_report()
                 last_report = current_time
             
-            time.sleep(1)
+            # 成果物の GC
+            if current_time - last_artifact_gc >= artifact_gc_interval:
+                self.collect_artifacts()
+                last_artifact_gc = current_time
+            
+            # メトリクスファイルの更新
+            if self.metrics_file is not None and current_time - last_metrics_write >= metrics_interval:
+                self.write_metrics()
+                last_metrics_write = current_time
+            
+            # プッシュで届いたメッセージ（完了報告など）はすぐ処理する
+            if self.comm.wait_for_messages(1):
+                self.check_messages()
+                last_message_check = time.time()
     
     def stop(self):
         """自動化を停止"""
         self.running = False
+        self.stop_worker_pool()
+        if self.metrics is not None:
+            self.write_metrics()
+            self.metrics.close()
         self.comm.log_activity("Manager automation stopped")
+        self.comm.flush()
+        self.comm.close()
+        if self.broker is not None:
+            self.broker.close()
+
+def locate_task(task_id, workers, queue=None):
+    """タスクファイル（未着手・実行中）を持っているワーカーを探す"""
+    name = f"{task_id}.json"
+    owners = []
+    for worker in workers:
+        if (Path(f"pending_tasks/{worker}") / name).exists() or \
+                (queue is not None and queue.lease_path(worker, name).exists()):
+            owners.append(worker)
+    return owners
+
+def cancel_task(comm, task_id, workers, queue=None, stats=None):
+    """キャンセルを指示する（Manager 本体と --cancel の両方から使う）。持ち主が見つかれば True"""
+    name = f"{task_id}.json"
+    if queue is not None:
+        # どのワーカーもまだ取得していなければキューから直接取り除く
+        killed_dir = "killed_tasks/queue"
+        os.makedirs(killed_dir, exist_ok=True)
+        try:
+            os.rename(os.path.join(queue.ready_dir, name), os.path.join(killed_dir, name))
+            if stats is not None:
+                stats.task_cancelled(None)
+            comm.log_activity(f"Cancelled queued task {task_id}")
+            return True
+        except FileNotFoundError:
+            pass
+    
+    owners = locate_task(task_id, workers, queue)
+    for worker in owners or workers:
+        # 逐次実行中のワーカーはメッセージをタスクの合間にしか読まないので、子プロセスはここで止める
+        worker_registry(worker).cancel(task_id)
+        comm.send_message(worker, "タスクキャンセル", task_id, "high", data={"task_id": task_id})
+    comm.log_activity(
+        f"Cancel requested for task {task_id} on {', '.join(owners) if owners else 'all workers'}")
+    return bool(owners)
 
 # WorkerCommunicationクラス
 class WorkerCommunication:
-    def __init__(self, worker_name: str):
+    def __init__(self, worker_name: str, log_formats=("text",), transport="socket"):
         self.worker_name = worker_name
-        self.messages_file = "communication/messages.json"
-        self.ensure_communication_dir()
-    
-    def ensure_communication_dir(self):
-        os.makedirs("communication", exist_ok=True)
-        if not os.path.exists(self.messages_file):
-            with open(self.messages_file, 'w') as f:
-                json.dump([], f)
+        self.store = MessageStore("communication")
+        # socket: ブローカー経由で即座に配送（ブローカー不在時はストアへ直接）、file: ストアのみ
+        self.transport = create_transport(transport, worker_name, self.store)
+        # ログは専用スレッドがまとめて書き出す（manager_log.txt / manager_log.jsonl）
+        self.logger = get_activity_logger("manager_log", worker_name, formats=log_formats,
+                                          echo_prefix="MANAGER")
     
-    def send_message(self, to: str, subject: str, message: str, priority: str = "medium"):
+    def send_message(self, to: str, subject: str, message: str, priority: str = "medium", data=None):
         msg = {
             "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
             "from": self.worker_name,
@@ -217,53 +959,129 @@ class WorkerCommunication:
             "subject": subject,
             "message": message,
             "priority": priority,
-            "read": False
+            # 再送時の重複除去に使う
+            "id": new_message_id()
         }
+        if data is not None:
+            # 機械処理用の付加情報（キャンセルするタスクIDなど）
+            msg["data"] = data
         
-        messages = self.read_all_messages()
-        messages.append(msg)
-        self.write_messages(messages)
+        self.transport.send(msg)
         print(f"[{self.worker_name}] Message sent to {to}: {subject}")
     
     def read_messages_for_me(self):
-        messages = self.read_all_messages()
-        my_messages = [msg for msg in messages if msg["to"] == self.worker_name and not msg.get("read", True)]
-        
-        for msg in messages:
-            if msg["to"] == self.worker_name:
-                msg["read"] = True
-        self.write_messages(messages)
-        
-        return my_messages
+        # プッシュで届いた分（file 転送・ブローカー不在時は既読位置から先）だけを読む
+        return self.transport.receive()
+    
+    def subscribe(self):
+        """プッシュ配送の受け取りを開始（ブローカーに接続できたら True）"""
+        return self.transport.subscribe()
+    
+    def wait_for_messages(self, timeout):
+        """メッセージが届くまで最大 timeout 秒待つ（届いたら True）"""
+        return self.transport.wait(timeout)
     
     def read_all_messages(self):
-        try:
-            with open(self.messages_file, 'r') as f:
-                return json.load(f)
-        except:
-            return []
+        return list(self.store.iter_all())
     
-    def write_messages(self, messages):
-        with open(self.messages_file, 'w') as f:
-            json.dump(messages, f, indent=2)
+    def log_activity(self, activity: str, progress=None, event="activity", task_id=None):
+        self.logger.log(activity, progress, event, task_id)
     
-    def log_activity(self, activity: str, progress=None):
-        log_file = "manager_log.txt"
-        
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        log_entry = f"[{timestamp}] {activity}"
-        if progress is not None:
-            log_entry += f" (Progress: {progress}%)"
-        
-        with open(log_file, 'a') as f:
-            f.write(log_entry + "\n")
-        
-        print(f"[MANAGER] {log_entry}")
+    def flush(self):
+        self.logger.flush()
+    
+    def close(self):
+        self.transport.close()
 
 # メイン実行
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manager automation")
+    parser.add_argument("--shared-queue", action="store_true",
+                        help="ワーカー未指定のタスクを task_queue/ready の共有キューに投入")
+    parser.add_argument("--log-format", default="text",
+                        help="ログの出力形式（カンマ区切り: text = manager_log.txt, jsonl = manager_log.jsonl）")
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="Prometheus テキスト形式のメトリクスを http://127.0.0.1:PORT/metrics で公開")
+    parser.add_argument("--metrics-file", default=None,
+                        help="メトリクスを定期的に書き出すファイル（例: metrics/manager.prom）")
+    parser.add_argument("--runtime", choices=RUNTIMES, default="sync",
+                        help="メインループの方式（async = asyncio のイベントループで報告の処理と定期処理を並行）")
+    parser.add_argument("--transport", choices=TRANSPORTS, default="socket",
+                        help="メッセージの転送方式（socket = ブローカー経由で即時配送、file = メッセージストアのみ）")
+    parser.add_argument("--dead-after", type=float, default=10,
+                        help="ハートビートがこの秒数途絶えたワーカーを停止とみなしタスクを再配布")
+    parser.add_argument("--stuck-after", type=float, default=600,
+                        help="1タスクの実行がこの秒数を超えたらキャンセルして別のワーカーへ再配布")
+    parser.add_argument("--max-reschedules", type=int, default=1,
+                        help="タイムアウト・リソース超過・--stuck-after 超過で中断されたタスクを別のワーカーへ再配布する回数の上限")
+    parser.add_argument("--artifact-max-mb", type=int, default=1024,
+                        help="成果物ストア（artifacts/）の容量の上限（MB、超えたら古い成果物から削除。0 = 無制限）")
+    parser.add_argument("--artifact-ttl-days", type=float, default=7,
+                        help="成果物を保持する日数（過ぎたら削除。0 = 無期限）")
+    parser.add_argument("--cancel", metavar="TASK_ID", default=None,
+                        help="実行中の Manager を起動せず、指定したタスクIDのキャンセルだけを送って終了")
+    parser.add_argument("--artifact", metavar="TASK_ID", default=None,
+                        help="実行中の Manager を起動せず、指定したタスクIDの出力を成果物ストアから標準出力へ書き出して終了")
+    parser.add_argument("--workers", default="worker1,worker2,worker3",
+                        help="管理するワーカー（カンマ区切り）")
+    parser.add_argument("--max-workers", type=int, default=None,
+                        help="指定するとワーカーをこのプロセスから起動し、負荷に応じて --min-workers〜この数で増減")
+    parser.add_argument("--min-workers", type=int, default=1,
+                        help="自動起動するワーカーの最小数")
+    parser.add_argument("--worker-args", default="--watch auto",
+                        help="自動起動するワーカーに渡す引数（例: \"--watch auto --max-parallel 2\"）")
+    parser.add_argument("--backlog-per-worker", type=int, default=4,
+                        help="ワーカー1台あたりの待ち件数の目安（これを超えるとワーカーを増やす）")
+    parser.add_argument("--max-load", type=float, default=1.0,
+                        help="CPUあたりのロードアベレージがこの値以上のときはワーカーを増やさない")
+    parser.add_argument("--scale-down-after", type=float, default=30,
+                        help="待ち件数の少ない状態がこの秒数続いたらワーカーを1台減らす")
+    args = parser.parse_args()
+    
+    if args.cancel:
+        comm = WorkerCommunication("manager", args.log_format.split(","), args.transport)
+        queue = WorkQueue() if args.shared_queue else None
+        found = cancel_task(comm, args.cancel, args.workers.split(","), queue)
+        print(f"Cancel {'sent' if found else 'broadcast (task not found)'}: {args.cancel}")
+        comm.flush()
+        comm.close()
+        sys.exit(0)
+    
+    if args.artifact:
+        stream = ArtifactStore().open_task(args.artifact)
+        if stream is None:
+            print(f"No artifact for task: {args.artifact}", file=sys.stderr)
+            sys.exit(1)
+        with stream:
+            shutil.copyfileobj(stream, sys.stdout.buffer)
+        sys.exit(0)
+    
+    # SIGTERM でも Ctrl+C と同じ後始末（管理下のワーカーの停止）を行う
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    
+    worker_pool = None
+    if args.max_workers is not None:
+        worker_pool = WorkerPool(min_workers=args.min_workers, max_workers=args.max_workers,
+                                 worker_args=shlex.split(args.worker_args) + (
+                                     ["--shared-queue"] if args.shared_queue else []),
+                                 transport=args.transport,
+                                 backlog_per_worker=args.backlog_per_worker,
+                                 max_load=args.max_load,
+                                 scale_down_after=args.scale_down_after)
+    
     try:
-        manager = ManagerAutomation()
+        manager = ManagerAutomation(use_queue=args.shared_queue, dead_after=args.dead_after,
+                                    stuck_after=args.stuck_after,
+                                    log_formats=args.log_format.split(","),
+                                    metrics_port=args.metrics_port,
+                                    metrics_file=args.metrics_file,
+                                    transport=args.transport,
+                                    runtime=args.runtime,
+                                    workers=args.workers.split(","),
+                                    max_reschedules=args.max_reschedules,
+                                    artifact_max_mb=args.artifact_max_mb,
+                                    artifact_ttl_days=args.artifact_ttl_days,
+                                    worker_pool=worker_pool)
         manager.run()
     except KeyboardInterrupt:
         print("\nManager automation stopped by user")
@@ -0,0 +1,779 @@
+#!/usr/bin/env python3
+import argparse
+import collections
+import errno
+import fcntl
+import json
+import os
+import queue
+import select
+import selectors
+import socket
+import sys
+import threading
+import time
+import uuid
+
+from message_store import MessageStore
+from task_watcher import create_watcher
+
+DEFAULT_SOCKET = "communication/bus.sock"
+TRANSPORTS = ("socket", "file")
+
+
+def new_message_id():
+    return uuid.uuid4().hex
+
+
+def _frame(obj):
+    return (json.dumps(obj, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+class FileTransport:
+    """従来どおりメッセージストア（JSONLセグメント）へ直接読み書きする"""
+    
+    name = "file"
+    
+    def __init__(self, recipient, store):
+        self.recipient = recipient
+        self.store = store
+    
+    def send(self, msg):
+        self.store.append(msg)
+    
+    def receive(self):
+        return self.store.read_new(self.recipient)
+    
+    def subscribe(self):
+        return False
+    
+    def fileno(self):
+        return None
+    
+    def wait(self, timeout):
+        time.sleep(max(timeout, 0))
+        return False
+    
+    def close(self):
+        pass
+
+
+class SocketTransport:
+    """ブローカーとUnixドメインソケットでつなぎ、受信はプッシュで受け取る
+    
+    送信だけのプロセス（プロセスプールの子など）は購読しないので、同名の受信者を横取りしない。
+    ブローカーに接続できない間はメッセージストアへ直接読み書きし、retry_interval ごとに再接続を試みる。
+    プッシュを受け取るとパイプに1バイト書くので、fileno() を select すれば即座に起きられる。
+    """
+    
+    name = "socket"
+    
+    def __init__(self, recipient, store, socket_path=DEFAULT_SOCKET, retry_interval=5.0):
+        self.recipient = recipient
+        self.store = store
+        self.socket_path = socket_path
+        self.retry_interval = retry_interval
+        
+        self._sock = None
+        self._subscribed = False
+        self._want_subscribe = False
+        self._last_attempt = 0
+        self._lock = threading.Lock()
+        self._inbox = collections.deque()
+        # 再接続時の再送を重複として捨てるための、最近受け取ったID
+        self._seen = collections.OrderedDict()
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_r, False)
+        os.set_blocking(self._wake_w, False)
+    
+    @property
+    def connected(self):
+        return self._sock is not None
+    
+    def _connect(self, force=False):
+        """接続を確保する（失敗しても例外は出さず False）。ロック保持中に呼ぶ"""
+        if self._sock is not None:
+            return True
+        now = time.time()
+        if not force and now - self._last_attempt < self.retry_interval:
+            return False
+        self._last_attempt = now
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.socket_path)
+        except OSError:
+            sock.close()
+            return False
+        self._sock = sock
+        self._subscribed = False
+        threading.Thread(target=self._read_loop, args=(sock,),
+                         name=f"{self.recipient}-bus-reader", daemon=True).start()
+        if self._want_subscribe:
+            self._subscribe_locked()
+        return self._sock is not None
+    
+    def _subscribe_locked(self):
+        try:
+            self._sock.sendall(_frame({"op": "subscribe", "name": self.recipient}))
+            self._subscribed = True
+        except OSError:
+            self._drop(self._sock)
+    
+    def _drop(self, sock):
+        if self._sock is sock and sock is not None:
+            self._sock = None
+            self._subscribed = False
+            try:
+                # 読み込みスレッドの makefile が記述子を保持しているので shutdown で確実に切る
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            try:
+                sock.close()
+            except OSError:
+                pass
+            self._wake()
+    
+    def _wake(self):
+        try:
+            os.write(self._wake_w, b"\0")
+        except (BlockingIOError, OSError):
+            pass
+    
+    def _read_loop(self, sock):
+        try:
+            with sock.makefile('rb') as stream:
+                for raw in stream:
+                    try:
+                        frame = json.loads(raw)
+                    except ValueError:
+                        continue
+                    if frame.get("op") != "deliver":
+                        continue
+                    msg = frame["msg"]
+                    msg_id = msg.get("id")
+                    if msg_id is not None:
+                        if msg_id in self._seen:
+                            continue
+                        self._seen[msg_id] = None
+                        if len(self._seen) > 4096:
+                            self._seen.popitem(last=False)
+                    self._dispatch(msg)
+        except (OSError, ValueError):
+            pass
+        with self._lock:
+            self._drop(sock)
+    
+    def _dispatch(self, msg):
+        self._inbox.append(msg)
+        self._wake()
+    
+    def subscribe(self):
+        """プッシュの受け取りを開始（ブローカーが未読分を先に送ってくる）"""
+        with self._lock:
+            self._want_subscribe = True
+            if self._connect(force=True) and not self._subscribed:
+                self._subscribe_locked()
+            return self._subscribed
+    
+    def send(self, msg):
+        with self._lock:
+            if self._connect():
+                try:
+                    self._sock.sendall(_frame({"op": "publish", "msg": msg}))
+                    return
+                except OSError:
+                    self._drop(self._sock)
+        # ブローカーがいない間はストアに直接追記（ブローカーが起動後に購読者へ届ける）
+        self.store.append(msg)
+    
+    def receive(self):
+        with self._lock:
+            self._want_subscribe = True
+            if self._connect() and not self._subscribed:
+                self._subscribe_locked()
+            subscribed = self._subscribed
+        
+        # 起こされた分を先に捨ててから取り出す（取りこぼさないため）
+        try:
+            while os.read(self._wake_r, 4096):
+                pass
+        except (BlockingIOError, OSError):
+            pass
+        messages = []
+        while self._inbox:
+            messages.append(self._inbox.popleft())
+        if not subscribed:
+            messages.extend(self.store.read_new(self.recipient))
+        return messages
+    
+    def fileno(self):
+        return self._wake_r
+    
+    def wait(self, timeout):
+        """プッシュが届くか接続が切れるまで最大 timeout 秒待つ"""
+        readable, _, _ = select.select([self._wake_r], [], [], max(timeout, 0))
+        return bool(readable)
+    
+    def close(self):
+        with self._lock:
+            self._want_subscribe = False
+            self._drop(self._sock)
+        for fd in (self._wake_r, self._wake_w):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+        self._wake_r = self._wake_w = -1
+
+
+class SharedSocketTransport(SocketTransport):
+    """1本の接続で複数の受信者を購読し、届いたメッセージを宛先ごとのチャネルに振り分ける
+    
+    1つのプロセスで複数のワーカーを動かすとき用。channel(name) が各ワーカーの転送になる。
+    プッシュが届くと共有のパイプで起こすので、fileno() を1つ監視すれば全ワーカー分を待てる。
+    """
+    
+    def __init__(self, store, socket_path=DEFAULT_SOCKET, retry_interval=5.0):
+        super().__init__("shared", store, socket_path, retry_interval)
+        self.channels = {}
+    
+    def channel(self, recipient):
+        channel = self.channels[recipient] = _Channel(self, recipient)
+        return channel
+    
+    def _subscribe_locked(self):
+        try:
+            for name, channel in self.channels.items():
+                if channel.subscribed:
+                    self._sock.sendall(_frame({"op": "subscribe", "name": name}))
+            self._subscribed = True
+        except OSError:
+            self._drop(self._sock)
+    
+    def _dispatch(self, msg):
+        channel = self.channels.get(msg.get("to"))
+        if channel is not None:
+            channel.inbox.append(msg)
+        self._wake()
+    
+    def add_subscriber(self, recipient):
+        """チャネルの購読を開始（接続済みならその宛先だけを購読する）"""
+        with self._lock:
+            self.channels[recipient].subscribed = True
+            self._want_subscribe = True
+            # 新たにつないだ場合は _connect が全チャネルをまとめて購読する
+            was_subscribed = self._subscribed
+            if not self._connect(force=True):
+                return False
+            if not self._subscribed:
+                self._subscribe_locked()
+            elif was_subscribed:
+                try:
+                    self._sock.sendall(_frame({"op": "subscribe", "name": recipient}))
+                except OSError:
+                    self._drop(self._sock)
+            return self._subscribed
+    
+    def remove_subscriber(self, recipient):
+        """チャネルの購読をやめる（以降の宛先のメッセージはストアに残る）"""
+        with self._lock:
+            channel = self.channels.pop(recipient, None)
+            if channel is None or not channel.subscribed or self._sock is None:
+                return
+            try:
+                self._sock.sendall(_frame({"op": "unsubscribe", "name": recipient}))
+            except OSError:
+                self._drop(self._sock)
+    
+    def ensure_subscribed(self):
+        """切断されていれば再接続して購読し直す（購読中なら True）"""
+        with self._lock:
+            if self._want_subscribe and self._connect() and not self._subscribed:
+                self._subscribe_locked()
+            return self._subscribed
+    
+    def drain(self):
+        """起こされた分を捨てる（チャネルの受信箱を読む前に呼ぶ）"""
+        try:
+            while os.read(self._wake_r, 4096):
+                pass
+        except (BlockingIOError, OSError):
+            pass
+    
+    def receive(self):
+        return []
+
+
+class _Channel:
+    """SharedSocketTransport の宛先1つ分（ワーカーからは通常の転送として使う）"""
+    
+    name = "socket"
+    
+    def __init__(self, shared, recipient):
+        self.shared = shared
+        self.recipient = recipient
+        self.store = shared.store
+        self.inbox = collections.deque()
+        self.subscribed = False
+    
+    def send(self, msg):
+        self.shared.send(msg)
+    
+    def subscribe(self):
+        return self.shared.add_subscriber(self.recipient)
+    
+    def receive(self):
+        subscribed = self.shared.ensure_subscribed()
+        messages = []
+        while self.inbox:
+            messages.append(self.inbox.popleft())
+        if not subscribed:
+            messages.extend(self.store.read_new(self.recipient))
+        return messages
+    
+    def has_messages(self):
+        return bool(self.inbox)
+    
+    def fileno(self):
+        # 待つのは共有の記述子（呼び出し側がまとめて監視する）
+        return None
+    
+    def wait(self, timeout):
+        readable, _, _ = select.select([self.shared.fileno()], [], [], max(timeout, 0))
+        return bool(readable)
+    
+    def close(self):
+        self.shared.remove_subscriber(self.recipient)
+
+
+def create_transport(kind, recipient, store, socket_path=DEFAULT_SOCKET):
+    if kind == "file":
+        return FileTransport(recipient, store)
+    if kind == "socket":
+        return SocketTransport(recipient, store, socket_path)
+    raise ValueError(f"Unknown transport: {kind}")
+
+
+class _Connection:
+    def __init__(self, sock):
+        self.sock = sock
+        self.buffer = b""
+        # 1本の接続で複数の宛先を購読できる（1プロセスで複数のワーカーを動かす場合）
+        self.names = set()
+        # ソケットに書き切れなかったプッシュ（受け付けスレッドが書き込めるようになったら送る）
+        self.outbox = bytearray()
+        self.closed = False
+
+
+class MessageBroker:
+    """Unixドメインソケットのメッセージブローカー
+    
+    publish されたメッセージは購読中の宛先へその場で送り、永続化は裏スレッドが
+    まとめて MessageStore に追記する。購読者の既読位置はブローカーが進め、
+    プッシュ済みのメッセージはストアから読み戻したときに読み飛ばす。
+    ストアに直接書かれたメッセージ（file 転送の送信者）も監視して購読者に届ける。
+    購読の開始時には未読分を送るので、切断中に届いたメッセージも失われない
+    （切断直前に送ったものは再送されうる。受信側は id で重複を捨てる）。
+    
+    プッシュはロックを持ったまま待つことのないよう、接続ごとの送信バッファに積んでノンブロッキングで書き、
+    書き切れない分は受け付けスレッドが送る。読まない購読者のバッファが max_outbox に達したら、
+    その宛先へのプッシュを止めてメッセージをストアに残し、バッファが空いたらストアから続きを送る
+    （遅い購読者が他の購読者への配送を止めることも、ブローカーのメモリを使い続けることもない）。
+    バッファに残ったまま切断された分は、既読位置を戻して再購読時に送り直す。
+    """
+    
+    def __init__(self, store=None, socket_path=DEFAULT_SOCKET, max_outbox=8 * 1024 * 1024, batch_size=1000):
+        self.store = store or MessageStore("communication")
+        self.socket_path = socket_path
+        self.max_outbox = max_outbox
+        self.batch_size = batch_size
+        self.lock_path = f"{socket_path}.lock"
+        
+        self._lock = threading.RLock()
+        self._subscribers = {}
+        self._pushed = {}
+        # 送信バッファに残っている宛先の既読位置の戻し先と、切断時に戻した位置
+        self._rewind = {}
+        self._rewound = {}
+        # バッファが埋まったためプッシュを止め、ストアから送る宛先
+        self._resync = set()
+        # 受け付けスレッドに書き込みの監視・ソケットのクローズを頼む接続と、それを知らせるパイプ
+        self._dirty = set()
+        self._wake_r = self._wake_w = -1
+        self._persist_queue = queue.Queue()
+        self._stop = threading.Event()
+        self._threads = []
+        self._listener = None
+        self._lock_file = None
+        self.delivered = 0
+        self.persisted = 0
+    
+    # ---- 起動・停止 ----
+    
+    def bind(self):
+        """ソケットを開く。他のブローカーが動いていれば False"""
+        directory = os.path.dirname(self.socket_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock_file = open(self.lock_path, 'a')
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError as e:
+            self._lock_file.close()
+            self._lock_file = None
+            if e.errno in (errno.EAGAIN, errno.EACCES):
+                return False
+            raise
+        
+        # ロックを取れた = 以前のブローカーは終了済み。残ったソケットファイルを消す
+        try:
+            os.unlink(self.socket_path)
+        except FileNotFoundError:
+            pass
+        self._listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._listener.bind(self.socket_path)
+        self._listener.listen(128)
+        self._listener.setblocking(False)
+        return True
+    
+    def start(self):
+        """裏スレッドで動かす。他のブローカーが動いていれば何もせず False"""
+        if not self.bind():
+            return False
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_r, False)
+        os.set_blocking(self._wake_w, False)
+        for target, name in ((self._serve, "bus-broker"), (self._persist_loop, "bus-persist"),
+                             (self._watch_loop, "bus-watch")):
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return True
+    
+    def close(self):
+        if self._listener is None:
+            return
+        self._stop.set()
+        self._persist_queue.put(None)
+        for thread in self._threads:
+            thread.join(timeout=5)
+        self._threads = []
+        with self._lock:
+            for conn in list(self._subscribers.values()):
+                conn.sock.close()
+            self._subscribers.clear()
+            self._dirty.clear()
+        self._listener.close()
+        self._listener = None
+        try:
+            os.unlink(self.socket_path)
+        except FileNotFoundError:
+            pass
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+    
+    # ---- 受け付け ----
+    
+    def _wake(self):
+        try:
+            os.write(self._wake_w, b"\0")
+        except (BlockingIOError, OSError):
+            pass
+    
+    def _update_selector(self, selector):
+        """他のスレッドが積んだ送信待ち・切断を受け付けスレッドの監視に反映する"""
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+        for conn in dirty:
+            try:
+                if conn.closed:
+                    selector.unregister(conn.sock)
+                    conn.sock.close()
+                else:
+                    events = selectors.EVENT_READ | (selectors.EVENT_WRITE if conn.outbox else 0)
+                    selector.modify(conn.sock, events, conn)
+            except (KeyError, ValueError):
+                pass
+    
+    def _serve(self):
+        selector = selectors.DefaultSelector()
+        selector.register(self._listener, selectors.EVENT_READ)
+        selector.register(self._wake_r, selectors.EVENT_READ)
+        try:
+            while not self._stop.is_set():
+                self._update_selector(selector)
+                for key, events in selector.select(timeout=0.5):
+                    if key.fileobj is self._listener:
+                        try:
+                            sock, _ = self._listener.accept()
+                        except BlockingIOError:
+                            continue
+                        sock.setblocking(False)
+                        selector.register(sock, selectors.EVENT_READ, _Connection(sock))
+                        continue
+                    if key.fileobj == self._wake_r:
+                        try:
+                            while os.read(self._wake_r, 4096):
+                                pass
+                        except (BlockingIOError, OSError):
+                            pass
+                        continue
+                    
+                    conn = key.data
+                    if events & selectors.EVENT_WRITE:
+                        with self._lock:
+                            self._flush(conn)
+                            resync = [name for name in conn.names if name in self._resync]
+                        if not conn.closed and not conn.outbox:
+                            selector.modify(conn.sock, selectors.EVENT_READ, conn)
+                            # 止めていたプッシュの続きをストアから送る
+                            for name in resync:
+                                self._sync(name)
+                    if not events & selectors.EVENT_READ or conn.closed:
+                        continue
+                    try:
+                        data = conn.sock.recv(256 * 1024)
+                    except (BlockingIOError, socket.timeout):
+                        continue
+                    except OSError:
+                        data = b""
+                    if not data:
+                        selector.unregister(conn.sock)
+                        self._disconnect(conn)
+                        continue
+                    conn.buffer += data
+                    *lines, conn.buffer = conn.buffer.split(b"\n")
+                    for line in lines:
+                        if line:
+                            self._handle(conn, line)
+        finally:
+            selector.close()
+            os.close(self._wake_r)
+            os.close(self._wake_w)
+    
+    def _handle(self, conn, line):
+        try:
+            frame = json.loads(line)
+        except ValueError:
+            return
+        op = frame.get("op")
+        if op == "publish" and isinstance(frame.get("msg"), dict):
+            self.publish(frame["msg"])
+        elif op == "subscribe" and frame.get("name"):
+            name = frame["name"]
+            with self._lock:
+                previous = self._subscribers.get(name)
+                if previous is not None and previous is not conn:
+                    previous.names.discard(name)
+                conn.names.add(name)
+                self._subscribers[name] = conn
+                self._pushed.setdefault(name, set())
+                self._rewound.pop(name, None)
+                self._resync.discard(name)
+            # 切断中に溜まった未読分を先に届ける
+            self._sync(name)
+        elif op == "unsubscribe" and frame.get("name"):
+            with self._lock:
+                self._unsubscribe(conn, frame["name"])
+    
+    def _unsubscribe(self, conn, name):
+        """ロック保持中に呼ぶ。送信バッファに残っていた分は既読位置を戻して再購読時に送り直す"""
+        conn.names.discard(name)
+        if self._subscribers.get(name) is conn:
+            del self._subscribers[name]
+            self._pushed.pop(name, None)
+            self._resync.discard(name)
+            cursor = self._rewind.pop(name, None)
+            if cursor is not None:
+                self.store.save_cursor(name, *cursor)
+                self._rewound[name] = cursor
+    
+    def _disconnect(self, conn):
+        with self._lock:
+            conn.closed = True
+            for name in list(conn.names):
+                self._unsubscribe(conn, name)
+        conn.sock.close()
+    
+    def _drop(self, conn):
+        """ロック保持中に呼ぶ。購読をすべて外し、ソケットは受け付けスレッドに閉じさせる"""
+        conn.closed = True
+        for name in list(conn.names):
+            self._unsubscribe(conn, name)
+        conn.outbox.clear()
+        self._dirty.add(conn)
+        self._wake()
+    
+    def _flush(self, conn):
+        """ロック保持中に呼ぶ。送信バッファを書けるだけ書く（待たない）"""
+        while conn.outbox and not conn.closed:
+            try:
+                sent = conn.sock.send(conn.outbox)
+            except BlockingIOError:
+                return
+            except OSError:
+                self._drop(conn)
+                return
+            del conn.outbox[:sent]
+        if not conn.outbox:
+            # すべて書けたので、切断されても送り直す必要はない
+            for name in conn.names:
+                self._rewind.pop(name, None)
+    
+    def _start_cursor(self, name):
+        cursor = self.store.load_cursor(name)
+        if cursor is None:
+            seqs = self.store.list_segments()
+            cursor = (seqs[0] if seqs else 1, 0)
+        return cursor
+    
+    def _deliver(self, conn, msg, cursor=None, bounded=True):
+        """ロック保持中に呼ぶ。接続の送信バッファに積んで書けるだけ書く（待たない）
+        
+        書き切れなければ、切断時に送り直せるよう宛先の既読位置の戻し先（cursor、なければ現在の位置）を
+        覚えておく。bounded なら、バッファが max_outbox に達している接続には積まずに False を返す。
+        """
+        if conn.closed or (bounded and len(conn.outbox) >= self.max_outbox):
+            return False
+        to = msg.get("to")
+        if conn.outbox and to not in self._rewind:
+            self._rewind[to] = cursor or self._start_cursor(to)
+        backlog = bool(conn.outbox)
+        conn.outbox += _frame({"op": "deliver", "msg": msg})
+        if not backlog:
+            self._flush(conn)
+            if conn.closed:
+                return False
+            if conn.outbox:
+                self._rewind.setdefault(to, cursor or self._start_cursor(to))
+                self._dirty.add(conn)
+                self._wake()
+        self.delivered += 1
+        return True
+    
+    def publish(self, msg):
+        """購読中の宛先へ即座に送り、永続化を予約する"""
+        msg.setdefault("id", new_message_id())
+        to = msg.get("to")
+        with self._lock:
+            conn = self._subscribers.get(to)
+            if conn is not None:
+                if to not in self._resync and self._deliver(conn, msg):
+                    self._pushed[to].add(msg["id"])
+                elif not conn.closed:
+                    # 読み切れていない購読者には送らず、バッファが空いてからストアの順に送る
+                    self._resync.add(to)
+        self._persist_queue.put(msg)
+    
+    # ---- 永続化と既読位置 ----
+    
+    def _sync(self, name):
+        """ストアの未読分を読み、まだプッシュしていないものを送る
+        
+        publish はプッシュ済みの印を永続化の予約より先に付けるので、ファイルの読み込みは
+        ロックの外で行ってよい（その間もプッシュは止まらない）。一度に読むのは送信バッファの
+        空き分までで、バッファが残っていれば空いたときに受け付けスレッドが続きを読む。
+        """
+        while True:
+            with self._lock:
+                conn = self._subscribers.get(name)
+                if conn is None:
+                    return
+                budget = self.max_outbox - len(conn.outbox)
+                if budget <= 0:
+                    self._resync.add(name)
+                    return
+                self._resync.discard(name)
+            cursor = self.store.load_cursor(name)
+            messages = self.store.read_new(name, max_bytes=budget)
+            if not messages:
+                return
+            with self._lock:
+                conn = self._subscribers.get(name)
+                pushed = self._pushed.get(name, set())
+                for msg in messages:
+                    msg_id = msg.get("id")
+                    if msg_id in pushed:
+                        pushed.discard(msg_id)
+                    elif conn is None or not self._deliver(conn, msg, cursor, bounded=False):
+                        # 届けられなかったので既読位置を戻し、再購読時に送り直す
+                        # （切断時に送信バッファの分をさらに前へ戻していればそちらを残す）
+                        rewound = self._rewound.get(name)
+                        if rewound is not None and (cursor is None or tuple(rewound) < tuple(cursor)):
+                            cursor = rewound
+                        if cursor is not None:
+                            self.store.save_cursor(name, *cursor)
+                        return
+                if conn.outbox:
+                    self._resync.add(name)
+                    return
+    
+    def sync_all(self):
+        with self._lock:
+            names = list(self._subscribers)
+        for name in names:
+            try:
+                self._sync(name)
+            except OSError as e:
+                print(f"[BUS] Failed to read messages for {name}: {e}", file=sys.stderr)
+    
+    def _persist_loop(self):
+        while True:
+            batch = [self._persist_queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._persist_queue.get_nowait())
+                except queue.Empty:
+                    break
+            msgs = [msg for msg in batch if msg is not None]
+            if msgs:
+                try:
+                    self.store.append_many(msgs)
+                    self.persisted += len(msgs)
+                except Exception as e:
+                    print(f"[BUS] Failed to persist {len(msgs)} messages: {e}", file=sys.stderr)
+            if len(msgs) < len(batch):
+                return
+    
+    def _watch_loop(self, debounce=0.02):
+        """ストアへの追記を監視し、既読位置を進める（直接追記されたメッセージは購読者に届ける）"""
+        watcher = create_watcher()
+        watcher.add(self.store.segments_dir, "messages")
+        try:
+            while not self._stop.is_set():
+                if watcher.wait(1.0):
+                    # 連続した追記はまとめて1回で読む
+                    self._stop.wait(debounce)
+                    watcher.wait(0)
+                    self.sync_all()
+        finally:
+            watcher.close()
+
+
+def start_broker(store=None, socket_path=DEFAULT_SOCKET):
+    """プロセス内でブローカーを起動。既に他で動いていれば None"""
+    broker = MessageBroker(store, socket_path)
+    return broker if broker.start() else None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Message bus broker (Unix domain socket)")
+    parser.add_argument("--socket", default=DEFAULT_SOCKET, help="ソケットのパス")
+    parser.add_argument("--base-dir", default="communication", help="メッセージストアのディレクトリ")
+    args = parser.parse_args()
+    
+    broker = MessageBroker(MessageStore(args.base_dir), args.socket)
+    if not broker.start():
+        print(f"Another broker is already serving {args.socket}", file=sys.stderr)
+        sys.exit(1)
+    print(f"[BUS] Listening on {args.socket}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        broker.close()
+        print(f"[BUS] Stopped (delivered {broker.delivered}, persisted {broker.persisted})")
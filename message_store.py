@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+import fcntl
+import json
+import os
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+
+class MessageStore:
+    """追記専用のJSONLセグメントで構成されるメッセージストア
+    
+    communication/messages/segment_XXXXXXXX.jsonl に1行1メッセージで追記し、
+    受信者ごとの既読位置は communication/cursors/<受信者>.json に保持する。
+    送信・受信のコストは履歴の総量ではなく未読分の量にのみ比例する。
+    """
+    
+    SEGMENT_PREFIX = "segment_"
+    SEGMENT_SUFFIX = ".jsonl"
+    
+    def __init__(self, base_dir="communication", segment_max_bytes=4 * 1024 * 1024, fsync=True):
+        self.base_dir = base_dir
+        self.segments_dir = os.path.join(base_dir, "messages")
+        self.cursors_dir = os.path.join(base_dir, "cursors")
+        self.lock_file = os.path.join(base_dir, "messages.lock")
+        self.legacy_file = os.path.join(base_dir, "messages.json")
+        self.segment_max_bytes = segment_max_bytes
+        self.fsync = fsync
+        
+        # グループコミット用の状態
+        self._cond = threading.Condition()
+        self._pending = []
+        self._filling_batch = 1
+        self._committed_batch = 0
+        self._failed_batch = None
+        self._leader_active = False
+        self._cursor_locks = {}
+        
+        self.ensure_directories()
+        self.migrate_legacy_file()
+    
+    def ensure_directories(self):
+        """必要なディレクトリを確保"""
+        os.makedirs(self.segments_dir, exist_ok=True)
+        os.makedirs(self.cursors_dir, exist_ok=True)
+    
+    @contextmanager
+    def _file_lock(self, path):
+        """プロセス間の排他ロック（flock）"""
+        with open(path, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+    
+    # ---- セグメント管理 ----
+    
+    def _segment_path(self, seq):
+        return os.path.join(self.segments_dir, f"{self.SEGMENT_PREFIX}{seq:08d}{self.SEGMENT_SUFFIX}")
+    
+    def list_segments(self):
+        """存在するセグメント番号を昇順で返す"""
+        seqs = []
+        for name in os.listdir(self.segments_dir):
+            if name.startswith(self.SEGMENT_PREFIX) and name.endswith(self.SEGMENT_SUFFIX):
+                try:
+                    seqs.append(int(name[len(self.SEGMENT_PREFIX):-len(self.SEGMENT_SUFFIX)]))
+                except ValueError:
+                    continue
+        return sorted(seqs)
+    
+    def disk_usage(self):
+        """(セグメント数, 合計バイト数) を返す"""
+        count, total = 0, 0
+        for seq in self.list_segments():
+            try:
+                total += os.path.getsize(self._segment_path(seq))
+                count += 1
+            except FileNotFoundError:
+                continue
+        return count, total
+    
+    def _active_segment(self):
+        """書き込み先のセグメント番号（ロック保持中に呼ぶ）"""
+        seqs = self.list_segments()
+        if not seqs:
+            return 1, False
+        active = seqs[-1]
+        if os.path.getsize(self._segment_path(active)) >= self.segment_max_bytes:
+            return active + 1, True
+        return active, False
+    
+    # ---- 書き込み ----
+    
+    def append(self, msg):
+        """メッセージを追記する（同時送信はまとめて1回の書き込みで確定）"""
+        line = json.dumps(msg, ensure_ascii=False) + "\n"
+        with self._cond:
+            self._pending.append(line)
+            my_batch = self._filling_batch
+            # 他スレッドがリーダーとして書き込み中なら、自分のバッチが確定するまで待つ
+            while self._committed_batch < my_batch and self._leader_active:
+                self._cond.wait()
+            if self._committed_batch >= my_batch:
+                if self._failed_batch and self._failed_batch[0] == my_batch:
+                    raise self._failed_batch[1]
+                return
+            self._leader_active = True
+            batch = self._pending
+            self._pending = []
+            self._filling_batch += 1
+        
+        try:
+            self._write_batch(batch)
+        except Exception as e:
+            with self._cond:
+                self._failed_batch = (my_batch, e)
+            raise
+        finally:
+            with self._cond:
+                self._committed_batch = my_batch
+                self._leader_active = False
+                self._cond.notify_all()
+    
+    def append_many(self, msgs):
+        """複数メッセージを1回の書き込みで追記"""
+        if msgs:
+            self._write_batch([json.dumps(m, ensure_ascii=False) + "\n" for m in msgs])
+    
+    def _write_batch(self, lines):
+        rotated = False
+        with self._file_lock(self.lock_file):
+            seq, rotated = self._active_segment()
+            fd = os.open(self._segment_path(seq), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, "".join(lines).encode("utf-8"))
+                if self.fsync:
+                    os.fsync(fd)
+            finally:
+                os.close(fd)
+        if rotated:
+            self.compact()
+    
+    # ---- 読み込み ----
+    
+    def _cursor_path(self, recipient):
+        return os.path.join(self.cursors_dir, f"{recipient}.json")
+    
+    def load_cursor(self, recipient):
+        """受信者の既読位置 (segment, offset) を返す。未登録ならNone"""
+        try:
+            with open(self._cursor_path(recipient), 'r') as f:
+                cursor = json.load(f)
+            return cursor["segment"], cursor["offset"]
+        except (OSError, ValueError, KeyError):
+            return None
+    
+    def save_cursor(self, recipient, segment, offset):
+        path = self._cursor_path(recipient)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({"segment": segment, "offset": offset}, f)
+        os.replace(tmp_path, path)
+    
+    def _scan(self, segment, offset):
+        """指定位置以降の完結した行を (seq, 次のoffset, メッセージ) で返す"""
+        for seq in self.list_segments():
+            if seq < segment:
+                continue
+            start = offset if seq == segment else 0
+            try:
+                with open(self._segment_path(seq), 'rb') as f:
+                    f.seek(start)
+                    pos = start
+                    for raw in f:
+                        # 書き込み途中の行は次回に回す
+                        if not raw.endswith(b"\n"):
+                            break
+                        pos += len(raw)
+                        try:
+                            msg = json.loads(raw)
+                        except ValueError:
+                            continue
+                        yield seq, pos, msg
+            except FileNotFoundError:
+                continue
+    
+    def read_new(self, recipient, max_bytes=None):
+        """未読メッセージを返し、既読位置を進める
+        
+        max_bytes を指定すると、返すメッセージの行の合計がそれを超えたところで止める（残りは次回）。
+        """
+        thread_lock = self._cursor_locks.setdefault(recipient, threading.Lock())
+        with thread_lock, self._file_lock(f"{self._cursor_path(recipient)}.lock"):
+            cursor = self.load_cursor(recipient)
+            if cursor is None:
+                seqs = self.list_segments()
+                cursor = (seqs[0] if seqs else 1, 0)
+            segment, offset = cursor
+            
+            my_messages = []
+            size = 0
+            for seq, pos, msg in self._scan(segment, offset):
+                line_bytes = pos - (offset if seq == segment else 0)
+                segment, offset = seq, pos
+                if msg.get("to") == recipient:
+                    my_messages.append(msg)
+                    size += line_bytes
+                    if max_bytes is not None and size >= max_bytes:
+                        break
+            
+            if (segment, offset) != cursor or self.load_cursor(recipient) is None:
+                self.save_cursor(recipient, segment, offset)
+            return my_messages
+    
+    def iter_all(self):
+        """保持している全メッセージを順に返す"""
+        for _, _, msg in self._scan(0, 0):
+            yield msg
+    
+    # ---- コンパクション ----
+    
+    def _has_passed(self, recipient, seq, size):
+        cursor = self.load_cursor(recipient)
+        if cursor is None:
+            return False
+        return cursor[0] > seq or (cursor[0] == seq and cursor[1] >= size)
+    
+    def compact(self):
+        """全受信者が読み終えた古いセグメントを削除する"""
+        removed = 0
+        with self._file_lock(self.lock_file):
+            seqs = self.list_segments()
+            for seq in seqs[:-1]:
+                recipients = set()
+                try:
+                    with open(self._segment_path(seq), 'rb') as f:
+                        for raw in f:
+                            try:
+                                recipients.add(json.loads(raw).get("to"))
+                            except ValueError:
+                                continue
+                except FileNotFoundError:
+                    continue
+                
+                # 既読位置が未登録、またはこのセグメントを読み終えていない受信者がいれば残す
+                size = os.path.getsize(self._segment_path(seq))
+                if all(self._has_passed(r, seq, size) for r in recipients):
+                    os.remove(self._segment_path(seq))
+                    removed += 1
+                else:
+                    break
+        return removed
+    
+    # ---- 旧形式からの移行 ----
+    
+    def migrate_legacy_file(self):
+        """旧 messages.json の未読メッセージをセグメントへ移す"""
+        if not os.path.exists(self.legacy_file):
+            return
+        with self._file_lock(self.lock_file):
+            if not os.path.exists(self.legacy_file):
+                return
+            try:
+                with open(self.legacy_file, 'r') as f:
+                    legacy = json.load(f)
+            except ValueError:
+                legacy = []
+            unread = []
+            for msg in legacy if isinstance(legacy, list) else []:
+                if not msg.get("read", True):
+                    msg = dict(msg)
+                    msg.pop("read", None)
+                    unread.append(json.dumps(msg, ensure_ascii=False) + "\n")
+            if unread:
+                seq, _ = self._active_segment()
+                with open(self._segment_path(seq), 'a') as f:
+                    f.write("".join(unread))
+            Path(self.legacy_file).rename(f"{self.legacy_file}.migrated")
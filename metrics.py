@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+import bisect
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# タスクのレイテンシ用バケット（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+# タスクの各段階: (開始の時刻, 終了の時刻)
+TASK_STAGES = {
+    "queue_wait": ("enqueued_at", "claimed_at"),
+    "pickup": ("claimed_at", "started_at"),
+    "run": ("started_at", "ended_at"),
+    "report": ("ended_at", "acked_at"),
+    "total": ("enqueued_at", "acked_at"),
+}
+
+
+def stage_latencies(timings):
+    """タイムスタンプの dict から段階ごとの所要時間を求める（揃っている段階のみ）"""
+    latencies = {}
+    for stage, (start, end) in TASK_STAGES.items():
+        if timings.get(start) is not None and timings.get(end) is not None:
+            latencies[stage] = max(timings[end] - timings[start], 0.0)
+    return latencies
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+               for value in labels.values())
+    return "{" + ",".join(f'{key}="{value}"' for key, value in zip(labels, escaped)) + "}"
+
+
+class Histogram:
+    """Prometheus 形式の累積ヒストグラム（ラベルの組ごと）"""
+    
+    def __init__(self, name, help_text, label_names, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._series = {}
+    
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        series = self._series.get(key)
+        if series is None:
+            # バケットごとの件数（最後は +Inf）、合計、件数
+            series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+    
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total, count) in sorted(self._series.items()):
+            labels = dict(zip(self.label_names, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_format_labels({**labels, 'le': bound})} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """ヒストグラムと、出力時に値を取得するゲージをまとめて Prometheus テキスト形式で出力"""
+    
+    def __init__(self):
+        self._histograms = {}
+        self._gauges = []
+        self._lock = threading.Lock()
+        self._server = None
+    
+    def histogram(self, name, help_text, label_names, buckets=LATENCY_BUCKETS):
+        with self._lock:
+            if name not in self._histograms:
+                self._histograms[name] = Histogram(name, help_text, label_names, buckets)
+            return self._histograms[name]
+    
+    def observe(self, name, value, **labels):
+        with self._lock:
+            self._histograms[name].observe(value, **labels)
+    
+    def gauge(self, name, help_text, collect):
+        """collect() は値、または {ラベルのdict をタプル化したもの: 値} を返す"""
+        with self._lock:
+            self._gauges.append((name, help_text, collect))
+    
+    def render(self):
+        lines = []
+        with self._lock:
+            for histogram in self._histograms.values():
+                lines.extend(histogram.render())
+            gauges = list(self._gauges)
+        for name, help_text, collect in gauges:
+            try:
+                values = collect()
+            except Exception:
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            if isinstance(values, dict):
+                for labels, value in sorted(values.items()):
+                    lines.append(f"{name}{_format_labels(dict(labels))} {value}")
+            else:
+                lines.append(f"{name} {values}")
+        return "\n".join(lines) + "\n"
+    
+    # ---- 公開 ----
+    
+    def write_file(self, path):
+        """node_exporter の textfile collector 等で読めるよう原子的に書き出す"""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.tmp{os.getpid()}"
+        with open(tmp_path, 'w') as f:
+            f.write(self.render())
+        os.replace(tmp_path, path)
+    
+    def serve(self, port, host="127.0.0.1"):
+        """GET /metrics に応答するHTTPサーバーを裏スレッドで起動"""
+        registry = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?", 1)[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            
+            def log_message(self, format, *args):
+                pass
+        
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="metrics-http", daemon=True).start()
+        return self._server.server_address
+    
+    def close(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
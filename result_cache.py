@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+import hashlib
+import json
+import os
+import subprocess
+import threading
+import time
+from pathlib import Path
+
+
+class ResultCache:
+    """command / script タスクの実行結果を内容アドレスで保存するキャッシュ
+    
+    キーはタスク本体（command または script）、作業ディレクトリ、
+    宣言された入力ファイル（task の "inputs"）の内容ハッシュから求める。
+    ディスク上の合計サイズが max_bytes を超えたら、最も古く使われたエントリから削除する（LRU）。
+    """
+    
+    def __init__(self, cache_dir="cache/results", max_bytes=256 * 1024 * 1024,
+                 max_entry_bytes=4 * 1024 * 1024, stats_dir="cache/stats"):
+        self.cache_dir = cache_dir
+        self.stats_dir = stats_dir
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._last_stats_write = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+        os.makedirs(self.stats_dir, exist_ok=True)
+        # 合計サイズは最初の保存時に1回だけ走査して求める
+        self._total_bytes = None
+    
+    # ---- キー ----
+    
+    def is_cacheable(self, task_data):
+        """キャッシュ対象か（command / script で、"cache": false が指定されていない）"""
+        return ('command' in task_data or 'script' in task_data) and task_data.get('cache', True)
+    
+    def fingerprint(self, path):
+        """入力ファイルの内容ハッシュ（存在しなければ None）"""
+        digest = hashlib.sha256()
+        try:
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    digest.update(chunk)
+        except FileNotFoundError:
+            return None
+        return digest.hexdigest()
+    
+    def key_for(self, task_data, cwd):
+        payload = {
+            "command": task_data.get('command'),
+            "script": task_data.get('script'),
+            "cwd": os.path.abspath(cwd),
+            "inputs": {path: self.fingerprint(os.path.join(cwd, path))
+                       for path in sorted(task_data.get('inputs', []))},
+        }
+        return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+    
+    def _entry_path(self, key):
+        return Path(self.cache_dir) / key[:2] / f"{key}.json"
+    
+    # ---- 取得・保存 ----
+    
+    def get(self, key):
+        """キャッシュ済みの結果（CompletedProcess）を返す。なければ None"""
+        path = self._entry_path(key)
+        try:
+            with open(path, 'r') as f:
+                entry = json.load(f)
+            # LRU 用に最終使用時刻を更新
+            os.utime(path)
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return subprocess.CompletedProcess(entry["args"], entry["returncode"],
+                                           entry["stdout"], entry["stderr"])
+    
+    def put(self, key, result):
+        """成功した結果を保存（出力の一部しか手元にない場合・大きすぎる場合は保存しない）"""
+        if result.returncode != 0 or result.stdout is None:
+            return False
+        if getattr(result, "stdout_bytes", len(result.stdout)) > len(result.stdout.encode("utf-8")):
+            return False
+        data = json.dumps({
+            "args": result.args if isinstance(result.args, str) else list(map(str, result.args)),
+            "returncode": result.returncode,
+            "stdout": result.stdout,
+            "stderr": result.stderr,
+            "created": time.time(),
+        }, ensure_ascii=False).encode("utf-8")
+        if len(data) > self.max_entry_bytes:
+            return False
+        
+        path = self._entry_path(key)
+        os.makedirs(path.parent, exist_ok=True)
+        tmp_path = path.with_suffix(f".tmp{os.getpid()}_{threading.get_ident()}")
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        
+        if self._total_bytes is None:
+            self._total_bytes = sum(p.stat().st_size for p in Path(self.cache_dir).glob("*/*.json"))
+        else:
+            with self._lock:
+                self._total_bytes += len(data)
+        with self._lock:
+            over_limit = self._total_bytes > self.max_bytes
+        if over_limit:
+            self.evict()
+        return True
+    
+    def evict(self):
+        """古く使われた順に削除し、上限の9割まで減らす"""
+        entries = []
+        for path in Path(self.cache_dir).glob("*/*.json"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+        
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes * 0.9
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                path.unlink()
+                total -= size
+            except FileNotFoundError:
+                continue
+        with self._lock:
+            self._total_bytes = total
+    
+    # ---- 統計 ----
+    
+    def record(self, hits, misses):
+        """別プロセス（プロセスプールの子）で数えたヒット・ミスを合算"""
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+    
+    def hit_ratio(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+    
+    def summary(self):
+        return f"cache hits={self.hits} misses={self.misses} ratio={self.hit_ratio():.1%}"
+    
+    def write_stats(self, worker, force=False):
+        """ワーカーごとのヒット率をファイルに書き出す（Managerのステータスレポート用、最短5秒間隔）"""
+        now = time.time()
+        if not force and now - self._last_stats_write < 5:
+            return
+        self._last_stats_write = now
+        path = os.path.join(self.stats_dir, f"{worker}.json")
+        with open(f"{path}.tmp", 'w') as f:
+            json.dump({"hits": self.hits, "misses": self.misses, "updated": now}, f)
+        os.replace(f"{path}.tmp", path)
+
+
+def read_cache_stats(stats_dir="cache/stats"):
+    """全ワーカーのキャッシュ統計を {worker: {"hits", "misses"}} で返す"""
+    stats = {}
+    for path in Path(stats_dir).glob("*.json"):
+        try:
+            with open(path, 'r') as f:
+                stats[path.stem] = json.load(f)
+        except (OSError, ValueError):
+            continue
+    return stats
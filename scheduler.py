@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+import os
+import re
+import threading
+import time
+from collections import defaultdict, deque
+from datetime import datetime
+from pathlib import Path
+
+# クライアントが指定できるタスクID（ファイル名にそのまま使うので区切り文字を含めない）
+TASK_ID_PATTERN = re.compile(r"[A-Za-z0-9_.-]+")
+# TaskIdGenerator が生成する形式（指定されたIDと衝突しないよう予約する）
+GENERATED_ID_PATTERN = re.compile(r"task_\d{8}_\d{6}_\d{9}_\d+")
+
+
+def check_task_id(task_id, generated=False):
+    """タスクIDを検証して返す（不正なら ValueError）。generated=False では生成形式のIDも受け付けない"""
+    if not isinstance(task_id, str) or not TASK_ID_PATTERN.fullmatch(task_id) or not task_id.strip("."):
+        raise ValueError(f"invalid task_id: {task_id!r} (allowed: letters, digits, '_', '.', '-')")
+    if not generated and GENERATED_ID_PATTERN.fullmatch(task_id):
+        raise ValueError(f"task_id {task_id!r} uses the reserved generated format")
+    return task_id
+
+
+class TaskIdGenerator:
+    """衝突しない単調増加のタスクIDを生成
+    
+    形式: task_YYYYmmdd_HHMMSS_<ナノ秒9桁>_<pid>
+    同一秒・同一ナノ秒の生成でも前回より必ず大きくなり、pidでプロセス間の衝突も防ぐ。
+    """
+    
+    def __init__(self):
+        self._last_ns = 0
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+    
+    def next_id(self):
+        with self._lock:
+            now_ns = max(time.time_ns(), self._last_ns + 1)
+            self._last_ns = now_ns
+        seconds, fraction = divmod(now_ns, 1_000_000_000)
+        stamp = datetime.fromtimestamp(seconds).strftime('%Y%m%d_%H%M%S')
+        return f"task_{stamp}_{fraction:09d}_{self._pid}"
+
+
+class TaskScheduler:
+    """待ち行列の深さ・実行中件数・過去の実行時間から配布先ワーカーを決める
+    
+    各ワーカーの「未完了の推定作業時間」を保持し、新しいタスクは
+    推定完了時刻が最も早いワーカーに割り当てる（貪欲なリストスケジューリング）。
+    """
+    
+    def __init__(self, workers, pending_root="pending_tasks", default_runtime=1.0,
+                 smoothing=0.3, reconcile_interval=30):
+        self.workers = list(workers)
+        self.pending_root = pending_root
+        self.default_runtime = default_runtime
+        self.smoothing = smoothing
+        self.reconcile_interval = reconcile_interval
+        
+        self.runtime_avg = {}
+        self._runtime_total = 0.0
+        self.pending = defaultdict(int)
+        self.in_flight = defaultdict(int)
+        self.outstanding = defaultdict(float)
+        self._started = defaultdict(deque)
+        self._last_reconcile = 0
+        self._lock = threading.Lock()
+        self.reconcile()
+    
+    # ---- 推定 ----
+    
+    def estimate(self, task_name):
+        """タスク名ごとの実行時間の移動平均（未知なら全体平均）"""
+        if task_name in self.runtime_avg:
+            return self.runtime_avg[task_name]
+        if self.runtime_avg:
+            return self._runtime_total / len(self.runtime_avg)
+        return self.default_runtime
+    
+    def load(self, worker):
+        """ワーカーの未完了の推定作業時間"""
+        return self.outstanding[worker]
+    
+    # ---- 割り当て ----
+    
+    def choose(self, task_data, workers=None):
+        """推定完了時刻が最も早いワーカーを選び、その分の負荷を計上する（workers で候補を限定）"""
+        with self._lock:
+            if time.time() - self._last_reconcile >= self.reconcile_interval:
+                self._reconcile_locked()
+            worker = min(workers or self.workers, key=lambda w: (self.outstanding[w],
+                                                      self.pending[w] + self.in_flight[w]))
+            self._assign_locked(worker, task_data)
+            return worker
+    
+    def assign(self, worker, task_data):
+        """配布先が指定済みのタスクの負荷を計上"""
+        with self._lock:
+            self._assign_locked(worker, task_data)
+    
+    def _assign_locked(self, worker, task_data):
+        self.pending[worker] += 1
+        self.outstanding[worker] += self.estimate(task_data.get('name'))
+    
+    def plan(self, tasks, workers=None):
+        """複数タスクを推定時間の長い順に割り当てる（LPT）。(worker, task) のリストを返す"""
+        ordered = sorted(tasks, key=lambda t: self.estimate(t.get('name')), reverse=True)
+        return [(self.choose(task, workers), task) for task in ordered]
+    
+    # ---- ライフサイクルイベント ----
+    
+    def task_started(self, worker, task_name, started_at=None):
+        with self._lock:
+            if self.pending[worker] > 0:
+                self.pending[worker] -= 1
+            self.in_flight[worker] += 1
+            self._started[(worker, task_name)].append(time.time() if started_at is None else started_at)
+    
+    def task_finished(self, worker, task_name, finished_at=None, success=True):
+        with self._lock:
+            if self.in_flight[worker] > 0:
+                self.in_flight[worker] -= 1
+            self.outstanding[worker] = max(0.0, self.outstanding[worker] - self.estimate(task_name))
+            
+            starts = self._started.get((worker, task_name))
+            if not starts:
+                return
+            finished_at = time.time() if finished_at is None else finished_at
+            runtime = max(finished_at - starts.popleft(), 0.0)
+            if success:
+                previous = self.runtime_avg.get(task_name)
+                if previous is None:
+                    updated = runtime
+                else:
+                    updated = self.smoothing * runtime + (1 - self.smoothing) * previous
+                self.runtime_avg[task_name] = updated
+                self._runtime_total += updated - (previous or 0.0)
+    
+    def worker_lost(self, worker):
+        """停止したワーカーの実行中タスクを破棄（再配布されるため）"""
+        with self._lock:
+            self.in_flight[worker] = 0
+            for key in [key for key in self._started if key[0] == worker]:
+                del self._started[key]
+            self._reconcile_locked()
+    
+    def add_worker(self, worker):
+        """配布先の候補にワーカーを加える"""
+        with self._lock:
+            if worker not in self.workers:
+                self.workers.append(worker)
+                self._reconcile_locked()
+    
+    def remove_worker(self, worker):
+        """配布先の候補からワーカーを外す（推定実行時間は残す）"""
+        with self._lock:
+            if worker in self.workers:
+                self.workers.remove(worker)
+            for table in (self.pending, self.in_flight, self.outstanding):
+                table.pop(worker, None)
+            for key in [key for key in self._started if key[0] == worker]:
+                del self._started[key]
+    
+    # ---- 実ディレクトリとの突き合わせ ----
+    
+    def reconcile(self):
+        with self._lock:
+            self._reconcile_locked()
+    
+    def _reconcile_locked(self):
+        """pending_tasks の実ファイル数で待ち件数を補正（推定の誤差の蓄積を防ぐ）"""
+        fallback = self.estimate(None)
+        for worker in self.workers:
+            pending_dir = Path(self.pending_root) / worker
+            try:
+                with os.scandir(pending_dir) as it:
+                    actual = sum(1 for entry in it if entry.name.endswith(".json"))
+            except FileNotFoundError:
+                actual = 0
+            # 実行中のタスクも完了までは pending_tasks に残っている
+            actual = max(actual - self.in_flight[worker], 0)
+            if actual != self.pending[worker]:
+                self.pending[worker] = actual
+                self.outstanding[worker] = (actual + self.in_flight[worker]) * fallback
+        self._last_reconcile = time.time()
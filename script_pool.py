@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+import builtins
+import multiprocessing
+import os
+import sys
+import threading
+import traceback
+
+from task_limits import TaskKilled, TaskLimits, kill_process_group
+
+DEFAULT_PRELOAD = ["json", "os", "re", "datetime", "collections", "pathlib"]
+
+
+def _child_main(conn):
+    """プール内の子プロセス: スクリプトを1つだけ実行して終了する（タスク間で状態を共有しない）"""
+    try:
+        code, cwd, stdout_path, stderr_path, limits, env = conn.recv()
+    except EOFError:
+        return
+    
+    # 親がプロセスグループごと kill できるよう新しいセッションにし、rlimit を設定する
+    os.setsid()
+    if limits is not None:
+        TaskLimits(*limits).apply_rlimits()
+    
+    # 作業ディレクトリ・環境変数・標準出力・標準エラーを付け替える（この子プロセスだけに影響）
+    os.chdir(cwd)
+    if env:
+        os.environ.update(env)
+    sys.stdout.flush()
+    sys.stderr.flush()
+    for fd, path in ((1, stdout_path), (2, stderr_path)):
+        target = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        os.dup2(target, fd)
+        os.close(target)
+    sys.argv = ["<task script>"]
+    
+    returncode = 0
+    try:
+        exec(compile(code, "<task script>", "exec"),
+             {"__name__": "__main__", "__builtins__": builtins})
+    except SystemExit as e:
+        if e.code is None:
+            returncode = 0
+        elif isinstance(e.code, int):
+            returncode = e.code
+        else:
+            print(e.code, file=sys.stderr)
+            returncode = 1
+    except BaseException:
+        traceback.print_exc()
+        returncode = 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+    
+    conn.send(returncode)
+    conn.close()
+
+
+class ScriptPool:
+    """forkserver から事前に起動しておく、温まったPythonインタプリタのプール
+    
+    forkserver は preload のモジュールを読み込んだ状態で待機し、子プロセスはそこから fork される。
+    各子プロセスはスクリプトを1つだけ実行して終了するため、タスク同士は隔離される。
+    """
+    
+    def __init__(self, size=2, preload=None):
+        self.size = max(size, 1)
+        self.preload = list(DEFAULT_PRELOAD if preload is None else preload)
+        self._ctx = multiprocessing.get_context("forkserver")
+        self._ctx.set_forkserver_preload([__name__] + self.preload)
+        self._idle = []
+        self._lock = threading.Lock()
+        self._closed = False
+        for _ in range(self.size):
+            self._idle.append(self._spawn())
+    
+    def _spawn(self):
+        parent_conn, child_conn = self._ctx.Pipe()
+        process = self._ctx.Process(target=_child_main, args=(child_conn,), daemon=True)
+        process.start()
+        child_conn.close()
+        return process, parent_conn
+    
+    def _acquire(self):
+        with self._lock:
+            while self._idle:
+                process, conn = self._idle.pop()
+                if process.is_alive():
+                    break
+                conn.close()
+            else:
+                process, conn = None, None
+        if process is None:
+            process, conn = self._spawn()
+        # 取り出した分を裏で補充
+        threading.Thread(target=self._replenish, daemon=True).start()
+        return process, conn
+    
+    def _replenish(self):
+        with self._lock:
+            missing = self.size - len(self._idle) if not self._closed else 0
+        for _ in range(missing):
+            worker = self._spawn()
+            with self._lock:
+                if self._closed or len(self._idle) >= self.size:
+                    worker[1].close()
+                    worker[0].terminate()
+                    return
+                self._idle.append(worker)
+    
+    def run(self, code, cwd, stdout_path, stderr_path, limits=None, on_start=None, env=None):
+        """スクリプトを実行し、終了コードを返す。出力は指定ファイルに書かれる
+        
+        limits.timeout を過ぎたら子プロセスを kill して TaskKilled を送出する。
+        on_start には子プロセスの pid を渡し、env は子プロセスの環境変数に追加する。
+        """
+        process, conn = self._acquire()
+        try:
+            conn.send((code, os.path.abspath(cwd), os.path.abspath(stdout_path),
+                       os.path.abspath(stderr_path), limits.as_tuple() if limits else None, env))
+            if on_start is not None:
+                on_start(process.pid)
+            timeout = limits.timeout if limits else None
+            try:
+                if not conn.poll(timeout):
+                    kill_process_group(process.pid)
+                    raise TaskKilled("timeout", f"exceeded {timeout} seconds")
+                returncode = conn.recv()
+            except EOFError:
+                # os._exit やシグナルで子プロセスが直接終了した
+                returncode = None
+        finally:
+            conn.close()
+            process.join()
+        return process.exitcode if returncode is None else returncode
+    
+    def close(self):
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for process, conn in idle:
+            conn.close()
+            process.join(timeout=1)
+            if process.is_alive():
+                process.terminate()
@@ -26,7 +26,7 @@ tmux send-keys -t $WORKER1_SESSION:0 "cd $(pwd)" C-m
 tmux send-keys -t $WORKER1_SESSION:0 "echo 'Worker1 Starting with Claude...'" C-m
 tmux send-keys -t $WORKER1_SESSION:0 "claude --dangerously-skip-permissions" C-m
 sleep 3
-tmux send-keys -t $WORKER1_SESSION:0 "cat worker_session_instructions.md && python3 worker_session_automation.py worker1" Enter
+tmux send-keys -t $WORKER1_SESSION:0 "cat worker_session_instructions.md && python3 worker_session_automation.py worker1 --watch auto" Enter
 
 # Worker2 セッション作成
 tmux new-session -d -s $WORKER2_SESSION -n "worker2"
@@ -34,7 +34,7 @@ tmux send-keys -t $WORKER2_SESSION:0 "cd $(pwd)" C-m
 tmux send-keys -t $WORKER2_SESSION:0 "echo 'Worker2 Starting with Claude...'" C-m
 tmux send-keys -t $WORKER2_SESSION:0 "claude --dangerously-skip-permissions" C-m
 sleep 3
-tmux send-keys -t $WORKER2_SESSION:0 "cat worker_session_instructions.md && python3 worker_session_automation.py worker2" Enter
+tmux send-keys -t $WORKER2_SESSION:0 "cat worker_session_instructions.md && python3 worker_session_automation.py worker2 --watch auto" Enter
 
 # Worker3 セッション作成
 tmux new-session -d -s $WORKER3_SESSION -n "worker3"
@@ -42,7 +42,7 @@ tmux send-keys -t $WORKER3_SESSION:0 "cd $(pwd)" C-m
 tmux send-keys -t $WORKER3_SESSION:0 "echo 'Worker3 Starting with Claude...'" C-m
 tmux send-keys -t $WORKER3_SESSION:0 "claude --dangerously-skip-permissions" C-m
 sleep 3
-tmux send-keys -t $WORKER3_SESSION:0 "cat worker_session_instructions.md && python3 worker_session_automation.py worker3" Enter
+tmux send-keys -t $WORKER3_SESSION:0 "cat worker_session_instructions.md && python3 worker_session_automation.py worker3 --watch auto" Enter
 
 # 監視用セッション作成
 MONITOR_SESSION="monitor_session"
@@ -50,7 +50,7 @@ tmux kill-session -t $MONITOR_SESSION 2>/dev/null
 tmux new-session -d -s $MONITOR_SESSION -n "monitor"
 tmux send-keys -t $MONITOR_SESSION:0 "cd $(pwd)" C-m
 tmux send-keys -t $MONITOR_SESSION:0 "echo 'Log Monitor Starting...'" C-m
-tmux send-keys -t $MONITOR_SESSION:0 "tail -f manager_log.txt worker*/worker*_log.txt" C-m
+tmux send-keys -t $MONITOR_SESSION:0 "tail -F manager_log.txt worker*/worker*_log.txt" C-m
 
 # 必要なディレクトリを作成
 mkdir -p pending_tasks/worker1 pending_tasks/worker2 pending_tasks/worker3
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+import itertools
+import json
+import os
+import shlex
+
+DEFAULT_BATCH_SIZE = 100
+
+# script の配列タスクで、1つのインタプリタが1バッチ分の項目を順に exec する
+# argv: スクリプトのパス、項目（[[index, item], ...] のJSON）のパス、終了コードの書き出し先
+SCRIPT_DRIVER = r"""
+import json, os, sys, traceback
+script_path, items_path, status_path = sys.argv[1:4]
+with open(script_path) as f:
+    code = compile(f.read(), script_path, "exec")
+with open(items_path) as f:
+    items = json.load(f)
+sys.argv = [script_path]
+with open(status_path, "a") as status:
+    for index, item in items:
+        text = item if isinstance(item, str) else json.dumps(item, ensure_ascii=False)
+        print(f"### [{index}] {text}", flush=True)
+        os.environ["TASK_ARRAY_INDEX"] = str(index)
+        os.environ["TASK_ARRAY_ITEM"] = text
+        namespace = {"__name__": "__main__", "ARRAY_INDEX": index, "ARRAY_ITEM": item}
+        try:
+            exec(code, namespace)
+            returncode = 0
+        except SystemExit as e:
+            returncode = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+        except BaseException:
+            traceback.print_exc()
+            returncode = 1
+        sys.stdout.flush()
+        sys.stderr.flush()
+        status.write(f"{index} {returncode}\n")
+        status.flush()
+"""
+
+
+def item_text(item):
+    """テンプレートと環境変数に入れる文字列（文字列以外はJSON）"""
+    return item if isinstance(item, str) else json.dumps(item, ensure_ascii=False)
+
+
+class TaskArray:
+    """1つのタスクファイルから多数の項目を生成する配列タスク
+    
+    "array": {"range": [start, stop(, step)]} または {"values": [...]} と、省略可能な
+    "batch_size"（1回の子プロセスで実行する項目数）を指定する。項目はバッチごとに必要な分だけ
+    生成するので、数百万件の range でもメモリに展開しない。
+    command では {item} / {index} をシェル用にクォートした値で置き換え、script では
+    ARRAY_ITEM / ARRAY_INDEX を定義する。どちらも環境変数 TASK_ARRAY_ITEM / TASK_ARRAY_INDEX を設定する。
+    """
+    
+    def __init__(self, items, batch_size=DEFAULT_BATCH_SIZE, command=None, script=None):
+        self.items = items
+        self.total = len(items)
+        self.batch_size = batch_size
+        self.command = command
+        self.script = script
+    
+    @classmethod
+    def from_task(cls, task_data):
+        spec = task_data['array']
+        if not isinstance(spec, dict):
+            raise ValueError(f"Invalid array: {spec!r} (must be an object with range or values)")
+        if 'range' in spec:
+            bounds = spec['range']
+            if (not isinstance(bounds, list) or not 1 <= len(bounds) <= 3
+                    or not all(isinstance(v, int) and not isinstance(v, bool) for v in bounds)):
+                raise ValueError(f"Invalid array range: {bounds!r} (must be [start, stop] or [start, stop, step])")
+            items = range(*bounds)
+        elif isinstance(spec.get('values'), list):
+            items = spec['values']
+        else:
+            raise ValueError("Array task needs either range or values")
+        batch_size = spec.get('batch_size', DEFAULT_BATCH_SIZE)
+        if isinstance(batch_size, bool) or not isinstance(batch_size, int) or batch_size <= 0:
+            raise ValueError(f"Invalid batch_size: {batch_size!r} (must be a positive integer)")
+        if 'command' not in task_data and 'script' not in task_data:
+            raise ValueError("Array task needs a command or script template")
+        return cls(items, batch_size, task_data.get('command'), task_data.get('script'))
+    
+    def batches(self, done=()):
+        """未実行の項目を batch_size ずつ [(index, item), ...] で返す"""
+        pending = ((index, self.items[index]) for index in range(self.total) if index not in done)
+        while True:
+            batch = list(itertools.islice(pending, self.batch_size))
+            if not batch:
+                return
+            yield batch
+    
+    def command_batch(self, batch):
+        """1バッチ分の項目を順に実行するシェルスクリプト（終了コードは $TASK_ARRAY_STATUS へ追記）
+        
+        各項目はサブシェルの eval で実行するので、1項目の exit や構文エラーで残りが止まらない。
+        """
+        lines = ['exec 3>>"$TASK_ARRAY_STATUS"']
+        for index, item in batch:
+            text = item_text(item)
+            command = self.command.replace("{item}", shlex.quote(text)).replace("{index}", str(index))
+            lines.append(f"echo {shlex.quote(f'### [{index}] {text}')}")
+            lines.append(f"(export TASK_ARRAY_INDEX={index} TASK_ARRAY_ITEM={shlex.quote(text)}; "
+                         f"eval {shlex.quote(command)})")
+            lines.append(f'echo "{index} $?" >&3')
+        return "\n".join(lines) + "\n"
+
+
+class ArrayResults:
+    """配列タスクの項目ごとの終了コード（1行1項目の TSV: index<TAB>exit_code）
+    
+    先頭行にタスクIDを書き、同じタスクの再実行（クラッシュ後の再開・リトライ）では
+    記録済みの項目を飛ばす。バッチごとに fsync する。
+    """
+    
+    def __init__(self, path, task_id, total):
+        self.path = path
+        self.task_id = task_id
+        self.total = total
+        self.codes = self._load()
+        self.resumed = len(self.codes)
+        if not self.codes:
+            with open(self.path, 'w') as f:
+                f.write(f"# task_id={task_id} total={total}\n")
+    
+    def _load(self):
+        codes = {}
+        try:
+            with open(self.path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return codes
+        end = data.rfind(b"\n") + 1
+        lines = data[:end].decode("utf-8", errors="replace").splitlines()
+        if not lines or lines[0].split(" ")[1:2] != [f"task_id={self.task_id}"]:
+            return codes
+        for line in lines[1:]:
+            index, _, code = line.partition("\t")
+            try:
+                codes[int(index)] = int(code)
+            except ValueError:
+                continue
+        if end < len(data):
+            # 書きかけの最終行を捨ててから追記する
+            os.truncate(self.path, end)
+        return codes
+    
+    def record(self, codes):
+        """1バッチ分の (index, exit_code) を追記"""
+        with open(self.path, 'a') as f:
+            f.write("".join(f"{index}\t{code}\n" for index, code in codes))
+            f.flush()
+            os.fsync(f.fileno())
+        self.codes.update(codes)
+    
+    @property
+    def failed(self):
+        return sum(1 for code in self.codes.values() if code != 0)
+    
+    def summary(self, max_failed=20):
+        """完了報告に載せる集計（失敗した項目は先頭 max_failed 件の index のみ）"""
+        exit_codes = {}
+        for code in self.codes.values():
+            exit_codes[str(code)] = exit_codes.get(str(code), 0) + 1
+        failed_items = sorted(index for index, code in self.codes.items() if code != 0)
+        return {
+            "total": self.total,
+            "succeeded": len(self.codes) - len(failed_items),
+            "failed": len(failed_items),
+            "exit_codes": exit_codes,
+            "failed_items": failed_items[:max_failed],
+            "results": self.path,
+        }
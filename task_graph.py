@@ -0,0 +1,399 @@
+#!/usr/bin/env python3
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict, defaultdict, deque
+from pathlib import Path
+
+BLOCKED = "blocked"
+RELEASED = "released"
+DONE = "done"
+FAILED = "failed"
+
+
+def artifact_env_name(task_name):
+    """依存先の成果物を渡す環境変数名（例: data_collection → ARTIFACT_DATA_COLLECTION）"""
+    return "ARTIFACT_" + re.sub(r"[^0-9A-Za-z]+", "_", str(task_name)).strip("_").upper()
+
+
+class _Node:
+    __slots__ = ("task_id", "name", "state", "parents", "waiting", "children", "task", "worker",
+                 "output", "artifact", "enqueued_at", "completed_at")
+    
+    def __init__(self, task_id, name, state):
+        self.task_id = task_id
+        self.name = name
+        self.state = state
+        self.parents = []       # 依存先のタスクID（宣言順）
+        self.waiting = set()    # まだ完了していない依存先
+        self.children = []      # このタスクの完了を待つタスクID
+        self.task = None        # 保留中のみ task_data を保持
+        self.worker = None      # 解放時の配布先（None ならスケジューラに任せる）
+        self.output = None
+        self.artifact = None    # 出力を保存した成果物ストアのハッシュ
+        self.enqueued_at = None
+        self.completed_at = None
+
+
+class TaskGraph:
+    """depends_on で宣言されたタスク間の依存関係（DAG）
+    
+    依存先がすべて完了した時点でタスクを解放し、依存先の出力を task_data の "artifacts"
+    （タスク名 → {task_id, hash, output}）として渡す。出力ファイルは同じ名前の後続のタスクに
+    上書きされるので、ワーカーは成果物ストアの hash から変更されないコピーを作って使う。
+    保留中のタスクは blocked_dir に置き、Manager を再起動しても引き継ぐ。
+    完了したタスクは retain 件まで保持し、それより古いものは completed_tasks から探す。
+    完了報告を受け取らないプロセス（task_ingest.py）では bounded=True とし、配布・保留中のものも含めて
+    最近登録した retain 件だけを保持する（古いタスクは名前では参照できなくなる）。
+    """
+    
+    def __init__(self, blocked_dir="blocked_tasks", completed_root="completed_tasks",
+                 failed_dir="killed_tasks/blocked", retain=10000, bounded=False):
+        self.blocked_dir = blocked_dir
+        self.completed_root = completed_root
+        self.failed_dir = failed_dir
+        self.retain = retain
+        self.bounded = bounded
+        self.nodes = {}
+        self.by_name = {}
+        self._done = OrderedDict()
+        self._recent = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(blocked_dir, exist_ok=True)
+    
+    # ---- 登録 ----
+    
+    def track(self, task_data):
+        """依存関係を持たないタスクも、後から depends_on で参照できるよう登録する"""
+        with self._lock:
+            node = self._node_for(task_data['task_id'], task_data.get('name'), RELEASED)
+            node.enqueued_at = node.enqueued_at or task_data.get('enqueued_at') or time.time()
+            self._prune()
+    
+    def add(self, tasks, worker=None):
+        """depends_on 付きのタスクをまとめて登録する
+        
+        depends_on にはタスク名（同じバッチ内・登録済み）またはタスクIDを書ける。
+        すぐに配布できる (task_data, worker) のリストと、未知の依存先・循環・失敗した依存先のため
+        登録しなかった (task_data, 理由) のリストを返す。
+        """
+        with self._lock:
+            batch = {task['task_id']: task for task in tasks}
+            names = {task.get('name'): task['task_id'] for task in tasks if task.get('name')}
+            parents, rejected = {}, {}
+            for task_id, task in batch.items():
+                try:
+                    parents[task_id] = [self._resolve(dep, names) for dep in self._depends_on(task)]
+                    self._check_parents(parents[task_id], batch)
+                except ValueError as e:
+                    rejected[task_id] = str(e)
+            
+            ready = []
+            for task_id in self._topological(parents, batch, rejected):
+                task = batch[task_id]
+                node = self._node_for(task_id, task.get('name'), BLOCKED)
+                node.enqueued_at = time.time()
+                node.parents = parents[task_id]
+                node.worker = worker
+                node.task = task
+                for parent_id in node.parents:
+                    parent = self.nodes.get(parent_id) or self._completed_node(parent_id)
+                    if parent.state != DONE:
+                        node.waiting.add(parent_id)
+                    parent.children.append(task_id)
+                if node.waiting:
+                    self._save_blocked(node)
+                else:
+                    ready.append(self._release(node))
+            self._prune()
+            return ready, [(batch[task_id], reason) for task_id, reason in rejected.items()]
+    
+    def _depends_on(self, task_data):
+        deps = task_data.get('depends_on') or []
+        return [deps] if isinstance(deps, str) else list(deps)
+    
+    def _resolve(self, dep, batch_names):
+        if dep in batch_names:
+            return batch_names[dep]
+        if dep in self.nodes:
+            return dep
+        if dep in self.by_name:
+            return self.by_name[dep]
+        if self._completed_node(dep, create=False) is not None:
+            return dep
+        raise ValueError(f"Unknown dependency: {dep}")
+    
+    def _check_parents(self, parent_ids, batch):
+        for parent_id in parent_ids:
+            parent = self.nodes.get(parent_id)
+            if parent_id not in batch and parent is not None and parent.state == FAILED:
+                raise ValueError(f"Dependency {parent.name or parent_id} has failed")
+    
+    def _topological(self, parents, batch, rejected):
+        """依存先が先に来る順に並べる（循環と、拒否したタスクに依存するタスクは rejected に加える）"""
+        indegree = {}
+        children = defaultdict(list)
+        for task_id in batch:
+            if task_id in rejected:
+                continue
+            internal = [p for p in parents[task_id] if p in batch]
+            indegree[task_id] = len(internal)
+            for parent_id in internal:
+                children[parent_id].append(task_id)
+        
+        ordered = []
+        queue = deque(task_id for task_id, degree in indegree.items() if degree == 0)
+        while queue:
+            task_id = queue.popleft()
+            ordered.append(task_id)
+            for child_id in children[task_id]:
+                indegree[child_id] -= 1
+                if indegree[child_id] == 0:
+                    queue.append(child_id)
+        
+        placed = set(ordered)
+        for task_id in indegree:
+            if task_id not in placed:
+                blocked_by = [p for p in parents[task_id] if p in rejected]
+                rejected[task_id] = (f"Dependency {batch[blocked_by[0]].get('name') or blocked_by[0]} was rejected"
+                                     if blocked_by else "Dependency cycle")
+        return ordered
+    
+    def _node_for(self, task_id, name, state):
+        node = self.nodes.get(task_id)
+        if node is None:
+            node = self.nodes[task_id] = _Node(task_id, name, state)
+            self._remember(task_id)
+        else:
+            node.state = state if node.state not in (DONE, FAILED) else node.state
+        if name:
+            self.by_name[name] = task_id
+        return node
+    
+    def _completed_node(self, task_id, create=True):
+        """保持していない完了済みタスクを completed_tasks から復元する"""
+        for path in Path(self.completed_root).glob(f"*/{task_id}.json"):
+            if not create:
+                return path
+            try:
+                with open(path, 'r') as f:
+                    task = json.load(f)
+            except (OSError, ValueError):
+                task = {}
+            node = _Node(task_id, task.get('name'), DONE)
+            node.output = os.path.abspath(os.path.join(path.parent.name,
+                                                       f"task_{task.get('name')}_output.txt"))
+            node.enqueued_at = task.get('enqueued_at')
+            # 完了フォルダへの移動（rename）で ctime が更新される
+            node.completed_at = path.stat().st_ctime
+            self.nodes[task_id] = node
+            self._remember(task_id)
+            self._mark_done(node)
+            return node
+        if not create:
+            return None
+        # 配布済みで実行中（Manager の再起動前に解放したタスクなど）
+        node = self.nodes[task_id] = _Node(task_id, None, RELEASED)
+        self._remember(task_id)
+        return node
+    
+    # ---- 完了・失敗 ----
+    
+    def complete(self, task_id, output=None, name=None, artifact=None):
+        """タスクの完了を記録し、(解放できる (task_data, worker) のリスト, 終端ならパイプラインの経路) を返す"""
+        with self._lock:
+            node = self.nodes.get(task_id)
+            if node is None:
+                # 別のプロセスが配布したタスク（後から依存先として参照されうる）
+                node = self.nodes[task_id] = _Node(task_id, name, RELEASED)
+                self._remember(task_id)
+            if node.state == DONE:
+                return [], None
+            node.state = DONE
+            node.completed_at = time.time()
+            if output:
+                node.output = os.path.abspath(output)
+            node.artifact = artifact
+            self._mark_done(node)
+            
+            ready = []
+            for child_id in node.children:
+                child = self.nodes.get(child_id)
+                if child is None or child.state != BLOCKED:
+                    continue
+                child.waiting.discard(task_id)
+                if not child.waiting:
+                    ready.append(self._release(child))
+            path = self._critical_path(node) if node.parents and not node.children else None
+            self._prune()
+            return ready, path
+    
+    def fail(self, task_id):
+        """タスクの失敗を記録し、それを（間接的にも）待っていた保留タスクを取り除いて返す"""
+        with self._lock:
+            node = self.nodes.get(task_id)
+            if node is None:
+                return []
+            node.state = FAILED
+            dropped = []
+            stack = list(node.children)
+            while stack:
+                child = self.nodes.get(stack.pop())
+                if child is None or child.state != BLOCKED:
+                    continue
+                child.state = FAILED
+                os.makedirs(self.failed_dir, exist_ok=True)
+                child.task['skipped_because'] = task_id
+                with open(os.path.join(self.failed_dir, f"{child.task_id}.json"), 'w') as f:
+                    json.dump(child.task, f, indent=2)
+                self._remove_blocked(child)
+                dropped.append(child.task)
+                child.task = None
+                stack.extend(child.children)
+            return dropped
+    
+    def replace(self, old_id, new_id):
+        """再配布で新しいIDになったタスクの依存関係を引き継ぐ"""
+        with self._lock:
+            node = self.nodes.pop(old_id, None)
+            if node is None:
+                return
+            node.task_id = new_id
+            node.state = RELEASED
+            self.nodes[new_id] = node
+            self._recent.pop(old_id, None)
+            self._remember(new_id)
+            if node.name and self.by_name.get(node.name) == old_id:
+                self.by_name[node.name] = new_id
+            for child_id in node.children:
+                child = self.nodes.get(child_id)
+                if child is None:
+                    continue
+                child.parents = [new_id if p == old_id else p for p in child.parents]
+                if old_id in child.waiting:
+                    child.waiting.discard(old_id)
+                    child.waiting.add(new_id)
+                    if child.state == BLOCKED:
+                        self._save_blocked(child)
+    
+    def _release(self, node):
+        node.state = RELEASED
+        task, node.task = node.task, None
+        artifacts = {}
+        for parent_id in node.parents:
+            parent = self.nodes.get(parent_id) or self._completed_node(parent_id)
+            if parent.output:
+                artifacts[parent.name or parent_id] = {"task_id": parent_id, "hash": parent.artifact,
+                                                       "output": parent.output}
+        if artifacts:
+            task['artifacts'] = artifacts
+        self._remove_blocked(node)
+        return task, node.worker
+    
+    def _mark_done(self, node):
+        self._done[node.task_id] = None
+        self._done.move_to_end(node.task_id)
+    
+    def _remember(self, task_id):
+        if self.bounded:
+            self._recent[task_id] = None
+            self._recent.move_to_end(task_id)
+    
+    def _prune(self):
+        while len(self._done) > self.retain:
+            task_id, _ = self._done.popitem(last=False)
+            self._forget(task_id)
+        while len(self._recent) > self.retain:
+            task_id, _ = self._recent.popitem(last=False)
+            self._forget(task_id)
+    
+    def _forget(self, task_id):
+        node = self.nodes.pop(task_id, None)
+        if node is not None and node.name and self.by_name.get(node.name) == task_id:
+            del self.by_name[node.name]
+    
+    def _critical_path(self, node):
+        """終端のタスクから最後に完了した依存先をたどり、(名前の経路, 所要時間, タスクIDの経路) を返す"""
+        chain = [node]
+        while chain[-1].parents:
+            parents = [self.nodes.get(p) for p in chain[-1].parents]
+            parents = [p for p in parents if p is not None and p.completed_at is not None]
+            if not parents:
+                break
+            chain.append(max(parents, key=lambda p: p.completed_at))
+        chain.reverse()
+        started = min(n.enqueued_at for n in chain if n.enqueued_at is not None)
+        return [n.name or n.task_id for n in chain], node.completed_at - started, [n.task_id for n in chain]
+    
+    # ---- 永続化 ----
+    
+    def _blocked_path(self, node):
+        return os.path.join(self.blocked_dir, f"{node.task_id}.json")
+    
+    def _save_blocked(self, node):
+        path = self._blocked_path(node)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({"task": node.task, "worker": node.worker, "parents": node.parents,
+                       "submitted_at": node.enqueued_at}, f, indent=2)
+        os.replace(tmp_path, path)
+    
+    def _remove_blocked(self, node):
+        try:
+            os.remove(self._blocked_path(node))
+        except FileNotFoundError:
+            pass
+    
+    def load_blocked(self):
+        """blocked_dir の保留タスクのうち未登録のものを読み込む
+        
+        Manager の再起動時のほか、別のプロセス（task_ingest.py など）が登録したタスクを
+        引き継ぐときにも使う。(読み込んだ件数, 既に解放できる (task_data, worker) のリスト) を返す。
+        """
+        with self._lock:
+            entries = []
+            for path in sorted(Path(self.blocked_dir).glob("*.json")):
+                node = self.nodes.get(path.stem)
+                if node is not None and node.state == BLOCKED:
+                    continue
+                try:
+                    with open(path, 'r') as f:
+                        entries.append(json.load(f))
+                except (OSError, ValueError):
+                    continue
+            for entry in entries:
+                task = entry['task']
+                node = self._node_for(task['task_id'], task.get('name'), BLOCKED)
+                node.task = task
+                node.worker = entry.get('worker')
+                node.parents = entry.get('parents', [])
+                node.enqueued_at = entry.get('submitted_at') or time.time()
+            
+            ready = []
+            for entry in entries:
+                node = self.nodes[entry['task']['task_id']]
+                for parent_id in node.parents:
+                    parent = self.nodes.get(parent_id) or self._completed_node(parent_id)
+                    if node.task_id not in parent.children:
+                        parent.children.append(node.task_id)
+                    if parent.state != DONE:
+                        node.waiting.add(parent_id)
+                if not node.waiting:
+                    ready.append(self._release(node))
+            self._prune()
+            return len(entries), ready
+    
+    def waiting_on(self, task_id):
+        """task_id の完了を直接待っている保留タスクの数"""
+        with self._lock:
+            node = self.nodes.get(task_id)
+            if node is None:
+                return 0
+            return sum(1 for child_id in node.children
+                       if child_id in self.nodes and self.nodes[child_id].state == BLOCKED)
+    
+    def blocked_count(self):
+        with self._lock:
+            return sum(1 for node in self.nodes.values() if node.state == BLOCKED)
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import sys
+import time
+
+from manager_automation import ManagerAutomation
+from scheduler import check_task_id
+
+TASK_KEYS = ("command", "script", "description")
+PRIORITIES = ("high", "medium", "low")
+
+
+class TaskIngestor:
+    """JSONLのリクエストを1行ずつ読み込み、バッチ単位でタスクとして配布する
+    
+    ファイル全体を読み込まないのでメモリ使用量は batch_size 分で一定。
+    通知メッセージはタスクごとではなくバッチ・ワーカーごとに1通だけ送る。
+    保留タスク数が high_water を超えたら low_water を下回るまで投入を止める。
+    """
+    
+    def __init__(self, manager, batch_size=100, high_water=1000, low_water=None,
+                 poll_interval=1.0):
+        self.manager = manager
+        self.batch_size = batch_size
+        self.high_water = high_water
+        self.low_water = high_water // 2 if low_water is None else low_water
+        self.poll_interval = poll_interval
+        self.stats = {"read": 0, "accepted": 0, "rejected": 0, "batches": 0, "paused": 0}
+        # まだ書き出していないバッチの task_id（書き出し済みのものは task_id_in_use がディスクから探す）
+        self.batch_ids = set()
+    
+    def to_task(self, record):
+        """1レコードをタスクJSONに変換（不正なら ValueError）"""
+        if not isinstance(record, dict):
+            raise ValueError("record is not a JSON object")
+        
+        if "request_id" in record:
+            # バックログ形式 {request_id, title, body} は一般タスクとして扱う
+            task = {
+                "name": str(record["request_id"]),
+                "description": f"{record.get('title', '')}\n\n{record.get('body', '')}".strip(),
+            }
+            for key in ("priority", "depends_on"):
+                if key in record:
+                    task[key] = record[key]
+        else:
+            task = dict(record)
+        
+        if not task.get("name") or not isinstance(task["name"], str):
+            raise ValueError("missing 'name'")
+        if not any(key in task for key in TASK_KEYS):
+            raise ValueError(f"needs one of {', '.join(TASK_KEYS)}")
+        if "priority" in task and task["priority"] not in PRIORITIES:
+            raise ValueError(f"invalid priority: {task['priority']}")
+        if "task_id" in task:
+            # task_id はタスクファイル名になるので、区切り文字や既存のIDとの重複を通さない
+            task_id = check_task_id(task["task_id"])
+            if task_id in self.batch_ids or self.manager.task_id_in_use(task_id):
+                raise ValueError(f"duplicate task_id: {task_id}")
+            self.batch_ids.add(task_id)
+        return task
+    
+    def iter_tasks(self, stream):
+        """行を逐次検証し、正しいタスクだけを返す"""
+        for line_no, line in enumerate(stream, 1):
+            line = line.strip()
+            if not line:
+                continue
+            self.stats["read"] += 1
+            try:
+                yield self.to_task(json.loads(line))
+            except ValueError as e:
+                self.stats["rejected"] += 1
+                self.manager.comm.log_activity(f"Ingest: skipped line {line_no}: {e}")
+    
+    def wait_for_capacity(self):
+        """保留タスクが多すぎる間は投入を止める（バックプレッシャー）"""
+        depth = self.manager.pending_depth()
+        if depth < self.high_water:
+            return
+        self.stats["paused"] += 1
+        self.manager.comm.log_activity(
+            f"Ingest paused: {depth} pending tasks >= high-water mark {self.high_water}")
+        interval = self.poll_interval
+        while depth > self.low_water:
+            time.sleep(interval)
+            interval = min(interval * 2, 30)
+            depth = self.manager.pending_depth()
+        self.manager.comm.log_activity(f"Ingest resumed: {depth} pending tasks")
+    
+    def flush(self, batch):
+        self.wait_for_capacity()
+        self.manager.distribute_tasks(batch)
+        self.batch_ids.clear()
+        self.stats["accepted"] += len(batch)
+        self.stats["batches"] += 1
+    
+    def ingest(self, stream):
+        """ストリームを最後まで取り込み、統計を返す"""
+        batch = []
+        for task in self.iter_tasks(stream):
+            batch.append(task)
+            if len(batch) >= self.batch_size:
+                self.flush(batch)
+                batch = []
+        if batch:
+            self.flush(batch)
+        
+        self.manager.comm.log_activity(
+            "Ingest finished: "
+            + ", ".join(f"{key}={value}" for key, value in self.stats.items()))
+        return self.stats
+
+
+def open_source(path):
+    """'-' なら標準入力、それ以外はファイルを開く"""
+    if path == "-":
+        return sys.stdin
+    return open(path, 'r', encoding="utf-8")
+
+
+# メイン実行
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stream tasks from a JSONL file into the worker queues")
+    parser.add_argument("source", help="JSONLファイル（'-' で標準入力）")
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--high-water", type=int, default=1000,
+                        help="保留タスク数がこれを超えたら投入を一時停止")
+    parser.add_argument("--low-water", type=int, default=None,
+                        help="投入を再開する保留タスク数（既定: high-water の半分）")
+    parser.add_argument("--shared-queue", action="store_true",
+                        help="ワーカーを指定せず task_queue/ready の共有キューに投入")
+    args = parser.parse_args()
+    
+    manager = ManagerAutomation(use_queue=args.shared_queue, announce=False)
+    ingestor = TaskIngestor(manager, batch_size=args.batch_size,
+                            high_water=args.high_water, low_water=args.low_water)
+    source = open_source(args.source)
+    try:
+        ingestor.ingest(source)
+    except KeyboardInterrupt:
+        print("\nIngest stopped by user")
+    finally:
+        if source is not sys.stdin:
+            source.close()
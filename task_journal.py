@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+import json
+import os
+import threading
+import time
+
+JOURNAL_DIR = "communication/journal"
+
+# タスクの状態（この順に進む）。completed / killed で終わったタスクは再起動時に何もしない
+CLAIMED = "claimed"
+RUNNING = "running"
+FAILED = "failed"
+OUTPUT_WRITTEN = "output_written"
+COMPLETED = "completed"
+KILLED = "killed"
+FINISHED_STATES = (COMPLETED, KILLED)
+
+
+def journal_path(worker, base_dir=JOURNAL_DIR):
+    return os.path.join(base_dir, f"{worker}.jsonl")
+
+
+def read_journal(worker, base_dir=JOURNAL_DIR):
+    """タスクID → 最後の記録（終わっていないタスクのみ）。書きかけの最終行は読み飛ばす"""
+    records = {}
+    try:
+        with open(journal_path(worker, base_dir), 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return records
+    for line in data[:data.rfind(b"\n") + 1].splitlines():
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if record.get("state") in FINISHED_STATES:
+            records.pop(record.get("task_id"), None)
+        else:
+            records[record.get("task_id")] = record
+    return records
+
+
+class TaskJournal:
+    """ワーカーごとのタスク状態の先行書き込みログ（WAL）
+    
+    claimed → running → output_written → completed の各段階を1行ずつ追記する。
+    追記はその場で行い（記録の順序は崩れない）、fsync は専用スレッドが sync_interval ごとに
+    まとめて1回だけ行う。durable=True の記録は次の fsync が終わるまで待つ（同時に待つ記録は1回の
+    fsync を共有する）。ワーカーが落ちても再起動時に read_journal で中断したタスクがわかる。
+    exclusive=True（このプロセスだけが書く）なら、max_bytes を超えたときに終わっていない
+    タスクの記録だけを残して書き直す。
+    """
+    
+    def __init__(self, worker, base_dir=JOURNAL_DIR, sync_interval=0.1, max_bytes=16 * 1024 * 1024,
+                 exclusive=True):
+        self.worker = worker
+        self.path = journal_path(worker, base_dir)
+        self.sync_interval = sync_interval
+        self.max_bytes = max_bytes
+        self.exclusive = exclusive
+        os.makedirs(base_dir, exist_ok=True)
+        
+        self._cond = threading.Condition()
+        self._written = 0
+        self._synced = 0
+        self._urgent = False
+        self._closing = False
+        self._fd = self._open()
+        self._size = os.fstat(self._fd).st_size
+        self._thread = threading.Thread(target=self._run, name=f"{worker}-journal", daemon=True)
+        self._thread.start()
+    
+    def _open(self):
+        return os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    
+    def append(self, task_id, state, durable=False, **fields):
+        """状態を記録する（durable=True ならディスクに届くまで待つ）"""
+        record = {"task_id": task_id, "state": state, "ts": time.time(), **fields}
+        line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+        with self._cond:
+            if self._fd < 0:
+                return
+            if self.exclusive and self._size + len(line) > self.max_bytes:
+                self._compact_locked()
+            # 1行を1回の write で追記する（プロセスプールの子が同時に書いても行は混ざらない）
+            os.write(self._fd, line)
+            self._size += len(line)
+            self._written += 1
+            target = self._written
+            if durable:
+                self._urgent = True
+            self._cond.notify_all()
+            if durable:
+                while self._synced < target and self._fd >= 0:
+                    self._cond.wait()
+    
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._written > self._synced or self._closing)
+                # 急ぎでなければ少し待って、その間の記録もまとめて fsync する
+                self._cond.wait_for(lambda: self._urgent or self._closing, timeout=self.sync_interval)
+                target = self._written
+                self._urgent = False
+                fd = self._fd
+                if target == self._synced and self._closing:
+                    return
+            try:
+                os.fsync(fd)
+            except OSError:
+                pass
+            with self._cond:
+                self._synced = max(self._synced, target)
+                self._cond.notify_all()
+    
+    def _compact_locked(self, keep=None):
+        """終わっていないタスクの最後の記録だけを残して書き直す（ロック保持中に呼ぶ）"""
+        os.fsync(self._fd)
+        records = read_journal(self.worker, os.path.dirname(self.path))
+        data = b"".join((json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+                        for task_id, record in records.items() if keep is None or task_id in keep)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        os.close(self._fd)
+        self._fd = self._open()
+        self._size = len(data)
+        self._synced = self._written
+    
+    def compact(self, keep=None):
+        """書き直す（keep を指定するとそのタスクIDの記録だけを残す）"""
+        with self._cond:
+            if self._fd >= 0:
+                self._compact_locked(keep)
+    
+    def close(self):
+        """未同期の記録を fsync してから閉じる"""
+        with self._cond:
+            if self._fd < 0:
+                return
+            self._closing = True
+            self._cond.notify_all()
+        self._thread.join()
+        with self._cond:
+            os.close(self._fd)
+            self._fd = -1
+            self._cond.notify_all()
@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+import os
+import resource
+import signal
+
+# 中断の理由
+KILL_REASONS = ("timeout", "cancelled", "cpu_limit", "memory_limit")
+
+RUNNING_DIR = "communication/running"
+
+BOOT_ID_PATH = "/proc/sys/kernel/random/boot_id"
+
+_MEMORY_ERRORS = ("MemoryError", "Cannot allocate memory", "std::bad_alloc", "out of memory")
+
+
+class TaskKilled(Exception):
+    """タイムアウト・キャンセル・リソース制限でタスクの子プロセスを止めた"""
+    
+    def __init__(self, reason, detail=""):
+        super().__init__(f"{reason}: {detail}" if detail else reason)
+        self.reason = reason
+        self.detail = detail
+
+
+class TaskLimits:
+    """タスクJSONの timeout（秒）・cpu_seconds・memory_mb
+    
+    cpu_seconds と memory_mb は子プロセスの rlimit（RLIMIT_CPU / RLIMIT_AS）として設定し（LimitGate）、
+    timeout は親が経過時間を見てプロセスグループごと kill する。
+    """
+    
+    def __init__(self, timeout=None, cpu_seconds=None, memory_mb=None):
+        self.timeout = timeout
+        self.cpu_seconds = cpu_seconds
+        self.memory_mb = memory_mb
+    
+    @classmethod
+    def from_task(cls, task_data):
+        values = {}
+        for key in ("timeout", "cpu_seconds", "memory_mb"):
+            value = task_data.get(key)
+            if value is None:
+                continue
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or value <= 0:
+                raise ValueError(f"Invalid {key}: {value!r} (must be a positive number)")
+            values[key] = value
+        return cls(**values)
+    
+    def __bool__(self):
+        return any(v is not None for v in (self.timeout, self.cpu_seconds, self.memory_mb))
+    
+    def as_tuple(self):
+        """プロセス間で受け渡す形（インタプリタプール用）"""
+        return (self.timeout, self.cpu_seconds, self.memory_mb)
+    
+    def rlimits(self):
+        """設定する rlimit の [(リソース, (soft, hard))]"""
+        limits = []
+        if self.cpu_seconds is not None:
+            # soft で SIGXCPU、それでも止まらなければ hard で SIGKILL
+            seconds = max(int(self.cpu_seconds + 0.999), 1)
+            limits.append((resource.RLIMIT_CPU, (seconds, seconds + 1)))
+        if self.memory_mb is not None:
+            limit = int(self.memory_mb * 1024 * 1024)
+            limits.append((resource.RLIMIT_AS, (limit, limit)))
+        return limits
+    
+    def apply_rlimits(self):
+        """自分自身に設定する（インタプリタプールの子プロセスがスクリプトの実行前に呼ぶ）"""
+        for which, limit in self.rlimits():
+            resource.setrlimit(which, limit)
+    
+    def apply_to(self, pid):
+        """起動済みの子プロセスに親から設定する"""
+        for which, limit in self.rlimits():
+            resource.prlimit(pid, which, limit)
+    
+    def exceeded(self, returncode, stderr=""):
+        """終了の仕方から超過したリソース制限を推定する（なければ None）
+        
+        RLIMIT_CPU は SIGXCPU（シェル経由なら終了コード 128 + SIGXCPU）、RLIMIT_AS は割り当ての失敗として
+        現れる。SIGKILL・SIGSEGV・SIGABRT はバグや外部からの kill（OOM killer など）でも起きるので、
+        制限の超過とはみなさない（再配布せず通常の失敗として扱う）。
+        """
+        if returncode is None or returncode == 0:
+            return None
+        if self.cpu_seconds is not None and returncode in (-signal.SIGXCPU, 128 + signal.SIGXCPU):
+            return "cpu_limit"
+        if self.memory_mb is not None and stderr and any(marker in stderr for marker in _MEMORY_ERRORS):
+            return "memory_limit"
+        return None
+
+
+class LimitGate:
+    """子プロセスの rlimit を親から prlimit で設定し終えるまで、コマンドを始めさせない
+    
+    preexec_fn はスレッドのあるプロセス（実行プール・ハートビート）では安全でないので使わない。
+    rlimit がある場合は /bin/sh で起動し、標準入力のパイプから1行読めてから本来のコマンドを
+    （標準入力を /dev/null にして）実行させる。設定前に fork した孫プロセスが制限を継承しないことを防ぎ、
+    親が設定に失敗すれば何もせず終わる。rlimit がなければ args・shell・stdin をそのまま使う。
+        
+        gate = LimitGate(limits, args, shell)
+        process = subprocess.Popen(gate.args, shell=gate.shell, stdin=gate.stdin, ...)
+        gate.release(process.pid)   # 起動に失敗したときは gate.release(None)
+    """
+    
+    def __init__(self, limits, args, shell=False, stdin=None):
+        self.limits = limits
+        self.args = args
+        self.shell = shell
+        self.stdin = stdin
+        self._fds = None
+        if limits is None or not limits.rlimits():
+            return
+        read_fd, write_fd = os.pipe()
+        self._fds = (read_fd, write_fd)
+        # shell=True のコマンドも Popen と同じく /bin/sh -c で実行する（終了コードの扱いを変えない）
+        if shell:
+            args = ["/bin/sh", "-c", args]
+        self.args = ["/bin/sh", "-c", 'read _ || exit 1; exec "$@" </dev/null', "sh", *args]
+        self.shell = False
+        self.stdin = read_fd
+    
+    def release(self, pid):
+        """起動直後に呼ぶ。rlimit を設定してから子プロセスにコマンドを始めさせる"""
+        if self._fds is None:
+            return
+        read_fd, write_fd = self._fds
+        self._fds = None
+        os.close(read_fd)
+        try:
+            if pid is not None:
+                self.limits.apply_to(pid)
+                os.write(write_fd, b"\n")
+        except ProcessLookupError:
+            pass
+        finally:
+            os.close(write_fd)
+
+
+def kill_process_group(pid):
+    """子プロセスのグループ（シェル経由の孫プロセスを含む）を SIGKILL する"""
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except ProcessLookupError:
+        # まだ新しいセッションを作る前ならプロセス単体を止める
+        try:
+            os.kill(pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+    except PermissionError:
+        pass
+
+
+def boot_id():
+    """起動ごとに変わるID（読めなければ None）"""
+    try:
+        with open(BOOT_ID_PATH, 'r') as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def process_identity(pid):
+    """プロセスの起動時刻（/proc/<pid>/stat の22番目）とブートID。読めなければ None
+    
+    PID は再利用されるので、記録した PID が今も同じプロセスかはこの組で確かめる。
+    """
+    try:
+        with open(f"/proc/{pid}/stat", 'rb') as f:
+            data = f.read()
+    except OSError:
+        return None
+    # 2番目のコマンド名は空白や括弧を含みうるので、最後の ')' の後ろ（3番目以降）から数える
+    fields = data[data.rfind(b")") + 1:].split()
+    boot = boot_id()
+    if len(fields) < 20 or boot is None:
+        return None
+    return f"{fields[19].decode()} {boot}"
+
+
+class ProcessRegistry:
+    """実行中タスクの子プロセスを <directory>/<task_id>.pgid に記録する
+    
+    ファイルに置くため、プロセスプールの子で動いているタスクも親からキャンセルできる。
+    キャンセル時は <task_id>.cancel を残し、子プロセスの起動前なら起動直後に止める。
+    記録には PID と一緒に process_identity を残し、kill する前に同じプロセスかを確かめる
+    （再起動後や PID の再利用で無関係なプロセスグループを止めない）。
+    """
+    
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+    
+    def _path(self, task_id, suffix):
+        return os.path.join(self.directory, f"{task_id}{suffix}")
+    
+    def register(self, task_id, pid):
+        """子プロセスの起動直後に呼ぶ（キャンセル済みならその場で止める）"""
+        if task_id is None:
+            return
+        path = self._path(task_id, ".pgid")
+        tmp_path = f"{path}.tmp"
+        identity = process_identity(pid)
+        with open(tmp_path, 'w') as f:
+            f.write(str(pid) if identity is None else f"{pid} {identity}")
+        os.replace(tmp_path, path)
+        if self.is_cancelled(task_id):
+            kill_process_group(pid)
+    
+    def _owned_pid(self, path, since=None):
+        """記録した子プロセスが今も動いていればその PID（別のプロセスに変わっていれば None）
+        
+        since（記録したワーカーの process_identity）を渡すと、そのワーカーの起動より後に
+        同じブートで起動した子プロセスだけに絞る。
+        """
+        try:
+            with open(path, 'r') as f:
+                pid, _, identity = f.read().strip().partition(" ")
+            pid = int(pid)
+        except (FileNotFoundError, ValueError):
+            return None
+        if not identity or process_identity(pid) != identity:
+            return None
+        if since is not None:
+            started, _, boot = identity.partition(" ")
+            owner_started, _, owner_boot = since.partition(" ")
+            if boot != owner_boot or int(started) < int(owner_started):
+                return None
+        return pid
+    
+    def is_cancelled(self, task_id):
+        return task_id is not None and os.path.exists(self._path(task_id, ".cancel"))
+    
+    def cancel(self, task_id):
+        """キャンセルを記録し、子プロセスが動いていれば kill する（動いていたら True）"""
+        with open(self._path(task_id, ".cancel"), 'w'):
+            pass
+        pid = self._owned_pid(self._path(task_id, ".pgid"))
+        if pid is None:
+            return False
+        kill_process_group(pid)
+        return True
+    
+    def finish(self, task_id, limits, returncode, stderr="", timed_out=False):
+        """子プロセスの終了後に呼ぶ。タイムアウト・キャンセル・制限超過で止まっていれば TaskKilled を送出"""
+        cancelled = self.is_cancelled(task_id)
+        self.unregister(task_id)
+        if cancelled:
+            raise TaskKilled("cancelled", "cancelled by manager")
+        if timed_out:
+            raise TaskKilled("timeout", f"exceeded {limits.timeout} seconds")
+        reason = limits.exceeded(returncode, stderr) if limits else None
+        if reason == "cpu_limit":
+            raise TaskKilled(reason, f"exceeded {limits.cpu_seconds} CPU seconds (exit code {returncode})")
+        if reason == "memory_limit":
+            raise TaskKilled(reason, f"exceeded {limits.memory_mb} MB (exit code {returncode})")
+    
+    def unregister(self, task_id):
+        if task_id is None:
+            return
+        try:
+            os.remove(self._path(task_id, ".pgid"))
+        except FileNotFoundError:
+            pass
+    
+    def clear(self, task_id):
+        """タスクの終了時に記録をすべて消す"""
+        for suffix in (".pgid", ".cancel"):
+            try:
+                os.remove(self._path(task_id, suffix))
+            except FileNotFoundError:
+                pass
+    
+    def kill_all(self, since=None):
+        """記録されていて今も動いている子プロセスをすべて kill する（異常終了したワーカーの取り残しを止める）
+        
+        起動時刻かブートIDが記録と違うもの（既に終わって PID が別のプロセスに使われたもの）は飛ばす。
+        since を渡すと、そのワーカーの実行中に起動したものだけを止める（_owned_pid を参照）。
+        """
+        killed = 0
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith(".pgid"):
+                continue
+            pid = self._owned_pid(entry.path, since)
+            if pid is None:
+                continue
+            kill_process_group(pid)
+            killed += 1
+        return killed
+    
+    def reset(self):
+        """ワーカーの起動時に前回の実行で取り残された子プロセスを止めて記録を消す（止めた数を返す）"""
+        killed = self.kill_all()
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith((".pgid", ".cancel", ".tmp")):
+                try:
+                    os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
+        return killed
+
+
+def worker_registry(worker_name):
+    """ワーカーごとの実行中プロセスの記録（Manager からも同じ場所を参照する）"""
+    return ProcessRegistry(os.path.join(RUNNING_DIR, worker_name))
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+import heapq
+import json
+import os
+import threading
+
+# 数値が小さいほど優先
+PRIORITY_RANK = {"high": 0, "medium": 1, "low": 2}
+DEFAULT_PRIORITY = "medium"
+
+
+def priority_rank(priority):
+    return PRIORITY_RANK.get(str(priority).lower(), PRIORITY_RANK[DEFAULT_PRIORITY])
+
+
+def sort_messages_by_priority(messages):
+    """high → medium → low の順に並べる（同じ優先度内は受信順を保つ）"""
+    return sorted(messages, key=lambda msg: priority_rank(msg.get("priority", DEFAULT_PRIORITY)))
+
+
+class PendingTaskHeap:
+    """優先度と投入時刻で並ぶ保留タスクのヒープ（エージング付き）
+    
+    キーは「投入時刻 + 優先度ランク × aging_seconds」。
+    low のタスクも aging_seconds × 2 だけ待てば後から来た high より先に取り出されるため、
+    大量の high が流れ続けても飢餓状態にならない。
+    """
+    
+    def __init__(self, aging_seconds=300):
+        self.aging_seconds = aging_seconds
+        self._heap = []
+        self._names = set()
+        self._seq = 0
+        self._lock = threading.Lock()
+    
+    def __len__(self):
+        return len(self._names)
+    
+    def __contains__(self, task_file):
+        return task_file.name in self._names
+    
+    def push(self, task_file, priority=DEFAULT_PRIORITY, enqueued_at=0.0):
+        """タスクを追加（既に入っていれば何もしない）。追加したら True"""
+        with self._lock:
+            if task_file.name in self._names:
+                return False
+            key = enqueued_at + priority_rank(priority) * self.aging_seconds
+            self._seq += 1
+            heapq.heappush(self._heap, (key, self._seq, task_file))
+            self._names.add(task_file.name)
+            return True
+    
+    def add_file(self, task_file):
+        """タスクファイルを読んで優先度と投入時刻を取り出し、追加する"""
+        if task_file in self:
+            return False
+        try:
+            enqueued_at = os.stat(task_file).st_mtime
+            with open(task_file, 'r') as f:
+                task_data = json.load(f)
+        except (OSError, ValueError):
+            # 書き込み途中・取得済みのファイルは次回に回す
+            return False
+        if not isinstance(task_data, dict):
+            task_data = {}
+        return self.push(task_file, task_data.get("priority", DEFAULT_PRIORITY), enqueued_at)
+    
+    def pop(self):
+        """最も優先すべきタスクを取り出す。空なら None"""
+        with self._lock:
+            if not self._heap:
+                return None
+            _, _, task_file = heapq.heappop(self._heap)
+            self._names.discard(task_file.name)
+            return task_file
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+import os
+import selectors
+import shutil
+import subprocess
+import tempfile
+import time
+
+from task_limits import LimitGate, kill_process_group
+
+CHUNK_SIZE = 64 * 1024
+EXIT_CODE_WIDTH = 12
+
+
+class StreamResult:
+    """ストリーミング実行の結果（subprocess.CompletedProcess と同じ属性名）"""
+    
+    def __init__(self, args, returncode, stdout, stderr, stdout_bytes, stderr_bytes, lines):
+        self.args = args
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+        self.stdout_bytes = stdout_bytes
+        self.stderr_bytes = stderr_bytes
+        self.lines = lines
+        self.timed_out = False
+
+
+class _Tail:
+    """末尾の一定バイト数だけを保持するバッファ"""
+    
+    def __init__(self, limit):
+        self.limit = limit
+        self.data = bytearray()
+    
+    def feed(self, chunk):
+        self.data += chunk
+        if len(self.data) > self.limit:
+            del self.data[:len(self.data) - self.limit]
+    
+    def text(self):
+        return bytes(self.data).decode("utf-8", errors="replace")
+
+
+def run_streaming(args, output_path, header_lines, cwd=None, shell=False,
+                  tail_bytes=64 * 1024, progress_interval=5.0, on_progress=None,
+                  limits=None, on_start=None, env=None):
+    """出力をメモリに溜めず、チャンク単位で出力ファイルへ書き出しながら実行する
+    
+    出力ファイルの形式は従来と同じ（ヘッダー、Exit Code、STDOUT、STDERR）。
+    Exit Code は終了後に予約しておいた位置へ書き戻す。
+    子プロセスは新しいセッションで起動し、limits.timeout を過ぎたらグループごと kill する
+    （結果の timed_out が True になる）。on_start には子プロセスの pid を渡す。
+    """
+    stdout_tail = _Tail(tail_bytes)
+    stderr_tail = _Tail(tail_bytes)
+    counts = {"stdout": 0, "stderr": 0, "lines": 0}
+    
+    with open(output_path, 'wb') as out, tempfile.TemporaryFile() as err_spool:
+        for line in header_lines:
+            out.write(f"{line}\n".encode("utf-8"))
+        exit_code_pos = out.tell()
+        out.write(f"Exit Code: {'':<{EXIT_CODE_WIDTH}}\n".encode("utf-8"))
+        out.write(b"STDOUT:\n")
+        
+        gate = LimitGate(limits, args, shell, stdin=subprocess.DEVNULL)
+        try:
+            process = subprocess.Popen(gate.args, shell=gate.shell, cwd=cwd, env=env, stdin=gate.stdin,
+                                       stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                       start_new_session=True)
+        except BaseException:
+            gate.release(None)
+            raise
+        gate.release(process.pid)
+        if on_start is not None:
+            on_start(process.pid)
+        started = time.time()
+        deadline = started + limits.timeout if limits and limits.timeout else None
+        timed_out = False
+        last_report = started
+        last_bytes = 0
+        
+        selector = selectors.DefaultSelector()
+        selector.register(process.stdout, selectors.EVENT_READ, ("stdout", out, stdout_tail))
+        selector.register(process.stderr, selectors.EVENT_READ, ("stderr", err_spool, stderr_tail))
+        try:
+            while selector.get_map():
+                wait = progress_interval
+                if deadline is not None and not timed_out:
+                    wait = min(wait, max(deadline - time.time(), 0))
+                for key, _ in selector.select(timeout=wait):
+                    stream, sink, tail = key.data
+                    chunk = os.read(key.fd, CHUNK_SIZE)
+                    if not chunk:
+                        selector.unregister(key.fileobj)
+                        continue
+                    sink.write(chunk)
+                    tail.feed(chunk)
+                    counts[stream] += len(chunk)
+                    if stream == "stdout":
+                        counts["lines"] += chunk.count(b"\n")
+                
+                now = time.time()
+                if deadline is not None and not timed_out and now >= deadline:
+                    # 残りの出力はパイプが閉じるまで読み切る
+                    kill_process_group(process.pid)
+                    timed_out = True
+                if on_progress is not None and now - last_report >= progress_interval:
+                    total = counts["stdout"] + counts["stderr"]
+                    rate = (total - last_bytes) / (now - last_report)
+                    on_progress(total, counts["lines"], rate, counts["lines"] / (now - started))
+                    last_report = now
+                    last_bytes = total
+        finally:
+            selector.close()
+            process.stdout.close()
+            process.stderr.close()
+        returncode = process.wait()
+        
+        # STDERR はスプールから追記
+        out.write(b"\nSTDERR:\n")
+        err_spool.seek(0)
+        shutil.copyfileobj(err_spool, out, CHUNK_SIZE)
+        out.write(b"\n")
+        
+        out.seek(exit_code_pos)
+        out.write(f"Exit Code: {returncode:<{EXIT_CODE_WIDTH}}".encode("utf-8"))
+    
+    result = StreamResult(args, returncode, stdout_tail.text(), stderr_tail.text(),
+                          counts["stdout"], counts["stderr"], counts["lines"])
+    result.timed_out = timed_out
+    return result
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from pathlib import Path
+
+QUEUE = "shared_queue"
+
+
+class WorkerCounters:
+    """1ワーカー分のカウンタ"""
+    
+    def __init__(self):
+        self.pending = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        # 起動後に終了したタスク（失敗率の分母）
+        self.finished = 0
+        # 直近のレポート区間の値（レポートごとにリセット）
+        self.interval_completed = 0
+        self.interval_failed = 0
+        self.wait_total = 0.0
+        self.wait_count = 0
+        self.wait_max = 0.0
+
+
+class TaskStats:
+    """タスクのライフサイクルイベントから更新するステータスレポート用のカウンタ
+    
+    起動時に一度だけディレクトリのファイル数を数え、以降は投入・開始・完了・失敗の
+    イベントで増減させる。レポート作成はワーカー数に比例するコストで済む。
+    """
+    
+    def __init__(self, workers, pending_root="pending_tasks", completed_root="completed_tasks",
+                 queue_dir=None):
+        self.workers = list(workers)
+        self.pending_root = pending_root
+        self.completed_root = completed_root
+        self.queue_dir = queue_dir
+        self.counters = defaultdict(WorkerCounters)
+        self._enqueued = defaultdict(deque)
+        self._interval_start = time.time()
+        self._lock = threading.Lock()
+    
+    def _count_files(self, path):
+        try:
+            with os.scandir(path) as it:
+                return sum(1 for entry in it if entry.name.endswith(".json"))
+        except FileNotFoundError:
+            return 0
+    
+    def reconcile(self):
+        """起動時にファイル数からカウンタを初期化（stat しないので大量のファイルでも軽い）"""
+        with self._lock:
+            for worker in self.workers:
+                counters = self.counters[worker]
+                counters.pending = self._count_files(Path(self.pending_root) / worker)
+                counters.completed = self._count_files(Path(self.completed_root) / worker)
+            if self.queue_dir is not None:
+                self.counters[QUEUE].pending = self._count_files(self.queue_dir)
+    
+    # ---- ライフサイクルイベント ----
+    
+    def task_enqueued(self, worker, task_name, enqueued_at=None):
+        """ワーカーの pending_tasks（worker=None なら共有キュー）にタスクを投入した"""
+        key = QUEUE if worker is None else worker
+        with self._lock:
+            self.counters[key].pending += 1
+            self._enqueued[(key, task_name)].append(time.time() if enqueued_at is None else enqueued_at)
+    
+    def task_started(self, worker, task_name, started_at=None):
+        started_at = time.time() if started_at is None else started_at
+        with self._lock:
+            counters = self.counters[worker]
+            counters.running += 1
+            
+            # 投入元（自分の pending_tasks → 共有キュー）の待ち件数を減らし、待ち時間を記録
+            for key in (worker, QUEUE):
+                enqueued = self._enqueued.get((key, task_name))
+                if enqueued:
+                    self.counters[key].pending = max(self.counters[key].pending - 1, 0)
+                    wait = max(started_at - enqueued.popleft(), 0.0)
+                    if not enqueued:
+                        del self._enqueued[(key, task_name)]
+                    counters.wait_total += wait
+                    counters.wait_count += 1
+                    counters.wait_max = max(counters.wait_max, wait)
+                    return
+            
+            # 起動前に投入されたタスク（投入時刻は不明）
+            for key in (worker, QUEUE):
+                if self.counters[key].pending > 0:
+                    self.counters[key].pending -= 1
+                    return
+    
+    def task_completed(self, worker, task_name=None):
+        with self._lock:
+            counters = self.counters[worker]
+            counters.running = max(counters.running - 1, 0)
+            counters.completed += 1
+            counters.finished += 1
+            counters.interval_completed += 1
+    
+    def task_failed(self, worker, task_name=None):
+        with self._lock:
+            counters = self.counters[worker]
+            counters.running = max(counters.running - 1, 0)
+            counters.failed += 1
+            counters.finished += 1
+            counters.interval_failed += 1
+    
+    def task_cancelled(self, worker):
+        """開始前のタスクを取り除いた（worker=None なら共有キューから）"""
+        key = QUEUE if worker is None else worker
+        with self._lock:
+            self.counters[key].pending = max(self.counters[key].pending - 1, 0)
+    
+    def task_reassigned(self, from_worker, to_worker, task_name):
+        """停止したワーカーの保留タスクを別のワーカー（None なら共有キュー）へ移した"""
+        to_key = QUEUE if to_worker is None else to_worker
+        with self._lock:
+            self.counters[from_worker].pending = max(self.counters[from_worker].pending - 1, 0)
+            self.counters[to_key].pending += 1
+            enqueued = self._enqueued.get((from_worker, task_name))
+            enqueued_at = enqueued.popleft() if enqueued else time.time()
+            if enqueued is not None and not enqueued:
+                del self._enqueued[(from_worker, task_name)]
+            self._enqueued[(to_key, task_name)].append(enqueued_at)
+    
+    def worker_lost(self, worker):
+        """停止したワーカーの実行中件数を破棄"""
+        with self._lock:
+            self.counters[worker].running = 0
+    
+    def add_worker(self, worker):
+        """起動したワーカーをレポートの対象に加える（pending_tasks のファイル数で初期化）"""
+        with self._lock:
+            if worker in self.workers:
+                return
+            self.workers.append(worker)
+            self.counters[worker].pending = self._count_files(Path(self.pending_root) / worker)
+    
+    def remove_worker(self, worker):
+        """停止したワーカーをレポートの対象から外す"""
+        with self._lock:
+            if worker in self.workers:
+                self.workers.remove(worker)
+            self.counters.pop(worker, None)
+    
+    # ---- レポート ----
+    
+    def pending(self, worker=None):
+        return self.counters[QUEUE if worker is None else worker].pending
+    
+    def snapshot(self, reset_interval=True):
+        """ワーカーごとの集計を返す（区間の値は既定でリセット）"""
+        now = time.time()
+        with self._lock:
+            elapsed = max(now - self._interval_start, 1e-9)
+            rows = {}
+            for worker in self.workers:
+                c = self.counters[worker]
+                rows[worker] = {
+                    "pending": c.pending,
+                    "running": c.running,
+                    "completed": c.completed,
+                    "failed": c.failed,
+                    "failure_rate": c.failed / c.finished if c.finished else 0.0,
+                    "interval_completed": c.interval_completed,
+                    "interval_failed": c.interval_failed,
+                    "throughput_per_min": c.interval_completed * 60 / elapsed,
+                    "wait_avg": c.wait_total / c.wait_count if c.wait_count else None,
+                    "wait_max": c.wait_max if c.wait_count else None,
+                }
+                if reset_interval:
+                    c.interval_completed = 0
+                    c.interval_failed = 0
+                    c.wait_total = 0.0
+                    c.wait_count = 0
+                    c.wait_max = 0.0
+            if reset_interval:
+                self._interval_start = now
+            return elapsed, rows
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+
+# inotify のイベントマスク（<sys/inotify.h>）
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+class InotifyWatcher:
+    """inotifyでディレクトリの変更を即座に検知する"""
+    
+    def __init__(self):
+        libc_name = ctypes.util.find_library("c")
+        if libc_name is None:
+            raise OSError("libc not found")
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self._libc, "inotify_init1"):
+            raise OSError("inotify is not available on this platform")
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._watches = {}
+        self._fds = {}
+    
+    def add(self, path, tag, suffix=None):
+        """ディレクトリを監視対象に追加（suffix指定時は該当ファイルのみ）"""
+        mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_MODIFY
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed: {path}")
+        self._watches[wd] = (path, tag, suffix)
+    
+    def add_fd(self, fd, tag):
+        """読み込み可能になったら tag の変更として通知するファイル記述子（メッセージバスの通知など）"""
+        self._fds[fd] = tag
+    
+    def fileno(self):
+        """イベントループに登録できる記述子（読み込み可能になったら wait(0) で取り出す）"""
+        return self._fd
+    
+    def wait(self, timeout):
+        """変更があったタグ → 変更されたファイルパスの集合 を返す（タイムアウト時は空）
+        
+        イベントキューが溢れた場合、ファイルが特定できないのでパスの集合は None になる。
+        add_fd で登録した記述子によるタグのパスの集合は空になる（記述子は呼び出し側が読む）。
+        """
+        readable, _, _ = select.select([self._fd, *self._fds], [], [], max(timeout, 0))
+        if not readable:
+            return {}
+        
+        changed = {}
+        for fd in readable:
+            if fd in self._fds:
+                changed.setdefault(self._fds[fd], set())
+        if self._fd not in readable:
+            return changed
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return changed
+        
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(data):
+            wd, mask, _cookie, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b"\0").decode(errors="replace")
+            offset += length
+            
+            if mask & IN_Q_OVERFLOW:
+                return {tag: None for _, tag, _ in self._watches.values()}
+            
+            path, tag, suffix = self._watches.get(wd, (None, None, None))
+            if tag is not None and (suffix is None or name.endswith(suffix)):
+                changed.setdefault(tag, set()).add(os.path.join(path, name))
+        return changed
+    
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+class PollingWatcher:
+    """inotifyが使えない環境向け。変化がない間は間隔を伸ばすポーリング"""
+    
+    def __init__(self, min_interval=0.05, max_interval=2.0):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = min_interval
+        self._watches = []
+        self._snapshots = {}
+        self._fds = {}
+    
+    def add(self, path, tag, suffix=None):
+        """ディレクトリを監視対象に追加（suffix指定時は該当ファイルのみ）"""
+        self._watches.append((path, tag, suffix))
+        self._snapshots[path] = self._snapshot(path, suffix)
+    
+    def add_fd(self, fd, tag):
+        """読み込み可能になったら tag の変更として通知するファイル記述子（メッセージバスの通知など）"""
+        self._fds[fd] = tag
+    
+    def fileno(self):
+        """記述子はない（イベントループでは定期的に wait(0) を呼ぶ）"""
+        return None
+    
+    def _snapshot(self, path, suffix):
+        entries = {}
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    if suffix is not None and not entry.name.endswith(suffix):
+                        continue
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries[entry.name] = (stat.st_size, stat.st_mtime_ns)
+        except FileNotFoundError:
+            pass
+        return entries
+    
+    def wait(self, timeout):
+        """変更があったタグ → 変更されたファイルパスの集合 を返す（タイムアウト時は空）"""
+        deadline = time.time() + max(timeout, 0)
+        while True:
+            changed = {}
+            if self._fds:
+                readable, _, _ = select.select(list(self._fds), [], [], 0)
+                for fd in readable:
+                    changed.setdefault(self._fds[fd], set())
+            for path, tag, suffix in self._watches:
+                snapshot = self._snapshot(path, suffix)
+                previous = self._snapshots[path]
+                if snapshot != previous:
+                    self._snapshots[path] = snapshot
+                    paths = changed.setdefault(tag, set())
+                    paths.update(os.path.join(path, name) for name, stat in snapshot.items()
+                                 if previous.get(name) != stat)
+            
+            if changed:
+                # 変化があれば次回から最短間隔に戻す
+                self.interval = self.min_interval
+                return changed
+            
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return changed
+            if self._fds:
+                # 記述子が読み込み可能になればポーリング間隔を待たずに戻る
+                select.select(list(self._fds), [], [], min(self.interval, remaining))
+            else:
+                time.sleep(min(self.interval, remaining))
+            self.interval = min(self.interval * 2, self.max_interval)
+    
+    def close(self):
+        self._watches = []
+        self._fds = {}
+
+
+def create_watcher(backend="auto"):
+    """監視バックエンドを生成（auto: inotifyが使えなければポーリング）"""
+    if backend == "poll":
+        return PollingWatcher()
+    try:
+        return InotifyWatcher()
+    except (OSError, AttributeError):
+        if backend == "inotify":
+            raise
+        return PollingWatcher()
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+
+def member_path(worker, base_dir="task_queue"):
+    """共有キューを使うワーカーの目印（pending_tasks をワークスティーリングの対象にしてよい）"""
+    return os.path.join(base_dir, "members", worker)
+
+
+def leave_queue(worker, base_dir="task_queue"):
+    """共有キューを使わずに起動したワーカーの目印を消す（前回の起動で残ったもの）"""
+    try:
+        os.remove(member_path(worker, base_dir))
+    except FileNotFoundError:
+        pass
+
+
+class WorkQueue:
+    """共有キューとリースによるタスクの取得
+    
+    task_queue/ready/ に置かれたタスクを、各ワーカーが
+    task_queue/leases/<worker>/ へ rename することで取得する。
+    rename は原子的なので、同じタスクを複数のワーカーが取得することはない。
+    リースファイルの mtime をハートビートとして更新し、期限切れのリースは
+    ready/ に戻される。
+    キューを使うワーカーは members/<worker> を置き、ワークスティーリングはそのワーカーからだけ奪う
+    （キューを使わないワーカーは pending_tasks のファイルをその場で実行するので、奪うと二重に実行される）。
+    """
+    
+    def __init__(self, base_dir="task_queue", pending_root="pending_tasks", lease_ttl=60):
+        self.base_dir = base_dir
+        self.ready_dir = os.path.join(base_dir, "ready")
+        self.leases_dir = os.path.join(base_dir, "leases")
+        self.tmp_dir = os.path.join(base_dir, "tmp")
+        self.members_dir = os.path.join(base_dir, "members")
+        self.pending_root = pending_root
+        self.lease_ttl = lease_ttl
+        self._heartbeat_thread = None
+        self._stop_heartbeat = threading.Event()
+        self.ensure_directories()
+    
+    def ensure_directories(self):
+        """必要なディレクトリを確保"""
+        os.makedirs(self.ready_dir, exist_ok=True)
+        os.makedirs(self.leases_dir, exist_ok=True)
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        os.makedirs(self.members_dir, exist_ok=True)
+    
+    def lease_dir(self, worker):
+        path = os.path.join(self.leases_dir, worker)
+        os.makedirs(path, exist_ok=True)
+        return path
+    
+    def lease_path(self, worker, name):
+        return Path(self.lease_dir(worker)) / name
+    
+    def join(self, worker):
+        """キューを使うワーカーとして登録（pending_tasks を他のワーカーが奪えるようにする）"""
+        with open(member_path(worker, self.base_dir), 'w') as f:
+            f.write(f"{os.getpid()}\n")
+    
+    def is_member(self, worker):
+        return os.path.exists(member_path(worker, self.base_dir))
+    
+    # ---- 投入 ----
+    
+    def enqueue(self, task_data, name):
+        """タスクを共有キューに投入（書き込み完了後に rename で公開）"""
+        tmp_path = os.path.join(self.tmp_dir, name)
+        with open(tmp_path, 'w') as f:
+            json.dump(task_data, f, indent=2)
+        ready_path = os.path.join(self.ready_dir, name)
+        os.rename(tmp_path, ready_path)
+        return Path(ready_path)
+    
+    def ready_tasks(self):
+        """共有キューで待機中のタスク"""
+        return sorted(Path(self.ready_dir).glob("*.json"))
+    
+    # ---- 取得・ハートビート ----
+    
+    def claim(self, task_file, worker):
+        """タスクをリースとして取得。他ワーカーに先を越された場合は None"""
+        task_file = Path(task_file)
+        lease_path = self.lease_path(worker, task_file.name)
+        try:
+            # rename は mtime を保つので、先にハートビート時刻を更新しておく
+            os.utime(task_file)
+            os.rename(task_file, lease_path)
+        except FileNotFoundError:
+            return None
+        return lease_path
+    
+    def heartbeat(self, worker, name):
+        """リースを延長。期限切れで回収済みなら False"""
+        try:
+            os.utime(self.lease_path(worker, name))
+            return True
+        except FileNotFoundError:
+            return False
+    
+    def start_heartbeat(self, worker, get_names, interval=None):
+        """実行中タスクのリースを定期的に延長するスレッドを開始"""
+        interval = interval or max(self.lease_ttl / 3, 1)
+        
+        def beat():
+            while not self._stop_heartbeat.wait(interval):
+                for name in get_names():
+                    self.heartbeat(worker, name)
+        
+        self._heartbeat_thread = threading.Thread(target=beat, name=f"{worker}-lease-heartbeat",
+                                                  daemon=True)
+        self._heartbeat_thread.start()
+    
+    def stop_heartbeat(self):
+        self._stop_heartbeat.set()
+    
+    def reclaim_expired(self):
+        """期限切れのリースを共有キューへ戻し、戻した件数を返す"""
+        reclaimed = 0
+        deadline = time.time() - self.lease_ttl
+        for worker_dir in Path(self.leases_dir).iterdir():
+            if not worker_dir.is_dir():
+                continue
+            for lease in worker_dir.glob("*.json"):
+                try:
+                    if lease.stat().st_mtime >= deadline:
+                        continue
+                    os.rename(lease, os.path.join(self.ready_dir, lease.name))
+                    reclaimed += 1
+                except FileNotFoundError:
+                    continue
+        return reclaimed
+    
+    def release_worker(self, worker, keep=()):
+        """停止したワーカーのリースを期限切れを待たずに共有キューへ戻し、件数を返す（keep のタスクIDは残す）"""
+        released = 0
+        for lease in Path(self.lease_dir(worker)).glob("*.json"):
+            if lease.stem in keep:
+                continue
+            try:
+                os.rename(lease, os.path.join(self.ready_dir, lease.name))
+                released += 1
+            except FileNotFoundError:
+                continue
+        return released
+    
+    # ---- ワークスティーリング ----
+    
+    def steal(self, worker, candidates, min_backlog=2):
+        """最も滞留の多い他ワーカーの pending_tasks から1件取得
+        
+        対象ワーカーが次に処理するタスクを残すため、末尾（最も新しい）から取る。
+        キューを使うワーカーはリースへ移してから実行するので、pending_tasks に残るのは未着手のものだけ。
+        キューを使わないワーカー（members/ に目印がない）からは奪わない。
+        """
+        victim_files = []
+        for other in candidates:
+            if other == worker or not self.is_member(other):
+                continue
+            pending_dir = os.path.join(self.pending_root, other)
+            try:
+                files = sorted(Path(pending_dir).glob("*.json"))
+            except FileNotFoundError:
+                continue
+            if len(files) >= min_backlog and len(files) > len(victim_files):
+                victim_files = files
+        
+        for task_file in reversed(victim_files[1:]):
+            lease_path = self.claim(task_file, worker)
+            if lease_path is not None:
+                return lease_path
+        return None
+    
+    def backlog_owners(self):
+        """pending_tasks 配下のワーカー名"""
+        try:
+            return [d.name for d in Path(self.pending_root).iterdir() if d.is_dir()]
+        except FileNotFoundError:
+            return []
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+import math
+import os
+import subprocess
+import sys
+import time
+
+from task_limits import process_identity
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "worker_session_automation.py")
+
+# ワーカーの状態
+RUNNING = "running"
+DRAINING = "draining"   # 新しいタスクを渡さず、手元のタスクがなくなるのを待つ
+STOPPING = "stopping"   # 停止を送り、終了を待つ
+
+
+def system_load():
+    """1分間のロードアベレージをCPU数で割った値（取得できない環境では 0）"""
+    try:
+        return os.getloadavg()[0] / (os.cpu_count() or 1)
+    except (OSError, AttributeError):
+        return 0.0
+
+
+class _Member:
+    __slots__ = ("name", "process", "identity", "state", "started_at", "state_since", "restarts",
+                 "crashes", "restart_at")
+    
+    def __init__(self, name):
+        self.name = name
+        self.process = None
+        self.identity = None
+        self.state = RUNNING
+        self.started_at = 0.0
+        self.state_since = 0.0
+        self.restarts = 0
+        self.crashes = 0
+        self.restart_at = None
+
+
+class WorkerPool:
+    """Manager が worker_session_automation.py を子プロセスとして起動・監視する
+    
+    待ち件数とロードアベレージから min_workers〜max_workers の間でワーカー数を決める。
+    異常終了したワーカーは同じ名前で再起動し、短時間に繰り返すほど再起動の間隔を空ける。
+    縮小するワーカーは draining にして新しいタスクを渡さず、停止は Manager が指示する。
+    """
+    
+    def __init__(self, min_workers=1, max_workers=4, worker_args=(), transport="socket",
+                 backlog_per_worker=4, max_load=1.0, scale_down_after=30, drain_timeout=300,
+                 restart_delay=1.0, max_restart_delay=60, stable_after=60, log_dir="worker_logs",
+                 prefix="worker"):
+        if min_workers < 1 or max_workers < min_workers:
+            raise ValueError(f"Invalid pool size: min={min_workers}, max={max_workers}")
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self.worker_args = list(worker_args)
+        self.transport = transport
+        self.backlog_per_worker = max(backlog_per_worker, 1)
+        self.max_load = max_load
+        self.scale_down_after = scale_down_after
+        self.drain_timeout = drain_timeout
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+        self.stable_after = stable_after
+        self.log_dir = log_dir
+        self.prefix = prefix
+        
+        self.members = {}
+        self._low_since = None
+    
+    # ---- 名前と状態 ----
+    
+    def initial_names(self):
+        return [f"{self.prefix}{i + 1}" for i in range(self.min_workers)]
+    
+    def free_name(self):
+        """使われていない最小番号の名前（ディレクトリを使い回せるよう番号を詰める）"""
+        index = 1
+        while f"{self.prefix}{index}" in self.members:
+            index += 1
+        return f"{self.prefix}{index}"
+    
+    def active(self):
+        """縮小対象でないワーカー（再起動待ちを含む）を起動順に返す"""
+        members = [m for m in self.members.values() if m.state == RUNNING]
+        return [m.name for m in sorted(members, key=lambda m: self._index(m.name))]
+    
+    def is_up(self, name):
+        """タスクを渡してよいワーカーか（動いていて縮小対象でない）"""
+        member = self.members.get(name)
+        return member is not None and member.state == RUNNING and member.process is not None
+    
+    def draining(self):
+        return [m.name for m in self.members.values() if m.state == DRAINING]
+    
+    def draining_for(self, name):
+        member = self.members[name]
+        return time.time() - member.state_since
+    
+    def pid(self, name):
+        member = self.members.get(name)
+        return member.process.pid if member is not None and member.process is not None else None
+    
+    def identity(self, name):
+        """最後に起動したワーカープロセスの process_identity（終了後も残る。取れなければ None）"""
+        member = self.members.get(name)
+        return member.identity if member is not None else None
+    
+    def _index(self, name):
+        suffix = name[len(self.prefix):]
+        return int(suffix) if suffix.isdigit() else 0
+    
+    # ---- 起動・終了 ----
+    
+    def spawn(self, name):
+        """ワーカーを起動して pid を返す（出力は log_dir/<name>.out に追記）"""
+        os.makedirs(self.log_dir, exist_ok=True)
+        with open(os.path.join(self.log_dir, f"{name}.out"), 'a') as out:
+            process = subprocess.Popen(
+                [sys.executable, WORKER_SCRIPT, name, "--transport", self.transport] + self.worker_args,
+                stdin=subprocess.DEVNULL, stdout=out, stderr=subprocess.STDOUT)
+        member = self.members.get(name)
+        if member is None:
+            member = self.members[name] = _Member(name)
+        now = time.time()
+        member.process = process
+        member.identity = process_identity(process.pid)
+        member.state = RUNNING
+        member.started_at = member.state_since = now
+        member.restart_at = None
+        return process.pid
+    
+    def reap(self):
+        """終了したワーカーを回収して [(name, returncode, expected)] を返す
+        
+        expected が False（異常終了）のワーカーは再起動の予定を立てる。
+        起動から stable_after 秒以内の異常終了が続くと間隔を倍にしていく。
+        """
+        now = time.time()
+        exited = []
+        for member in list(self.members.values()):
+            if member.process is None:
+                continue
+            returncode = member.process.poll()
+            if returncode is None:
+                continue
+            member.process = None
+            if member.state == RUNNING:
+                member.crashes = member.crashes + 1 if now - member.started_at < self.stable_after else 1
+                delay = min(self.restart_delay * 2 ** (member.crashes - 1), self.max_restart_delay)
+                member.restart_at = now + delay
+                exited.append((member.name, returncode, False))
+            else:
+                del self.members[member.name]
+                exited.append((member.name, returncode, True))
+        return exited
+    
+    def restart_delay_for(self, name):
+        member = self.members[name]
+        return max(member.restart_at - time.time(), 0.0) if member.restart_at is not None else 0.0
+    
+    def due_restarts(self):
+        now = time.time()
+        return [m.name for m in self.members.values()
+                if m.process is None and m.restart_at is not None and m.restart_at <= now]
+    
+    def restart(self, name):
+        self.members[name].restarts += 1
+        return self.spawn(name)
+    
+    def kill(self, name):
+        """応答しないワーカーを止める（次の reap で異常終了として扱う）"""
+        member = self.members.get(name)
+        if member is not None and member.process is not None:
+            member.process.kill()
+    
+    # ---- 増減 ----
+    
+    def target(self, depth, load):
+        """待ち件数とロードアベレージから目標のワーカー数を決める
+        
+        増やすのはすぐ、減らすのは待ち件数の少ない状態が scale_down_after 秒続いたときに1台ずつ。
+        ロードアベレージ（CPUあたり）が max_load 以上のときは増やさない。
+        """
+        active = len(self.active())
+        wanted = min(max(math.ceil(depth / self.backlog_per_worker), self.min_workers), self.max_workers)
+        if wanted > active and load >= self.max_load:
+            wanted = max(active, self.min_workers)
+        if wanted >= active:
+            self._low_since = None
+            return wanted
+        now = time.time()
+        if self._low_since is None:
+            self._low_since = now
+        if now - self._low_since < self.scale_down_after:
+            return active
+        self._low_since = now
+        return active - 1
+    
+    def drain(self, name):
+        member = self.members[name]
+        member.state = DRAINING
+        member.state_since = time.time()
+    
+    def undrain(self):
+        """停止をまだ指示していない縮小中のワーカーを1台戻す（なければ None）"""
+        for name in self.draining():
+            member = self.members[name]
+            member.state = RUNNING
+            member.state_since = time.time()
+            return name
+        return None
+    
+    def mark_stopping(self, name):
+        member = self.members[name]
+        member.state = STOPPING
+        member.state_since = time.time()
+    
+    def stop_all(self, send_stop, timeout=30):
+        """すべてのワーカーに停止を指示し、終了しなければ terminate / kill する"""
+        members = [m for m in self.members.values() if m.process is not None]
+        for member in members:
+            if member.state != STOPPING:
+                send_stop(member.name)
+        deadline = time.time() + timeout
+        for member in members:
+            try:
+                member.process.wait(max(deadline - time.time(), 0.1))
+            except subprocess.TimeoutExpired:
+                member.process.terminate()
+                try:
+                    member.process.wait(5)
+                except subprocess.TimeoutExpired:
+                    member.process.kill()
+                    member.process.wait()
+        self.members = {}
+    
+    def summary(self):
+        line = f"{len(self.active())} workers (min {self.min_workers}, max {self.max_workers})"
+        leaving = [m.name for m in self.members.values() if m.state != RUNNING]
+        if leaving:
+            line += f", draining: {', '.join(sorted(leaving))}"
+        restarts = sum(m.restarts for m in self.members.values())
+        if restarts:
+            line += f", restarts: {restarts}"
+        return line
@@ -1,37 +1,289 @@
 #!/usr/bin/env python3
+import argparse
+import asyncio
+import contextvars
+import hashlib
 import json
 import os
 import sys
 import time
 import shutil
+import signal
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
 import subprocess
 
+from activity_log import get_activity_logger
+from artifact_store import ArtifactStore
+from async_runtime import RUNTIMES, AsyncWorkerRuntime
+from heartbeat import HeartbeatWriter
+from message_bus import TRANSPORTS, create_transport, new_message_id
+from message_store import MessageStore
+from metrics import MetricsRegistry, stage_latencies
+from result_cache import ResultCache
+from script_pool import ScriptPool
+from task_priority import PendingTaskHeap, sort_messages_by_priority
+from task_array import SCRIPT_DRIVER, ArrayResults, TaskArray
+from task_graph import artifact_env_name
+from task_journal import CLAIMED, COMPLETED, FAILED, KILLED, OUTPUT_WRITTEN, RUNNING, TaskJournal, read_journal
+from task_limits import LimitGate, TaskKilled, TaskLimits, kill_process_group, worker_registry
+from task_runner import run_streaming
+from task_watcher import create_watcher
+from work_queue import WorkQueue, leave_queue
+
+# 依存先の成果物のコピーを、最後に使われてから残しておく秒数
+INPUT_RETENTION = 24 * 3600
+
 class WorkerSessionAutomation:
-    def __init__(self, worker_name):
+    def __init__(self, worker_name, watch=None, max_parallel_tasks=1, executor="thread",
+                 stream_output=False, use_queue=False, steal=False, aging_seconds=300,
+                 script_pool_size=0, preload_modules=None, result_cache=False,
+                 cache_max_mb=256, log_formats=("text",), metrics_port=None, metrics_file=None,
+                 transport="socket", runtime="sync", artifact_store=True, announce=True,
+                 shared=None, journal=True):
         self.worker_name = worker_name
-        self.comm = WorkerCommunication(self.worker_name)
+        # shared: 1つのプロセスで複数のワーカーを動かす WorkerSupervisor（ストア・接続・監視・
+        # 実行プール・共有キュー・成果物ストアを共有し、ハートビートもまとめて書く）
+        self.shared = shared
+        self.comm = WorkerCommunication(self.worker_name, log_formats, transport,
+                                        shared=shared)
+        self.log_formats = tuple(log_formats)
+        self.transport = transport
+        self.runtime = runtime
         self.running = True
         self.instructions_file = "worker_session_instructions.md"
         self.pending_tasks_dir = f"pending_tasks/{worker_name}"
         self.completed_tasks_dir = f"completed_tasks/{worker_name}"
+        self.killed_tasks_dir = f"killed_tasks/{worker_name}"
         self.worker_dir = worker_name
         
         # ディレクトリ作成
         self.ensure_directories()
         
-        # 初期ログ
-        self.comm.log_activity(f"Worker {worker_name} session automation started")
-        self.read_instructions()
+        # 実行中タスクの子プロセス（キャンセル時にプロセスグループごと kill する）
+        self.processes = worker_registry(worker_name)
+        
+        # 出力をメモリに溜めずファイルへ逐次書き出すか
+        self.stream_output = stream_output
+        
+        # 共有キュー（リースによる取得とワークスティーリング）
+        if shared is not None:
+            self.queue = shared.queue if use_queue else None
+        else:
+            self.queue = WorkQueue() if use_queue else None
+        self.steal = steal and use_queue
+        self._last_reclaim = 0
+        # 依存先の成果物を展開したコピー（内容のハッシュ名、INPUT_RETENTION 秒使われなければ削除）
+        self.artifact_inputs_dir = os.path.join(self.worker_dir, "artifacts")
+        self._last_input_prune = 0
+        
+        # 並列実行（1の場合は従来どおり逐次実行）
+        self.max_parallel_tasks = max_parallel_tasks or os.cpu_count() or 1
+        self.executor_kind = executor
+        self.executor = None
+        self.in_flight = set()
+        self._task_lock = threading.Lock()
+        
+        # 保留タスクは優先度→投入時刻の順に取り出す（エージングで low の飢餓を防ぐ）
+        self.pending_heap = PendingTaskHeap(aging_seconds)
+        self._draining = False
+        # asyncio ランタイムではタスクをその場で実行せず、これを呼んでイベントループに知らせる
+        self.tasks_available = None
+        
+        # command / script の結果キャッシュ（入力が同じなら再実行しない）
+        self.cache_max_mb = cache_max_mb
+        self.result_cache = ResultCache(max_bytes=cache_max_mb * 1024 * 1024) if result_cache else None
+        
+        # 完了したタスクの出力を内容アドレスで保存する（同じ名前のタスクでも上書きされない）
+        if shared is not None:
+            self.artifacts = shared.artifacts if artifact_store else None
+        else:
+            self.artifacts = ArtifactStore() if artifact_store else None
+        
+        # タスクの状態の先行書き込みログ（落ちても再起動時に中断したタスクから再開する）
+        # プロセスプールの子も同じファイルに追記するので、その間は書き直さない
+        self.journal = None
+        if journal:
+            self.journal = TaskJournal(
+                worker_name, exclusive=announce and not (executor == "process" and self.max_parallel_tasks > 1))
+        
+        # 初期ログ・監視・プールの準備（プロセスプールの子では省略）
+        self.watcher = None
+        self.script_pool = None
+        self.heartbeat = None
+        self.metrics = None
+        self.metrics_file = metrics_file
+        if shared is not None:
+            self.join_supervisor(shared)
+        elif announce:
+            self.comm.log_activity(f"Worker {worker_name} session automation started")
+            self.read_instructions()
+            
+            # 中断したタスクを復元し、前回の実行で残った子プロセスを止めてキャンセルの記録を消す
+            self.recover_tasks()
+            self.reset_processes()
+            self.advertise_queue_mode()
+            
+            # 生存確認用のハートビート（Managerが数秒で停止を検知できるよう1秒ごとに更新）
+            self.heartbeat = HeartbeatWriter(worker_name)
+            self.heartbeat.start()
+            self.comm.heartbeat = self.heartbeat
+            
+            # メッセージはブローカーからのプッシュで受け取る（不在時はストアを読む）
+            if self.comm.subscribe():
+                self.comm.log_activity("Subscribed to message bus")
+            elif transport == "socket":
+                self.comm.log_activity("Message bus not available, reading the message store directly")
+            
+            # 変更監視（None の場合は従来の定期チェックのみ）
+            if watch:
+                self.watcher = self.create_watcher(watch)
+            if self.max_parallel_tasks > 1 and runtime == "sync":
+                self.executor = self.create_executor()
+            if script_pool_size > 0:
+                self.script_pool = ScriptPool(script_pool_size, preload_modules)
+                self.comm.log_activity(
+                    f"Script interpreter pool ready: {script_pool_size} warm processes, "
+                    f"preloaded {', '.join(self.script_pool.preload) or 'nothing'}")
+            if metrics_port is not None or metrics_file is not None:
+                self.metrics = self.create_metrics(metrics_port)
+            if self.result_cache is not None:
+                self.comm.log_activity(
+                    f"Result cache enabled: {self.result_cache.cache_dir} (max {cache_max_mb} MB)")
+            if self.queue is not None:
+                self.queue.start_heartbeat(self.worker_name, lambda: list(self.in_flight))
+                self.comm.log_activity(
+                    f"Claiming tasks from shared queue {self.queue.ready_dir}"
+                    + (" (work stealing enabled)" if self.steal else ""))
+    
+    def advertise_queue_mode(self):
+        """共有キューを使うかを他のワーカーに知らせる（奪われてよいのはキューを使うワーカーのタスクだけ）"""
+        if self.queue is not None:
+            self.queue.join(self.worker_name)
+        else:
+            leave_queue(self.worker_name)
+    
+    def join_supervisor(self, shared):
+        """WorkerSupervisor の下で動く準備（監視・実行プール・ハートビートのスレッドは持たない）"""
+        self.comm.log_activity(
+            f"Worker {self.worker_name} session automation started (supervised, pid {os.getpid()})")
+        self.recover_tasks()
+        self.reset_processes()
+        self.advertise_queue_mode()
+        # ハートビートとリースの延長は WorkerSupervisor が全ワーカー分をまとめて行う
+        self.heartbeat = HeartbeatWriter(self.worker_name)
+        self.comm.heartbeat = self.heartbeat
+        self.comm.subscribe()
+        # 逐次実行（1件ずつ）でもタスクは共有プールで動かし、監視ループを塞がない
+        self.executor_kind = "thread"
+        self.executor = shared.executor
+    
+    def recover_tasks(self):
+        """前回の実行で中断したタスクをジャーナルから復元する
+        
+        出力まで書き終えていたタスクは実行し直さず完了処理だけを行い、実行中だったタスク
+        （共有キューのリースを含む）はリースの期限切れを待たずにすぐ再実行する。
+        """
+        if self.journal is None:
+            return
+        finalized = 0
+        resumed = set()
+        for task_id, record in read_journal(self.worker_name).items():
+            task_file = Path(record.get("path", ""))
+            if not record.get("path") or not task_file.exists():
+                # 既に完了・移動済み（Managerが他のワーカーへ移した場合を含む）
+                continue
+            if record["state"] == OUTPUT_WRITTEN:
+                try:
+                    with open(task_file, 'r') as f:
+                        task_data = json.load(f)
+                except (OSError, ValueError) as e:
+                    self.comm.log_activity(f"Error reading journaled task {task_file}: {e}")
+                    continue
+                outcome = {"success": True, "task_type": record.get("task_type"),
+                           "timings": record.get("timings", {}), "exit_code": record.get("exit_code"),
+                           "array": record.get("array")}
+                self.comm.set_current_task(task_id)
+                try:
+                    self.complete_task(task_file, task_data, outcome)
+                    self.journal.append(task_id, COMPLETED)
+                finally:
+                    self.comm.set_current_task(None)
+                finalized += 1
+            else:
+                self.pending_heap.add_file(task_file)
+                resumed.add(task_id)
+        # 移動済みのタスクの記録は捨てる
+        self.journal.compact(keep=resumed)
+        if finalized or resumed:
+            self.comm.log_activity(
+                f"Recovered from journal: finalized {finalized} tasks whose output was already written, "
+                f"resuming {len(resumed)} interrupted tasks")
+    
+    def reset_processes(self):
+        """前回の実行で取り残された子プロセスを止め、記録を消す（ジャーナルの有無によらず、再実行と重ならないように）"""
+        orphans = self.processes.reset()
+        if orphans:
+            self.comm.log_activity(f"Killed {orphans} task processes left by the previous run")
     
     def ensure_directories(self):
         """必要なディレクトリを確保"""
         os.makedirs(self.pending_tasks_dir, exist_ok=True)
         os.makedirs(self.completed_tasks_dir, exist_ok=True)
+        os.makedirs(self.killed_tasks_dir, exist_ok=True)
         os.makedirs(self.worker_dir, exist_ok=True)
         os.makedirs("communication", exist_ok=True)
     
+    def create_watcher(self, backend):
+        """pending_tasksとメッセージストアの監視を開始"""
+        watcher = create_watcher(backend)
+        watcher.add(self.pending_tasks_dir, "tasks", suffix=".json")
+        if self.queue is not None:
+            watcher.add(self.queue.ready_dir, "tasks", suffix=".json")
+        watcher.add(self.comm.store.segments_dir, "messages")
+        if self.comm.transport.fileno() is not None:
+            watcher.add_fd(self.comm.transport.fileno(), "messages")
+        self.comm.log_activity(f"Watching for tasks and messages with {type(watcher).__name__}")
+        return watcher
+    
+    def create_executor(self):
+        """タスク実行用の上限付きプールを作成"""
+        if self.executor_kind == "process":
+            executor = ProcessPoolExecutor(max_workers=self.max_parallel_tasks)
+        else:
+            executor = ThreadPoolExecutor(max_workers=self.max_parallel_tasks,
+                                          thread_name_prefix=f"{self.worker_name}-task")
+        self.comm.log_activity(
+            f"Running up to {self.max_parallel_tasks} tasks in parallel ({self.executor_kind} pool)")
+        return executor
+    
+    def create_metrics(self, port):
+        """タスクのレイテンシとキューの深さのメトリクスを用意（port 指定時はHTTPで公開）"""
+        metrics = MetricsRegistry()
+        metrics.histogram("task_latency_seconds",
+                          "Task latency by stage (queue_wait, pickup, run)",
+                          ["worker", "task_type", "stage"])
+        metrics.gauge("worker_pending_tasks", "Tasks waiting in the worker's priority heap",
+                      lambda: {(("worker", self.worker_name),): len(self.pending_heap)})
+        metrics.gauge("worker_in_flight_tasks", "Tasks currently running on the worker",
+                      lambda: {(("worker", self.worker_name),): len(self.in_flight)})
+        metrics.gauge("message_store_bytes", "Total size of message store segments",
+                      lambda: self.comm.store.disk_usage()[1])
+        metrics.gauge("message_store_segments", "Number of message store segments",
+                      lambda: self.comm.store.disk_usage()[0])
+        if self.queue is not None:
+            metrics.gauge("shared_queue_ready_tasks", "Tasks waiting in the shared queue",
+                          lambda: len(os.listdir(self.queue.ready_dir)))
+        if port is not None:
+            host, bound_port = metrics.serve(port)
+            self.comm.log_activity(f"Metrics available at http://{host}:{bound_port}/metrics")
+        if self.metrics_file is not None:
+            self.comm.log_activity(f"Writing metrics to {self.metrics_file}")
+        return metrics
+    
     def read_instructions(self):
         """指示書を読み込む"""
         try:
@@ -44,45 +296,402 @@ class WorkerSessionAutomation:
         except Exception as e:
             self.comm.log_activity(f"Error reading instructions: {str(e)}")
     
-    def check_pending_tasks(self):
-        """保留中のタスクをチェック"""
+    def check_pending_tasks(self, task_files=None):
+        """保留中のタスクをチェック（task_files 指定時はそのファイルだけを追加）"""
         try:
-            task_files = list(Path(self.pending_tasks_dir).glob("*.json"))
-            if task_files:
-                self.comm.log_activity(f"Found {len(task_files)} pending tasks")
-                for task_file in task_files:
-                    self.process_task(task_file)
+            if task_files is None:
+                task_files = self.find_task_files()
+            added = self.enqueue_pending(task_files)
+            if added:
+                self.comm.log_activity(f"Found {added} pending tasks")
+            
+            if self.tasks_available is not None:
+                self.tasks_available()
+            elif self.executor is None:
+                self.run_pending_tasks()
+            else:
+                self.dispatch_tasks()
         except Exception as e:
             self.comm.log_activity(f"Error checking pending tasks: {str(e)}")
     
-    def process_task(self, task_file):
-        """タスクを処理"""
+    def enqueue_pending(self, task_files):
+        """実行中でないタスクを優先度ヒープに追加し、追加した件数を返す"""
+        added = 0
+        for task_file in task_files:
+            if task_file.name not in self.in_flight and self.pending_heap.add_file(task_file):
+                added += 1
+        return added
+    
+    def next_pending_task(self):
+        """ヒープから次のタスクを取り出す（既に消えたファイルは読み飛ばす）"""
+        while True:
+            task_file = self.pending_heap.pop()
+            if task_file is None or task_file.exists():
+                return task_file
+    
+    def run_pending_tasks(self):
+        """優先度順に1件ずつ処理"""
+        if self._draining:
+            return
+        self._draining = True
         try:
-            with open(task_file, 'r') as f:
-                task_data = json.load(f)
-            
-            task_name = task_data.get('name', 'unknown_task')
-            self.comm.log_activity(f"Starting task: {task_name}", progress=0)
+            while self.running:
+                task_file = self.next_pending_task()
+                if task_file is None:
+                    # ワークスティーリング時は奪える仕事がなくなるまで続ける
+                    if self.steal and self.enqueue_pending(self.find_task_files()):
+                        continue
+                    return
+                self.run_claimed_task(task_file)
+                # 実行中に届いたタスク・メッセージを取り込み、次の1件を優先度で選び直す
+                self.poll_watcher()
+        finally:
+            self._draining = False
+    
+    def find_task_files(self):
+        """自分宛て・共有キューのタスクを列挙（なければ他ワーカーから奪う）"""
+        task_files = list(Path(self.pending_tasks_dir).glob("*.json"))
+        if self.queue is None:
+            return task_files
+        
+        # 期限切れリースの回収はTTLの半分ごとに1回で十分
+        now = time.time()
+        if now - self._last_reclaim >= self.queue.lease_ttl / 2:
+            reclaimed = self.queue.reclaim_expired()
+            if reclaimed:
+                self.comm.log_activity(f"Returned {reclaimed} expired leases to the shared queue")
+            self._last_reclaim = now
+        
+        task_files.extend(self.queue.ready_tasks())
+        if not task_files and self.steal and len(self.in_flight) < self.max_parallel_tasks:
+            stolen = self.queue.steal(self.worker_name, self.queue.backlog_owners())
+            if stolen is not None:
+                self.comm.log_activity(f"Stole task {stolen.name} from another worker's backlog")
+                task_files.append(stolen)
+        return task_files
+    
+    def claim_task(self, task_file):
+        """タスクの実行権を取得（共有キュー使用時はリースへ移動）"""
+        if self.queue is None or task_file.parent == Path(self.queue.lease_dir(self.worker_name)):
+            claimed = task_file
+        else:
+            claimed = self.queue.claim(task_file, self.worker_name)
+        if claimed is not None and self.journal is not None:
+            self.journal.append(claimed.stem, CLAIMED, path=str(claimed))
+        return claimed
+    
+    def run_claimed_task(self, task_file):
+        """実行権を取得できたタスクのみ処理"""
+        with self._task_lock:
+            self.in_flight.add(task_file.name)
+        try:
+            claimed = self.claim_task(task_file)
+            if claimed is not None:
+                claimed_at = time.time()
+                if self.heartbeat is not None:
+                    self.heartbeat.task_started(claimed.name)
+                self.record_task_outcome(self.process_task(claimed, claimed_at))
+        finally:
+            with self._task_lock:
+                self.in_flight.discard(task_file.name)
+    
+    def dispatch_tasks(self):
+        """空きスロットの分だけ優先度順にタスクを投入"""
+        while True:
+            with self._task_lock:
+                if len(self.in_flight) >= self.max_parallel_tasks:
+                    return
+                task_file = self.next_pending_task()
+                if task_file is None:
+                    return
+                if task_file.name in self.in_flight:
+                    continue
+                self.in_flight.add(task_file.name)
             
-            # Managerに開始報告
-            self.comm.send_message("manager", f"タスク開始: {task_name}", 
-                                 f"Task '{task_name}' has been started by {self.worker_name}")
+            claimed = self.claim_task(task_file)
+            if claimed is None:
+                # 他のワーカーが先に取得した
+                with self._task_lock:
+                    self.in_flight.discard(task_file.name)
+                continue
+            claimed_at = time.time()
             
-            # タスクの種類に応じて実行
-            if 'command' in task_data:
-                self.execute_command_task(task_data)
-            elif 'script' in task_data:
-                self.execute_script_task(task_data)
+            if self.heartbeat is not None:
+                self.heartbeat.task_started(claimed.name)
+            if self.executor_kind == "process":
+                future = self.executor.submit(_process_task_in_child, self.worker_name, str(claimed),
+                                              claimed_at, self.result_cache is not None,
+                                              self.cache_max_mb, self.log_formats, self.transport,
+                                              self.artifacts is not None, self.journal is not None)
             else:
-                self.execute_generic_task(task_data)
-            
-            # 完了処理
-            self.complete_task(task_file, task_data)
-            
+                future = self.executor.submit(self.process_task, claimed, claimed_at)
+            future.add_done_callback(lambda f, task_file=claimed: self.on_task_done(task_file, f))
+    
+    def on_task_done(self, task_file, future):
+        """タスク終了時にスロットを解放し、次のタスクを投入"""
+        with self._task_lock:
+            self.in_flight.discard(task_file.name)
+        # 終了と入れ違いに届いたキャンセルの記録を消す
+        self.processes.clear(task_file.stem)
+        if future.exception() is not None:
+            self.comm.log_activity(f"Error in task executor for {task_file.name}: {future.exception()}")
+            outcome = {"success": False, "task_type": None, "timings": {}}
+        else:
+            outcome = future.result()
+            if outcome.get("cache_counts") is not None:
+                # 子プロセスで数えたキャッシュのヒット・ミスを合算
+                self.result_cache.record(*outcome["cache_counts"])
+        self.record_task_outcome(outcome)
+        if not self.running:
+            return
+        if self.steal and not len(self.pending_heap):
+            self.check_pending_tasks()
+        else:
+            self.dispatch_tasks()
+    
+    def record_task_outcome(self, outcome):
+        """タスク終了後の集計（ハートビート・キャッシュ統計・段階ごとのレイテンシ）"""
+        if self.heartbeat is not None:
+            self.heartbeat.task_finished(outcome["success"])
+        if self.result_cache is not None:
+            self.result_cache.write_stats(self.worker_name)
+        if self.metrics is not None and outcome["success"]:
+            for stage, seconds in stage_latencies(outcome["timings"]).items():
+                self.metrics.observe("task_latency_seconds", seconds, worker=self.worker_name,
+                                     task_type=outcome["task_type"], stage=stage)
+    
+    def task_type(self, task_data):
+        if 'array' in task_data:
+            return "array"
+        if 'command' in task_data:
+            return "command"
+        if 'script' in task_data:
+            return "script"
+        return "generic"
+    
+    def process_task(self, task_file, claimed_at=None):
+        """タスクを処理し、成否・種類・各段階の時刻を返す"""
+        outcome = {"success": False, "task_type": None, "timings": {"claimed_at": claimed_at}}
+        # このスレッドのログにタスクIDを付ける
+        self.comm.set_current_task(task_file.stem)
+        try:
+            task_data = self.begin_task(task_file, outcome)
+            result = self.execute_task(task_data)
+            outcome["exit_code"] = getattr(result, "returncode", None)
+            if getattr(result, "array", None) is not None:
+                outcome["array"] = result.array
+            self.finish_task(task_file, task_data, outcome)
         except Exception as e:
-            self.comm.log_activity(f"Error processing task {task_file}: {str(e)}")
-            self.comm.send_message("manager", f"タスクエラー: {task_file.name}", 
-                                 f"Error occurred while processing task: {str(e)}", "high")
+            self.fail_task(task_file, e)
+        finally:
+            self.comm.set_current_task(None)
+        return outcome
+    
+    def begin_task(self, task_file, outcome):
+        """タスクファイルを読み、開始を記録・報告して task_data を返す"""
+        with open(task_file, 'r') as f:
+            task_data = json.load(f)
+        outcome["timings"]["enqueued_at"] = task_data.get('enqueued_at')
+        outcome["task_type"] = self.task_type(task_data)
+        
+        task_name = task_data.get('name', 'unknown_task')
+        self.comm.log_activity(f"Starting task: {task_name}", progress=0, event="task_started")
+        if self.journal is not None:
+            self.journal.append(task_file.stem, RUNNING, path=str(task_file))
+        
+        # Managerに開始報告
+        self.comm.send_message("manager", f"タスク開始: {task_name}", 
+                             f"Task '{task_name}' has been started by {self.worker_name}")
+        self.prepare_artifacts(task_data)
+        outcome["timings"]["started_at"] = time.time()
+        return task_data
+    
+    def prepare_artifacts(self, task_data):
+        """依存先の成果物を変更されないコピーにし、artifacts（名前 → パス）と inputs に付ける
+        
+        依存先の出力ファイル（task_<name>_output.txt）は同じ名前の後続タスクに上書きされるので、
+        成果物ストアのハッシュから <worker>/artifacts/<hash> に展開して渡す。
+        """
+        sources = task_data.get('artifacts')
+        if not sources:
+            return
+        paths = {name: source if isinstance(source, str) else self.materialize_artifact(source)
+                 for name, source in sources.items()}
+        task_data['artifacts'] = paths
+        # 結果キャッシュのキーに依存先の出力を含める
+        inputs = list(task_data.get('inputs', []))
+        task_data['inputs'] = inputs + [path for path in paths.values() if path not in inputs]
+    
+    def materialize_artifact(self, source):
+        """依存先の出力を <worker>/artifacts/<sha256> に置いてパスを返す（同じ内容なら使い回す）"""
+        digest = source.get('hash')
+        if digest:
+            path = os.path.abspath(os.path.join(self.artifact_inputs_dir, digest))
+            try:
+                os.utime(path)
+                return path
+            except FileNotFoundError:
+                pass
+            store = self.artifacts if self.artifacts is not None else ArtifactStore()
+            try:
+                with store.open(digest) as stream:
+                    return self.write_artifact_input(stream)
+            except (OSError, ValueError) as e:
+                self.comm.log_activity(f"WARNING: artifact {digest[:12]} of {source['task_id']} "
+                                       f"is not in the store ({e}), copying {source['output']}")
+        # 成果物ストアに保存されていない（--no-artifacts のワーカーの出力）ときは出力ファイルをコピーする
+        with open(source['output'], 'rb') as stream:
+            return self.write_artifact_input(stream)
+    
+    def write_artifact_input(self, stream):
+        os.makedirs(self.artifact_inputs_dir, exist_ok=True)
+        self.prune_artifact_inputs()
+        digest = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=self.artifact_inputs_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in iter(lambda: stream.read(1024 * 1024), b""):
+                    digest.update(chunk)
+                    f.write(chunk)
+            path = os.path.abspath(os.path.join(self.artifact_inputs_dir, digest.hexdigest()))
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+        return path
+    
+    def prune_artifact_inputs(self):
+        """しばらく使われていない成果物のコピーを削除（1時間に1回まで）"""
+        now = time.time()
+        if now - self._last_input_prune < 3600:
+            return
+        self._last_input_prune = now
+        for entry in os.scandir(self.artifact_inputs_dir):
+            try:
+                if entry.stat().st_mtime < now - INPUT_RETENTION:
+                    os.remove(entry.path)
+            except FileNotFoundError:
+                continue
+    
+    def execute_task(self, task_data):
+        """タスクの種類に応じて実行（キャッシュ対象なら前回の結果を再利用）"""
+        if 'array' in task_data:
+            return self.execute_array_task(task_data)
+        if self.result_cache is not None and self.result_cache.is_cacheable(task_data):
+            return self.execute_cached_task(task_data)
+        if 'command' in task_data:
+            return self.execute_command_task(task_data)
+        if 'script' in task_data:
+            return self.execute_script_task(task_data)
+        return self.execute_generic_task(task_data)
+    
+    def finish_task(self, task_file, task_data, outcome):
+        outcome["timings"]["ended_at"] = time.time()
+        self.journal_output(task_file, task_data, outcome)
+        self.complete_task(task_file, task_data, outcome)
+        if self.journal is not None:
+            self.journal.append(task_file.stem, COMPLETED)
+        outcome["success"] = True
+        self.processes.clear(task_file.stem)
+    
+    def journal_output(self, task_file, task_data, outcome):
+        """出力ファイルをディスクに書き切ってから output_written を記録（以降に落ちても再実行しない）"""
+        if self.journal is None:
+            return
+        output_path = self.task_output_path(task_data)
+        try:
+            fd = os.open(output_path, os.O_RDONLY)
+        except FileNotFoundError:
+            pass
+        else:
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        self.journal.append(task_file.stem, OUTPUT_WRITTEN, durable=True,
+                            path=str(task_file), exit_code=outcome.get("exit_code"),
+                            task_type=outcome["task_type"], timings=outcome["timings"],
+                            array=outcome.get("array"))
+    
+    def fail_task(self, task_file, error):
+        self.processes.clear(task_file.stem)
+        if isinstance(error, TaskKilled):
+            self.kill_task(task_file, error)
+            return
+        if self.journal is not None:
+            # タスクファイルは pending_tasks に残り、リトライで再実行される
+            self.journal.append(task_file.stem, FAILED, path=str(task_file))
+        self.comm.log_activity(f"Error processing task {task_file}: {str(error)}", event="task_failed")
+        self.comm.send_message("manager", f"タスクエラー: {task_file.name}", 
+                             f"Error occurred while processing task: {str(error)}", "high")
+    
+    def kill_task(self, task_file, killed, started=True):
+        """中断したタスクを killed_tasks へ移し、Managerが再配布できるよう理由を添えて報告"""
+        killed_file = Path(self.killed_tasks_dir) / task_file.name
+        try:
+            shutil.move(str(task_file), str(killed_file))
+        except OSError as e:
+            self.comm.log_activity(f"Error moving killed task {task_file.name}: {str(e)}")
+            killed_file = None
+        
+        if self.journal is not None:
+            self.journal.append(task_file.stem, KILLED)
+        self.comm.log_activity(f"Task killed ({killed.reason}): {task_file.name}", event="task_killed")
+        self.comm.send_message("manager", f"タスク中断: {task_file.name}",
+                               f"Task '{task_file.name}' was killed on {self.worker_name}: {killed}",
+                               "high",
+                               data={"status": "killed", "reason": killed.reason,
+                                     "task_id": task_file.stem, "started": started,
+                                     "task_file": None if killed_file is None else str(killed_file)})
+    
+    def register_task_process(self, pid):
+        """実行中タスクの子プロセスを記録（キャンセル済みならその場で kill される）"""
+        self.processes.register(self.comm.current_task(), pid)
+    
+    def settle_task_process(self, limits, result):
+        """子プロセスの終了後、タイムアウト・キャンセル・制限超過なら TaskKilled を送出"""
+        self.processes.finish(self.comm.current_task(), limits, result.returncode,
+                              result.stderr or "", getattr(result, "timed_out", False))
+    
+    def task_env(self, task_data, extra_only=False):
+        """依存先の成果物を環境変数で渡す（ARTIFACT_<依存先のタスク名> と TASK_ARTIFACTS、なければ None）"""
+        artifacts = task_data.get('artifacts')
+        if not artifacts:
+            return None
+        env = {artifact_env_name(name): path for name, path in artifacts.items()}
+        env["TASK_ARTIFACTS"] = json.dumps(artifacts, ensure_ascii=False)
+        return env if extra_only else dict(os.environ, **env)
+    
+    def run_limited(self, args, limits, shell=False, env=None):
+        """子プロセスを新しいセッションで実行し、timeout を過ぎたらプロセスグループごと kill する"""
+        gate = LimitGate(limits, args, shell)
+        try:
+            process = subprocess.Popen(gate.args, shell=gate.shell, cwd=self.worker_dir, env=env, text=True,
+                                       stdin=gate.stdin, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                       start_new_session=True)
+        except BaseException:
+            gate.release(None)
+            raise
+        gate.release(process.pid)
+        self.register_task_process(process.pid)
+        timed_out = False
+        try:
+            stdout, stderr = process.communicate(timeout=limits.timeout)
+        except subprocess.TimeoutExpired:
+            # kill 後もパイプが閉じるまでの出力は結果に残す
+            kill_process_group(process.pid)
+            stdout, stderr = process.communicate()
+            timed_out = True
+        except BaseException:
+            kill_process_group(process.pid)
+            process.wait()
+            raise
+        result = subprocess.CompletedProcess(args, process.returncode, stdout, stderr)
+        result.timed_out = timed_out
+        return result
     
     def execute_command_task(self, task_data):
         """コマンドタスクを実行"""
@@ -92,30 +701,27 @@ class WorkerSessionAutomation:
         self.comm.log_activity(f"Executing command: {command}", progress=25)
         
         try:
-            # 作業ディレクトリを変更
-            original_dir = os.getcwd()
-            os.chdir(self.worker_dir)
-            
-            # コマンド実行
-            result = subprocess.run(command, shell=True, capture_output=True, text=True)
-            
-            # 結果をファイルに保存
             output_file = f"task_{task_name}_output.txt"
-            with open(output_file, 'w') as f:
-                f.write(f"Task: {task_name}\n")
-                f.write(f"Command: {command}\n")
-                f.write(f"Exit Code: {result.returncode}\n")
-                f.write(f"STDOUT:\n{result.stdout}\n")
-                f.write(f"STDERR:\n{result.stderr}\n")
+            header = [f"Task: {task_name}", f"Command: {command}"]
+            limits = TaskLimits.from_task(task_data)
             
-            self.comm.log_activity(f"Command executed successfully. Output saved to {output_file}", progress=75)
+            if self.stream_output:
+                # 出力をファイルへ逐次書き出しながら実行
+                result = self.run_streaming_task(command, task_name, output_file, header, shell=True,
+                                                 limits=limits, env=self.task_env(task_data))
+            else:
+                # コマンド実行（作業ディレクトリはプロセス全体ではなく子プロセスにのみ指定）
+                result = self.run_limited(command, limits, shell=True, env=self.task_env(task_data))
+                
+                # 結果をファイルに保存
+                self.write_task_output(output_file, header, result)
+            self.settle_task_process(limits, result)
             
-            # 元のディレクトリに戻る
-            os.chdir(original_dir)
+            self.comm.log_activity(f"Command executed successfully. Output saved to {output_file}", progress=75)
+            return result
             
         except Exception as e:
             self.comm.log_activity(f"Error executing command: {str(e)}")
-            os.chdir(original_dir)
             raise
     
     def execute_script_task(self, task_data):
@@ -126,41 +732,261 @@ class WorkerSessionAutomation:
         self.comm.log_activity(f"Executing script for task: {task_name}", progress=25)
         
         try:
-            # 作業ディレクトリを変更
-            original_dir = os.getcwd()
-            os.chdir(self.worker_dir)
-            
-            # スクリプトを一時ファイルに保存
-            script_file = f"temp_script_{task_name}.py"
-            with open(script_file, 'w') as f:
-                f.write(script)
-            
-            # スクリプト実行
-            result = subprocess.run([sys.executable, script_file], 
-                                  capture_output=True, text=True)
-            
-            # 結果をファイルに保存
             output_file = f"task_{task_name}_output.txt"
-            with open(output_file, 'w') as f:
-                f.write(f"Task: {task_name}\n")
-                f.write(f"Script executed: {script_file}\n")
-                f.write(f"Exit Code: {result.returncode}\n")
-                f.write(f"STDOUT:\n{result.stdout}\n")
-                f.write(f"STDERR:\n{result.stderr}\n")
+            limits = TaskLimits.from_task(task_data)
             
-            # 一時ファイルを削除
-            os.remove(script_file)
+            if self.script_pool is not None:
+                # 温まったインタプリタで実行（一時スクリプトファイルは作らない）
+                header = [f"Task: {task_name}", "Script executed: <warm interpreter pool>"]
+                result = self.run_pooled_script(script, output_file, header, limits,
+                                                self.task_env(task_data, extra_only=True))
+            else:
+                # スクリプトを一時ファイルに保存（並列実行時に衝突しないようスレッド単位で命名）
+                script_file = f"temp_script_{task_name}_{os.getpid()}_{threading.get_ident()}.py"
+                script_path = os.path.join(self.worker_dir, script_file)
+                with open(script_path, 'w') as f:
+                    f.write(script)
+                
+                header = [f"Task: {task_name}", f"Script executed: {script_file}"]
+                
+                # スクリプト実行
+                try:
+                    if self.stream_output:
+                        result = self.run_streaming_task([sys.executable, script_file], task_name,
+                                                         output_file, header, limits=limits,
+                                                         env=self.task_env(task_data))
+                    else:
+                        result = self.run_limited([sys.executable, script_file], limits,
+                                                  env=self.task_env(task_data))
+                finally:
+                    # 一時ファイルを削除
+                    os.remove(script_path)
+                
+                # 結果をファイルに保存
+                if not self.stream_output:
+                    self.write_task_output(output_file, header, result)
+            self.settle_task_process(limits, result)
             
             self.comm.log_activity(f"Script executed successfully. Output saved to {output_file}", progress=75)
-            
-            # 元のディレクトリに戻る
-            os.chdir(original_dir)
+            return result
             
         except Exception as e:
             self.comm.log_activity(f"Error executing script: {str(e)}")
-            os.chdir(original_dir)
             raise
     
+    def execute_array_task(self, task_data):
+        """配列タスクを実行（項目をバッチごとに1つのシェル／インタプリタでまとめて実行する）
+        
+        項目ごとの終了コードは task_<name>_results.tsv に記録し、同じタスクの再実行では
+        記録済みの項目を飛ばす。出力は全項目分を task_<name>_output.txt に追記する。
+        """
+        array = TaskArray.from_task(task_data)
+        task_name = task_data.get('name', 'array_task')
+        limits = TaskLimits.from_task(task_data)
+        output_file = f"task_{task_name}_output.txt"
+        results_file = f"task_{task_name}_results.tsv"
+        results = ArrayResults(os.path.join(self.worker_dir, results_file), self.comm.current_task(),
+                               array.total)
+        self.comm.log_activity(
+            f"Executing array task: {task_name} ({array.total} items in batches of {array.batch_size}"
+            + (f", resuming after {results.resumed} items" if results.resumed else "") + ")", progress=25)
+        
+        script_file = None
+        if array.script is not None:
+            script_file = f"temp_script_{task_name}_{os.getpid()}_{threading.get_ident()}.py"
+            with open(os.path.join(self.worker_dir, script_file), 'w') as f:
+                f.write(array.script)
+        started = time.time()
+        last_report = started
+        try:
+            with open(os.path.join(self.worker_dir, output_file), 'a' if results.resumed else 'w') as output:
+                if not results.resumed:
+                    template = f"Command: {array.command}" if script_file is None else "Script: <array template>"
+                    output.write(f"Task: {task_name}\nArray: {array.total} items\n{template}\n")
+                    output.flush()
+                for batch in array.batches(results.codes):
+                    batch_limits = limits
+                    if limits.timeout is not None:
+                        # timeout は配列全体に対する上限
+                        remaining = limits.timeout - (time.time() - started)
+                        if remaining <= 0:
+                            raise TaskKilled("timeout", f"exceeded {limits.timeout} seconds")
+                        batch_limits = TaskLimits(remaining, limits.cpu_seconds, limits.memory_mb)
+                    results.record(self.run_array_batch(array, batch, batch_limits, output, script_file,
+                                                        self.task_env(task_data)))
+                    done = len(results.codes)
+                    if done == array.total or time.time() - last_report >= 1:
+                        self.comm.log_activity(
+                            f"Array {task_name}: {done}/{array.total} items done ({results.failed} failed)",
+                            progress=25 + 50 * done // max(array.total, 1))
+                        last_report = time.time()
+        finally:
+            if script_file is not None:
+                os.remove(os.path.join(self.worker_dir, script_file))
+        
+        summary = results.summary()
+        self.comm.log_activity(
+            f"Array task finished: {summary['succeeded']}/{summary['total']} items succeeded, "
+            f"{summary['failed']} failed. Results saved to {results_file}", progress=75)
+        result = subprocess.CompletedProcess(task_name, 1 if summary['failed'] else 0)
+        result.array = summary
+        return result
+    
+    def run_array_batch(self, array, batch, limits, output, script_file=None, env=None):
+        """1バッチを1つの子プロセスで実行し [(index, exit_code), ...] を返す（出力は output へ直接書く）"""
+        status_fd, status_path = tempfile.mkstemp(prefix="array_status_")
+        batch_fd, batch_path = tempfile.mkstemp(prefix="array_batch_")
+        os.close(status_fd)
+        try:
+            with os.fdopen(batch_fd, 'w') as f:
+                if script_file is None:
+                    f.write(array.command_batch(batch))
+                else:
+                    json.dump(batch, f)
+            if script_file is None:
+                args = ["/bin/sh", batch_path]
+            else:
+                args = [sys.executable, "-c", SCRIPT_DRIVER, script_file, batch_path, status_path]
+            
+            gate = LimitGate(limits, args)
+            try:
+                process = subprocess.Popen(gate.args, cwd=self.worker_dir,
+                                           env=dict(env or os.environ, TASK_ARRAY_STATUS=status_path),
+                                           stdin=gate.stdin, stdout=output, stderr=subprocess.STDOUT,
+                                           start_new_session=True)
+            except BaseException:
+                gate.release(None)
+                raise
+            gate.release(process.pid)
+            self.register_task_process(process.pid)
+            timed_out = False
+            try:
+                process.wait(timeout=limits.timeout)
+            except subprocess.TimeoutExpired:
+                kill_process_group(process.pid)
+                process.wait()
+                timed_out = True
+            except BaseException:
+                kill_process_group(process.pid)
+                process.wait()
+                raise
+            result = subprocess.CompletedProcess(args, process.returncode, stderr="")
+            result.timed_out = timed_out
+            self.settle_task_process(limits, result)
+            
+            codes = {}
+            with open(status_path, 'r') as f:
+                for line in f:
+                    index, _, code = line.strip().partition(" ")
+                    codes[int(index)] = int(code)
+            # 終了コードを書く前に子プロセスが終わった項目は、子プロセスの終了コードで失敗扱い
+            missing = process.returncode or -1
+            return [(index, codes.get(index, missing)) for index, _ in batch]
+        finally:
+            os.remove(status_path)
+            os.remove(batch_path)
+    
+    def execute_cached_task(self, task_data):
+        """キャッシュにあれば保存済みの結果を出力し、なければ実行して結果を保存"""
+        task_name = task_data.get('name', f"{self.task_type(task_data)}_task")
+        key = self.result_cache.key_for(task_data, self.worker_dir)
+        result = self.result_cache.get(key)
+        
+        if result is not None:
+            output_file = f"task_{task_name}_output.txt"
+            if 'command' in task_data:
+                header = [f"Task: {task_name}", f"Command: {task_data['command']}"]
+            else:
+                header = [f"Task: {task_name}", "Script executed: <cached result>"]
+            header.append(f"Cached result: {key[:16]}")
+            self.write_task_output(output_file, header, result)
+            self.comm.log_activity(
+                f"Cache hit for task {task_name}, output saved to {output_file} "
+                f"({self.result_cache.summary()})", progress=75)
+        else:
+            self.comm.log_activity(
+                f"Cache miss for task {task_name} ({self.result_cache.summary()})")
+            if 'command' in task_data:
+                result = self.execute_command_task(task_data)
+            else:
+                result = self.execute_script_task(task_data)
+            self.result_cache.put(key, result)
+        return result
+    
+    def write_task_output(self, output_file, header, result):
+        """実行結果を出力ファイルに保存"""
+        with open(os.path.join(self.worker_dir, output_file), 'w') as f:
+            for line in header:
+                f.write(f"{line}\n")
+            f.write(f"Exit Code: {result.returncode}\n")
+            f.write(f"STDOUT:\n{result.stdout}\n")
+            f.write(f"STDERR:\n{result.stderr}\n")
+    
+    def run_pooled_script(self, script, output_file, header, limits=None, env=None):
+        """インタプリタプールでスクリプトを実行し、結果を保存"""
+        stdout_fd, stdout_path = tempfile.mkstemp(prefix="script_stdout_")
+        stderr_fd, stderr_path = tempfile.mkstemp(prefix="script_stderr_")
+        os.close(stdout_fd)
+        os.close(stderr_fd)
+        try:
+            timed_out = False
+            try:
+                returncode = self.script_pool.run(script, self.worker_dir, stdout_path, stderr_path,
+                                                  limits, self.register_task_process, env)
+            except TaskKilled:
+                returncode, timed_out = -signal.SIGKILL, True
+            
+            if self.stream_output:
+                # 出力はメモリに載せずファイル間でコピー
+                with open(os.path.join(self.worker_dir, output_file), 'wb') as out:
+                    for line in header:
+                        out.write(f"{line}\n".encode("utf-8"))
+                    out.write(f"Exit Code: {returncode}\nSTDOUT:\n".encode("utf-8"))
+                    with open(stdout_path, 'rb') as f:
+                        shutil.copyfileobj(f, out)
+                    out.write(b"\nSTDERR:\n")
+                    with open(stderr_path, 'rb') as f:
+                        shutil.copyfileobj(f, out)
+                    out.write(b"\n")
+                result = subprocess.CompletedProcess("<warm interpreter pool>", returncode,
+                                                     stderr=self.read_tail(stderr_path))
+                result.timed_out = timed_out
+                return result
+            
+            with open(stdout_path, 'r', errors="replace") as f:
+                stdout = f.read()
+            with open(stderr_path, 'r', errors="replace") as f:
+                stderr = f.read()
+            result = subprocess.CompletedProcess("<warm interpreter pool>", returncode, stdout, stderr)
+            result.timed_out = timed_out
+            self.write_task_output(output_file, header, result)
+            return result
+        finally:
+            os.remove(stdout_path)
+            os.remove(stderr_path)
+    
+    def read_tail(self, path, size=4096):
+        """ファイル末尾だけを読む（メモリ超過の判定用）"""
+        with open(path, 'rb') as f:
+            f.seek(max(os.path.getsize(path) - size, 0))
+            return f.read().decode("utf-8", errors="replace")
+    
+    def run_streaming_task(self, args, task_name, output_file, header, shell=False, limits=None,
+                           env=None):
+        """出力をファイルへ逐次書き出しながら実行し、進捗をログに記録"""
+        def report_progress(total_bytes, lines, byte_rate, line_rate):
+            self.comm.log_activity(
+                f"Task {task_name} running: {total_bytes} bytes, {lines} lines "
+                f"({line_rate:.0f} lines/s, {byte_rate / 1024:.0f} KiB/s)", progress=50)
+        
+        result = run_streaming(args, os.path.join(self.worker_dir, output_file), header,
+                               cwd=self.worker_dir, shell=shell, on_progress=report_progress,
+                               limits=limits, on_start=self.register_task_process, env=env)
+        self.comm.log_activity(
+            f"Task {task_name} exited with code {result.returncode}: "
+            f"{result.stdout_bytes} bytes stdout, {result.stderr_bytes} bytes stderr")
+        return result
+    
     def execute_generic_task(self, task_data):
         """一般的なタスクを実行"""
         task_name = task_data.get('name', 'generic_task')
@@ -168,13 +994,9 @@ class WorkerSessionAutomation:
         
         self.comm.log_activity(f"Processing generic task: {task_name}", progress=25)
         
-        # 作業ディレクトリを変更
-        original_dir = os.getcwd()
-        os.chdir(self.worker_dir)
-        
         # タスク情報をファイルに保存
         output_file = f"task_{task_name}_output.txt"
-        with open(output_file, 'w') as f:
+        with open(os.path.join(self.worker_dir, output_file), 'w') as f:
             f.write(f"Task: {task_name}\n")
             f.write(f"Description: {description}\n")
             f.write(f"Worker: {self.worker_name}\n")
@@ -182,12 +1004,9 @@ class WorkerSessionAutomation:
             f.write(f"Status: Task acknowledged and processed\n")
         
         self.comm.log_activity(f"Generic task processed. Output saved to {output_file}", progress=75)
-        
-        # 元のディレクトリに戻る
-        os.chdir(original_dir)
     
-    def complete_task(self, task_file, task_data):
-        """タスクを完了"""
+    def complete_task(self, task_file, task_data, outcome=None):
+        """タスクを完了（各段階の時刻も報告し、Managerが全体のレイテンシを集計できるようにする）"""
         task_name = task_data.get('name', 'unknown_task')
         
         try:
@@ -195,37 +1014,121 @@ class WorkerSessionAutomation:
             completed_file = Path(self.completed_tasks_dir) / task_file.name
             shutil.move(str(task_file), str(completed_file))
             
-            self.comm.log_activity(f"Task completed: {task_name}", progress=100)
+            self.comm.log_activity(f"Task completed: {task_name}", progress=100, event="task_completed")
             
-            # Managerに完了報告
+            # Managerに完了報告（出力ファイルは依存するタスクへ成果物として渡される）
+            data = {"task_id": task_file.stem}
+            output_path = self.task_output_path(task_data)
+            if 'name' in task_data:
+                data["output"] = output_path
+            exit_code = outcome.get("exit_code") if outcome is not None else None
+            if exit_code is not None:
+                data["exit_code"] = exit_code
+            if outcome is not None and outcome.get("array"):
+                # 配列タスクは項目ごとの報告の代わりに集計を1回だけ送る
+                data["array"] = outcome["array"]
+            artifact = self.store_artifact(task_file.stem, task_data, output_path, exit_code)
+            if artifact is not None:
+                data["artifact"] = {"hash": artifact["hash"], "size": artifact["size"]}
+            if outcome is not None:
+                data.update(task_type=outcome["task_type"], timings=outcome["timings"])
             self.comm.send_message("manager", f"タスク完了: {task_name}", 
-                                 f"Task '{task_name}' has been completed by {self.worker_name}")
+                                 f"Task '{task_name}' has been completed by {self.worker_name}",
+                                 data=data)
             
         except Exception as e:
             self.comm.log_activity(f"Error completing task: {str(e)}")
     
+    def task_output_path(self, task_data):
+        """タスクの出力ファイル（name のないタスクは種類ごとの既定名）"""
+        task_name = task_data.get('name', f"{self.task_type(task_data)}_task")
+        return os.path.join(self.worker_dir, f"task_{task_name}_output.txt")
+    
+    def store_artifact(self, task_id, task_data, output_path, exit_code=None):
+        """出力ファイルを成果物ストアに保存し、索引のエントリを返す（保存できなければ None）"""
+        if self.artifacts is None or not os.path.exists(output_path):
+            return None
+        try:
+            entry = self.artifacts.store_output(task_id, task_data.get('name'), self.worker_name,
+                                                output_path, exit_code)
+        except OSError as e:
+            self.comm.log_activity(f"Error storing artifact for {task_id}: {e}")
+            return None
+        self.comm.log_activity(
+            f"Stored artifact {entry['hash'][:12]} ({entry['size']} bytes, "
+            f"{entry['stored_bytes']} bytes written)")
+        return entry
+    
     def check_messages(self):
         """メッセージをチェック"""
-        messages = self.comm.read_messages_for_me()
+        # high の指示（停止など）を先に処理
+        messages = sort_messages_by_priority(self.comm.read_messages_for_me())
         for msg in messages:
             self.comm.log_activity(f"Received message from {msg['from']}: {msg['subject']}")
             
             # 特定のメッセージタイプに応じた処理
-            if "停止" in msg['subject'] or "stop" in msg['subject'].lower():
+            if "タスクキャンセル" in msg['subject']:
+                task_id = (msg.get('data') or {}).get('task_id') or msg['message'].strip()
+                self.cancel_task(task_id)
+            elif "停止" in msg['subject'] or "stop" in msg['subject'].lower():
                 self.comm.log_activity("Received stop command from manager")
                 self.running = False
             elif "リトライ" in msg['subject']:
                 self.comm.log_activity("Received retry command from manager")
                 # 失敗したタスクを再処理
                 self.check_pending_tasks()
+            elif "新規タスク" in msg['subject']:
+                # 監視なしでも配布の通知ですぐに取りに行く
+                self.check_pending_tasks()
+            elif "状況確認" in msg['subject'] or "status" in msg['subject'].lower():
+                self.report_status(msg['from'])
+    
+    def cancel_task(self, task_id):
+        """実行中ならプロセスグループごと kill し、未着手なら killed_tasks へ移す"""
+        name = f"{task_id}.json"
+        with self._task_lock:
+            running = name in self.in_flight
+        if running:
+            # 子プロセスの起動前でも、記録が残るので起動直後に止まる
+            killed = self.processes.cancel(task_id)
+            self.comm.log_activity(
+                f"Cancelling running task {task_id}" + ("" if killed else " (no child process running)"))
+            return
+        
+        task_file = Path(self.pending_tasks_dir) / name
+        if task_file.exists():
+            self.kill_task(task_file, TaskKilled("cancelled", "cancelled by manager before it started"),
+                           started=False)
+            self.processes.clear(task_id)
+        else:
+            # 既に終了したか、このワーカーの担当ではない
+            self.comm.log_activity(f"Cancel request for task {task_id} ignored (not pending or running here)")
+            self.processes.clear(task_id)
+    
+    def report_status(self, to):
+        """実行中・待ちのタスクと処理件数を返信"""
+        with self._task_lock:
+            running = sorted(self.in_flight)
+        lines = [f"Running: {', '.join(running) if running else 'none'}",
+                 f"Pending: {len(self.pending_heap)}"]
+        if self.heartbeat is not None:
+            lines.append(f"Done: {self.heartbeat.tasks_done} (failed {self.heartbeat.tasks_failed})")
+        self.comm.send_message(to, f"状況報告: {self.worker_name}", "\n".join(lines))
     
     def run(self):
-        """メインループ"""
+        """メインループ（runtime="async" ではイベントループで実行）"""
+        if self.runtime == "async":
+            asyncio.run(AsyncWorkerRuntime(self).run())
+            self.release_resources()
+            return
+        
         task_check_interval = 30    # 30秒ごとにタスクチェック
         message_check_interval = 20  # 20秒ごとにメッセージチェック
+        metrics_interval = 15        # 15秒ごとにメトリクスファイルを更新
         
         last_task_check = 0
         last_message_check = 0
+        last_metrics_write = 0
         
         self.comm.log_activity(f"Worker {self.worker_name} is now running autonomously")
         
@@ -242,91 +1145,256 @@ class WorkerSessionAutomation:
                 self.check_messages()
                 last_message_check = current_time
             
-            time.sleep(1)
+            # メトリクスファイルの更新
+            if self.metrics_file is not None and current_time - last_metrics_write >= metrics_interval:
+                self.write_metrics()
+                last_metrics_write = current_time
+            
+            if self.watcher is None:
+                # プッシュで届いたメッセージはすぐ処理する
+                if self.comm.wait_for_messages(1):
+                    self.check_messages()
+                    last_message_check = time.time()
+                continue
+            
+            # 変更通知を待つ（次の定期チェックまで）
+            next_check = min(last_task_check + task_check_interval,
+                             last_message_check + message_check_interval)
+            changed = self.watcher.wait(next_check - time.time())
+            if "messages" in changed:
+                self.check_messages()
+                last_message_check = time.time()
+            if "tasks" in changed:
+                self.check_pending_tasks(self.task_files_from_event(changed["tasks"]))
+        
+        self.release_resources()
+    
+    def release_resources(self):
+        """メインループ終了後の後始末（実行中のタスクの終了を待ち、統計を書き出す）"""
+        self.shutdown_executor()
+        if self.script_pool is not None:
+            self.script_pool.close()
+        if self.result_cache is not None:
+            self.comm.log_activity(f"Result cache: {self.result_cache.summary()}")
+            self.result_cache.write_stats(self.worker_name, force=True)
+        if self.heartbeat is not None:
+            self.heartbeat.stop()
+        if self.journal is not None:
+            self.journal.close()
+        self.close_metrics()
+    
+    def write_metrics(self):
+        if self.metrics is not None and self.metrics_file is not None:
+            try:
+                self.metrics.write_file(self.metrics_file)
+            except OSError as e:
+                self.comm.log_activity(f"Error writing metrics: {e}")
+    
+    def close_metrics(self):
+        if self.metrics is not None:
+            self.write_metrics()
+            self.metrics.close()
+    
+    def task_files_from_event(self, paths):
+        """監視イベントのパスをタスクファイルに変換（取りこぼし時は全体を再走査）"""
+        if paths is None:
+            return self.find_task_files()
+        return [Path(p) for p in sorted(paths)]
+    
+    def poll_watcher(self):
+        """待たずに監視イベントを取り込む（逐次実行中のタスクの合間に呼ぶ）"""
+        if self.watcher is None:
+            return
+        changed = self.watcher.wait(0)
+        if "messages" in changed:
+            self.check_messages()
+        if "tasks" in changed:
+            self.enqueue_pending(self.task_files_from_event(changed["tasks"]))
+    
+    def shutdown_executor(self):
+        """実行中のタスクの終了を待ってプールを閉じる（共有のプールは WorkerSupervisor が閉じる）"""
+        if self.shared is not None:
+            self.executor = None
+        elif self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            self.executor = None
     
     def stop(self):
         """自動化を停止"""
         self.running = False
+        self.shutdown_executor()
+        if self.script_pool is not None:
+            self.script_pool.close()
+        if self.queue is not None:
+            self.queue.stop_heartbeat()
+        if self.result_cache is not None:
+            self.comm.log_activity(f"Result cache: {self.result_cache.summary()}")
+            self.result_cache.write_stats(self.worker_name, force=True)
+        if self.heartbeat is not None:
+            self.heartbeat.stop()
+        if self.journal is not None:
+            self.journal.close()
+        self.close_metrics()
+        if self.watcher is not None:
+            self.watcher.close()
         self.comm.log_activity(f"Worker {self.worker_name} automation stopped")
+        self.comm.flush()
+        self.comm.close()
+
+def _process_task_in_child(worker_name, task_file, claimed_at=None, result_cache=False,
+                           cache_max_mb=256, log_formats=("text",), transport="socket",
+                           artifact_store=True, journal=True):
+    """プロセスプール内でタスクを1件処理し、結果（キャッシュのヒット・ミス数を含む）を返す"""
+    worker = WorkerSessionAutomation(worker_name, result_cache=result_cache,
+                                     cache_max_mb=cache_max_mb, log_formats=log_formats,
+                                     transport=transport, artifact_store=artifact_store,
+                                     announce=False, journal=journal)
+    outcome = worker.process_task(Path(task_file), claimed_at)
+    # プールの子プロセスは atexit を実行せずに終了するため、ここで書き出しておく
+    worker.comm.flush()
+    worker.comm.close()
+    if worker.journal is not None:
+        worker.journal.close()
+    if worker.result_cache is not None:
+        outcome["cache_counts"] = (worker.result_cache.hits, worker.result_cache.misses)
+    return outcome
+
+# ログの task_id（スレッドごと・asyncio のタスクごとに独立）
+_current_task = contextvars.ContextVar("current_task", default=None)
 
 # WorkerCommunicationクラス
 class WorkerCommunication:
-    def __init__(self, worker_name: str):
+    def __init__(self, worker_name: str, log_formats=("text",), transport="socket", shared=None):
         self.worker_name = worker_name
-        self.messages_file = "communication/messages.json"
-        self.ensure_communication_dir()
+        if shared is not None:
+            # 同じプロセスのワーカーとストア・ブローカーへの接続を共有する
+            self.store = shared.store
+            self.transport = shared.transport_for(worker_name)
+        else:
+            self.store = MessageStore("communication")
+            # socket: ブローカー経由で即座に配送（ブローカー不在時はストアへ直接）、file: ストアのみ
+            self.transport = create_transport(transport, worker_name, self.store)
+        self.heartbeat = None
+        # ログは専用スレッドがまとめて書き出す（<worker>/<worker>_log.txt / .jsonl）
+        self.logger = get_activity_logger(f"{worker_name}/{worker_name}_log", worker_name,
+                                          formats=log_formats, echo_prefix=worker_name.upper())
     
-    def ensure_communication_dir(self):
-        os.makedirs("communication", exist_ok=True)
-        if not os.path.exists(self.messages_file):
-            with open(self.messages_file, 'w') as f:
-                json.dump([], f)
-    
-    def send_message(self, to: str, subject: str, message: str, priority: str = "medium"):
+    def send_message(self, to: str, subject: str, message: str, priority: str = "medium", data=None):
         msg = {
             "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
             "from": self.worker_name,
             "to": to,
             "subject": subject,
             "message": message,
-            "priority": priority,
-            "read": False
+            "priority": priority
         }
+        if data is not None:
+            # 機械処理用の付加情報（タスクの種類・各段階の時刻など）
+            msg["data"] = data
+        # 再送時の重複除去に使う
+        msg["id"] = new_message_id()
         
-        messages = self.read_all_messages()
-        messages.append(msg)
-        self.write_messages(messages)
+        self.transport.send(msg)
         print(f"[{self.worker_name}] Message sent to {to}: {subject}")
     
     def read_messages_for_me(self):
-        messages = self.read_all_messages()
-        my_messages = [msg for msg in messages if msg["to"] == self.worker_name and not msg.get("read", True)]
-        
-        for msg in messages:
-            if msg["to"] == self.worker_name:
-                msg["read"] = True
-        self.write_messages(messages)
-        
-        return my_messages
+        # プッシュで届いた分（file 転送・ブローカー不在時は既読位置から先）だけを読む
+        return self.transport.receive()
+    
+    def subscribe(self):
+        """プッシュ配送の受け取りを開始（ブローカーに接続できたら True）"""
+        return self.transport.subscribe()
+    
+    def wait_for_messages(self, timeout):
+        """メッセージが届くまで最大 timeout 秒待つ（届いたら True）"""
+        return self.transport.wait(timeout)
     
     def read_all_messages(self):
-        try:
-            with open(self.messages_file, 'r') as f:
-                return json.load(f)
-        except:
-            return []
+        return list(self.store.iter_all())
     
-    def write_messages(self, messages):
-        with open(self.messages_file, 'w') as f:
-            json.dump(messages, f, indent=2)
+    def set_current_task(self, task_id):
+        """このスレッド（asyncio ではこのタスク）で処理中のタスクID（ログの task_id に使う）"""
+        _current_task.set(task_id)
     
-    def log_activity(self, activity: str, progress=None):
-        log_file = f"{self.worker_name}/{self.worker_name}_log.txt"
-        
-        # ログファイルのディレクトリを確保
-        os.makedirs(os.path.dirname(log_file), exist_ok=True)
-        
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        log_entry = f"[{timestamp}] {activity}"
-        if progress is not None:
-            log_entry += f" (Progress: {progress}%)"
-        
-        with open(log_file, 'a') as f:
-            f.write(log_entry + "\n")
-        
-        print(f"[{self.worker_name.upper()}] {log_entry}")
+    def current_task(self):
+        return _current_task.get()
+    
+    def log_activity(self, activity: str, progress=None, event="activity", task_id=None):
+        if task_id is None:
+            task_id = _current_task.get()
+        if progress is not None and self.heartbeat is not None:
+            self.heartbeat.set_progress(progress)
+        self.logger.log(activity, progress, event, task_id)
+    
+    def flush(self):
+        self.logger.flush()
+    
+    def close(self):
+        self.transport.close()
 
 # メイン実行
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: python worker_session_automation.py <worker_name>")
-        print("Example: python worker_session_automation.py worker1")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(
+        description="Worker session automation",
+        epilog="Example: python worker_session_automation.py worker1 --watch auto")
+    parser.add_argument("worker_name")
+    parser.add_argument("--max-parallel", type=int, default=1,
+                        help="同時に実行するタスク数（0 = CPUコア数、既定: 1 = 逐次実行。--runtime async ではイベントループ上の同時実行数）")
+    parser.add_argument("--executor", choices=["thread", "process"], default="thread",
+                        help="並列実行に使うプールの種類")
+    parser.add_argument("--stream-output", action="store_true",
+                        help="タスク出力をメモリに溜めずファイルへ逐次書き出し、進捗をログに記録")
+    parser.add_argument("--script-pool", type=int, default=0,
+                        help="script タスク用に待機させておくインタプリタ数（既定: 0 = 毎回 python を起動）")
+    parser.add_argument("--preload", default=None,
+                        help="インタプリタプールで事前に import するモジュール（カンマ区切り）")
+    parser.add_argument("--result-cache", action="store_true",
+                        help="command / script の結果を cache/results に保存し、同じ入力なら再実行しない")
+    parser.add_argument("--cache-max-mb", type=int, default=256,
+                        help="結果キャッシュのディスク上限（MB、超えたら古く使われた順に削除）")
+    parser.add_argument("--log-format", default="text",
+                        help="ログの出力形式（カンマ区切り: text = [WORKER]_log.txt, jsonl = [WORKER]_log.jsonl）")
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="Prometheus テキスト形式のメトリクスを http://127.0.0.1:PORT/metrics で公開")
+    parser.add_argument("--metrics-file", default=None,
+                        help="メトリクスを定期的に書き出すファイル（例: metrics/worker1.prom）")
+    parser.add_argument("--runtime", choices=RUNTIMES, default="sync",
+                        help="メインループの方式（async = asyncio のイベントループでメッセージ処理とタスク実行を並行）")
+    parser.add_argument("--transport", choices=TRANSPORTS, default="socket",
+                        help="メッセージの転送方式（socket = ブローカー経由で即時配送、file = メッセージストアのみ）")
+    parser.add_argument("--shared-queue", action="store_true",
+                        help="task_queue/ready の共有キューからリースでタスクを取得")
+    parser.add_argument("--steal", action="store_true",
+                        help="アイドル時に --shared-queue で動く他ワーカーの pending_tasks から奪う（--shared-queue と併用）")
+    parser.add_argument("--watch", choices=["auto", "inotify", "poll", "none"], default="none",
+                        help="タスク・メッセージの変更監視バックエンド（既定: none = 定期チェックのみ）")
+    parser.add_argument("--no-artifacts", action="store_true",
+                        help="完了したタスクの出力を成果物ストア（artifacts/）に保存しない")
+    parser.add_argument("--no-journal", action="store_true",
+                        help="タスクの状態をジャーナル（communication/journal/）に記録しない（落ちたら中断したタスクを最初からやり直す）")
+    args = parser.parse_args()
     
-    worker_name = sys.argv[1]
+    worker_name = args.worker_name
     
     try:
-        worker = WorkerSessionAutomation(worker_name)
+        worker = WorkerSessionAutomation(worker_name,
+                                         watch=None if args.watch == "none" else args.watch,
+                                         max_parallel_tasks=args.max_parallel,
+                                         executor=args.executor,
+                                         stream_output=args.stream_output,
+                                         use_queue=args.shared_queue,
+                                         steal=args.steal,
+                                         script_pool_size=args.script_pool,
+                                         preload_modules=args.preload.split(",") if args.preload else None,
+                                         result_cache=args.result_cache,
+                                         cache_max_mb=args.cache_max_mb,
+                                         log_formats=args.log_format.split(","),
+                                         metrics_port=args.metrics_port,
+                                         metrics_file=args.metrics_file,
+                                         transport=args.transport,
+                                         runtime=args.runtime,
+                                         artifact_store=not args.no_artifacts,
+                                         journal=not args.no_journal)
         worker.run()
     except KeyboardInterrupt:
         print(f"\n{worker_name} automation stopped by user")
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+import argparse
+import os
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from artifact_store import ArtifactStore
+from message_bus import TRANSPORTS, SharedSocketTransport, create_transport
+from message_store import MessageStore
+from task_watcher import create_watcher
+from work_queue import WorkQueue
+from worker_session_automation import WorkerSessionAutomation
+
+
+class WorkerSupervisor:
+    """1つのプロセスで複数の WorkerSessionAutomation を動かす
+    
+    ワーカーごとにプロセスを起動する代わりに、メッセージストア・ブローカーへの接続（1本で全員を購読）・
+    変更監視・タスク実行のスレッドプール・共有キュー・成果物ストアを全ワーカーで共有する。
+    監視ループとハートビートの更新もそれぞれ1本のスレッドで全ワーカー分を処理するので、
+    数十のワーカーでもインタプリタ1つ分のメモリで済み、起動はミリ秒単位で終わる。
+    各ワーカーの名前・pending_tasks・ログ・ハートビートは従来どおりなので、Managerからは区別できない。
+    """
+    
+    def __init__(self, worker_names, pool_size=None, max_parallel_tasks=1, watch="auto",
+                 transport="socket", use_queue=False, heartbeat_interval=1.0, **worker_options):
+        self.running = True
+        self.instructions_file = "worker_session_instructions.md"
+        self.heartbeat_interval = heartbeat_interval
+        
+        # 全ワーカーで共有する資源（WorkerSessionAutomation の shared から参照される）
+        self.store = MessageStore("communication")
+        self.transport = SharedSocketTransport(self.store) if transport == "socket" else None
+        self.queue = WorkQueue() if use_queue else None
+        self.artifacts = ArtifactStore() if worker_options.get("artifact_store", True) else None
+        pool_size = pool_size or len(worker_names) * max_parallel_tasks
+        self.executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="supervised-task")
+        
+        started = time.time()
+        self.read_instructions()
+        self.workers = {}
+        for name in worker_names:
+            self.workers[name] = WorkerSessionAutomation(name, max_parallel_tasks=max_parallel_tasks,
+                                                         transport=transport, use_queue=use_queue,
+                                                         shared=self, **worker_options)
+        self.watcher = self.create_watcher(watch) if watch else None
+        
+        self._stop_beat = threading.Event()
+        self._beat_thread = threading.Thread(target=self._beat, name="supervisor-heartbeat", daemon=True)
+        self._beat_thread.start()
+        self.log(f"Started {len(self.workers)} workers in {(time.time() - started) * 1000:.0f} ms "
+                 f"(pid {os.getpid()}, {pool_size} task threads, "
+                 f"{'subscribed to message bus' if self.connected else transport + ' transport'})")
+    
+    def log(self, message):
+        print(f"[SUPERVISOR] {message}")
+    
+    @property
+    def connected(self):
+        return self.transport is not None and self.transport.connected
+    
+    def read_instructions(self):
+        """指示書は全ワーカー共通なので1回だけ読む"""
+        try:
+            with open(self.instructions_file, 'r') as f:
+                instructions = f.read()
+            self.log(f"Instructions loaded ({len(instructions)} chars)")
+        except Exception as e:
+            self.log(f"Error reading instructions: {str(e)}")
+    
+    def transport_for(self, worker_name):
+        """ワーカーのメッセージ転送（socket: 共有接続のチャネル、file: 共有ストアへの直接読み書き）"""
+        if self.transport is None:
+            return create_transport("file", worker_name, self.store)
+        return self.transport.channel(worker_name)
+    
+    def create_watcher(self, backend):
+        """全ワーカーの pending_tasks・共有キュー・メッセージストアを1つの監視にまとめる"""
+        watcher = create_watcher(backend)
+        for name, worker in self.workers.items():
+            watcher.add(worker.pending_tasks_dir, f"tasks:{name}", suffix=".json")
+        if self.queue is not None:
+            watcher.add(self.queue.ready_dir, "queue", suffix=".json")
+        watcher.add(self.store.segments_dir, "store")
+        if self.transport is not None:
+            watcher.add_fd(self.transport.fileno(), "messages")
+        self.log(f"Watching for tasks and messages with {type(watcher).__name__}")
+        return watcher
+    
+    def _beat(self):
+        """全ワーカーのハートビートと共有キューのリースを1本のスレッドで更新"""
+        lease_interval = max(self.queue.lease_ttl / 3, 1) if self.queue is not None else None
+        last_lease = time.time()
+        while not self._stop_beat.wait(self.heartbeat_interval):
+            workers = list(self.workers.values())
+            for worker in workers:
+                worker.heartbeat.write()
+            if lease_interval is not None and time.time() - last_lease >= lease_interval:
+                for worker in workers:
+                    for name in list(worker.in_flight):
+                        self.queue.heartbeat(worker.worker_name, name)
+                last_lease = time.time()
+    
+    # ---- 監視ループ ----
+    
+    def active_workers(self):
+        return [worker for worker in self.workers.values() if worker.running]
+    
+    def check_pending_tasks(self):
+        for worker in self.active_workers():
+            worker.check_pending_tasks()
+    
+    def check_messages(self, workers=None):
+        for worker in workers if workers is not None else self.active_workers():
+            worker.check_messages()
+    
+    def deliver_messages(self):
+        """プッシュで届いたメッセージを、届いたワーカーにだけ処理させる"""
+        self.transport.drain()
+        if not self.transport.ensure_subscribed():
+            # 切断中は各ワーカーがストアを直接読む
+            self.check_messages()
+            return
+        self.check_messages([worker for worker in self.active_workers()
+                             if worker.comm.transport.has_messages()])
+    
+    def handle_changes(self, changed):
+        if "messages" in changed:
+            self.deliver_messages()
+        if "store" in changed and (self.transport is None or not self.transport.ensure_subscribed()):
+            self.check_messages()
+        for tag, paths in changed.items():
+            if tag.startswith("tasks:"):
+                worker = self.workers.get(tag[len("tasks:"):])
+                if worker is not None and worker.running:
+                    worker.check_pending_tasks(worker.task_files_from_event(paths))
+        if "queue" in changed:
+            # 空きのあるワーカーが順に取りに行く（リースを取れたワーカーだけが実行する）
+            paths = changed["queue"]
+            for worker in self.active_workers():
+                if len(worker.in_flight) < worker.max_parallel_tasks:
+                    worker.check_pending_tasks(worker.task_files_from_event(paths))
+    
+    def wait(self, timeout):
+        if self.watcher is not None:
+            return self.watcher.wait(timeout)
+        if self.transport is not None:
+            return {"messages": set()} if self.transport.wait(timeout) else {}
+        time.sleep(max(timeout, 0))
+        return {}
+    
+    def retire_stopped(self):
+        """停止の指示を受け、実行中のタスクも終えたワーカーを外す"""
+        for name, worker in list(self.workers.items()):
+            if worker.running or worker.in_flight:
+                continue
+            del self.workers[name]
+            worker.stop()
+            self.log(f"{name} stopped ({len(self.workers)} workers left)")
+    
+    def run(self):
+        task_check_interval = 30    # 30秒ごとにタスクチェック
+        message_check_interval = 20  # 20秒ごとにメッセージチェック
+        retire_check_interval = 1    # 停止したワーカーの片付け
+        
+        last_task_check = 0
+        last_message_check = 0
+        
+        while self.running and self.workers:
+            current_time = time.time()
+            
+            if current_time - last_task_check >= task_check_interval:
+                self.check_pending_tasks()
+                last_task_check = current_time
+            
+            if current_time - last_message_check >= message_check_interval:
+                self.check_messages()
+                last_message_check = current_time
+            
+            self.retire_stopped()
+            
+            next_check = min(last_task_check + task_check_interval,
+                             last_message_check + message_check_interval,
+                             time.time() + retire_check_interval)
+            self.handle_changes(self.wait(next_check - time.time()))
+        
+        self.stop()
+    
+    def stop(self):
+        """全ワーカーを止める（実行中のタスクの終了を待つ）"""
+        if self.executor is None:
+            return
+        self.running = False
+        for worker in self.workers.values():
+            worker.running = False
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        self.executor = None
+        for worker in self.workers.values():
+            worker.stop()
+        self.workers = {}
+        self._stop_beat.set()
+        if self.watcher is not None:
+            self.watcher.close()
+        if self.transport is not None:
+            self.transport.close()
+        self.log("All workers stopped")
+
+
+def worker_names(args):
+    if args.worker_names:
+        return args.worker_names
+    return [f"{args.prefix}{i}" for i in range(1, args.workers + 1)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run many workers in a single process",
+        epilog="Example: python worker_supervisor.py --workers 20 --shared-queue")
+    parser.add_argument("worker_names", nargs="*",
+                        help="動かすワーカー名（省略時は --workers の数だけ <prefix>1, <prefix>2, ...）")
+    parser.add_argument("--workers", type=int, default=3,
+                        help="ワーカー名を省略したときのワーカー数")
+    parser.add_argument("--prefix", default="worker",
+                        help="ワーカー名を省略したときの名前の接頭辞")
+    parser.add_argument("--max-parallel", type=int, default=1,
+                        help="ワーカーごとの同時実行数（既定: 1 = 逐次実行）")
+    parser.add_argument("--pool-size", type=int, default=None,
+                        help="全ワーカーで共有するタスク実行スレッド数（既定: ワーカー数 × --max-parallel）")
+    parser.add_argument("--stream-output", action="store_true",
+                        help="タスク出力をメモリに溜めずファイルへ逐次書き出し、進捗をログに記録")
+    parser.add_argument("--result-cache", action="store_true",
+                        help="command / script の結果を cache/results に保存し、同じ入力なら再実行しない")
+    parser.add_argument("--cache-max-mb", type=int, default=256,
+                        help="結果キャッシュのディスク上限（MB、超えたら古く使われた順に削除）")
+    parser.add_argument("--log-format", default="text",
+                        help="ログの出力形式（カンマ区切り: text = [WORKER]_log.txt, jsonl = [WORKER]_log.jsonl）")
+    parser.add_argument("--transport", choices=TRANSPORTS, default="socket",
+                        help="メッセージの転送方式（socket = ブローカーへの1本の接続で全ワーカーを購読、file = メッセージストアのみ）")
+    parser.add_argument("--shared-queue", action="store_true",
+                        help="task_queue/ready の共有キューからリースでタスクを取得")
+    parser.add_argument("--steal", action="store_true",
+                        help="アイドル時に --shared-queue で動く他ワーカーの pending_tasks から奪う（--shared-queue と併用）")
+    parser.add_argument("--watch", choices=["auto", "inotify", "poll", "none"], default="auto",
+                        help="タスク・メッセージの変更監視バックエンド（全ワーカーで1つ）")
+    parser.add_argument("--no-artifacts", action="store_true",
+                        help="完了したタスクの出力を成果物ストア（artifacts/）に保存しない")
+    parser.add_argument("--no-journal", action="store_true",
+                        help="タスクの状態をジャーナル（communication/journal/）に記録しない")
+    args = parser.parse_args()
+    
+    # SIGTERM でも Ctrl+C と同じく実行中のタスクを待って止める
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    
+    supervisor = None
+    try:
+        supervisor = WorkerSupervisor(worker_names(args),
+                                      pool_size=args.pool_size,
+                                      max_parallel_tasks=args.max_parallel,
+                                      watch=None if args.watch == "none" else args.watch,
+                                      transport=args.transport,
+                                      use_queue=args.shared_queue,
+                                      steal=args.steal,
+                                      stream_output=args.stream_output,
+                                      result_cache=args.result_cache,
+                                      cache_max_mb=args.cache_max_mb,
+                                      log_formats=args.log_format.split(","),
+                                      artifact_store=not args.no_artifacts,
+                                      journal=not args.no_journal)
+        supervisor.run()
+    except KeyboardInterrupt:
+        print("\nWorker supervisor stopped by user")
+        if supervisor is not None:
+            supervisor.stop()